@@ -8,11 +8,13 @@ except ImportError:
     # For Python 2.x
     from urllib2 import urlopen
 import subprocess
-from time import sleep
+from time import sleep, monotonic, time
 import signal
 import json
+import os
 import re
 import http
+import threading
 
 def get_command_msg(id):
     return "_GPHD_:%u:%u:%d:%1lf\n" % (0, 0, 2, 0)
@@ -29,9 +31,136 @@ SAVE = False
 SAVE_FILENAME = "goprofeed3"
 SAVE_FORMAT = "ts"
 SAVE_LOCATION = "/tmp/"
+## Saved feed is split into segments of this many seconds; only the newest
+## SAVE_SEGMENT_WRAP segments are kept, bounding disk use (0 keeps them all)
+SAVE_SEGMENT_SECONDS = 60
+SAVE_SEGMENT_WRAP = 30
+## Shows the feed in ffplay; can be combined with STREAM and SAVE
+PREVIEW = True
+PREVIEW_PORT = 10001
 ## for wake_on_lan
 GOPRO_IP = '10.5.5.9'
 GOPRO_MAC = 'DEADBEEF0000'
+## Status polling interval bounds (seconds) while waiting for the camera to connect
+STATUS_POLL_MIN = 0.1
+STATUS_POLL_MAX = 1.0
+## The ingest ffmpeg gives up after STALL_MS without packets; it is then restarted
+## (after a gpStream restart) at most once every RESTART_BACKOFF seconds, while
+## ffplay keeps listening on PREVIEW_PORT so the preview window stays open
+STALL_MS = 1000
+RESTART_BACKOFF = 2.0
+## Warn when the ingest ffmpeg runs slower than this fraction of real time
+SLOW_SPEED = 0.95
+
+## ffmpeg/ffplay children, stopped by reap_children() on exit or Ctrl+C
+CHILDREN = []
+
+def spawn(args, progress=False):
+    """Start an ffmpeg/ffplay argument list (no shell); with progress, report ffmpeg's -progress"""
+    if progress:
+        args = args[:1] + ["-progress", "pipe:1", "-nostats"] + args[1:]
+    if args[0] == "ffmpeg":
+        args = args[:1] + ["-nostdin"] + args[1:]
+    process = subprocess.Popen(args, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE if progress else None)
+    CHILDREN[:] = [child for child in CHILDREN if child.poll() is None] + [process]
+    if progress:
+        threading.Thread(target=watch_progress, args=(process,), daemon=True).start()
+    return process
+
+def watch_progress(process):
+    """Read ffmpeg's key=value progress blocks; print them when VERBOSE, warn when falling behind"""
+    block = {}
+    for line in iter(process.stdout.readline, b""):
+        key, _, value = line.decode(errors="replace").strip().partition("=")
+        if key != "progress":
+            block[key] = value
+            continue
+        try:
+            speed = float(block.get("speed", "").rstrip("x"))
+        except ValueError:
+            speed = None
+        summary = "fps=%s bitrate=%s speed=%s drop=%s dup=%s" % (
+            block.get("fps"), block.get("bitrate"), block.get("speed"),
+            block.get("drop_frames"), block.get("dup_frames"))
+        if VERBOSE:
+            print("ffmpeg progress:", summary)
+        elif speed is not None and speed < SLOW_SPEED:
+            print("ffmpeg is not keeping up with the stream:", summary)
+        block = {}
+    process.stdout.close()
+
+def next_segment_number(since):
+    """Number for the next saved segment: one past the newest segment written since `since` (a time())"""
+    pattern = re.compile(re.escape(SAVE_FILENAME) + r"_(\d+)\." + re.escape(SAVE_FORMAT) + "$")
+    newest = None
+    try:
+        names = os.listdir(SAVE_LOCATION)
+    except OSError:
+        return 0
+    for name in names:
+        match = pattern.match(name)
+        if not match:
+            continue
+        try:
+            mtime = os.path.getmtime(os.path.join(SAVE_LOCATION, name))
+        except OSError:
+            continue
+        if mtime >= since and (newest is None or (mtime, int(match.group(1))) > newest):
+            newest = (mtime, int(match.group(1)))
+    if newest is None:
+        return 0
+    number = newest[1] + 1
+    return number % SAVE_SEGMENT_WRAP if SAVE_SEGMENT_WRAP else number
+
+def reap_children(timeout=2.0):
+    for child in CHILDREN:
+        if child.poll() is None:
+            child.terminate()
+    for child in CHILDREN:
+        try:
+            child.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            child.kill()
+            child.wait()
+    del CHILDREN[:]
+
+
+## Camera model and firmware are cached here, so launches skip the gp/gpControl
+## fetch; entries older than INFO_CACHE_MAX_AGE seconds are fetched again
+INFO_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "gopro-controller", "camera_info.json")
+INFO_CACHE_MAX_AGE = 24 * 3600
+
+def camera_info(ip):
+    """(model, firmware) of the camera, from the cache when fresh"""
+    cache = {}
+    try:
+        with open(INFO_CACHE) as f:
+            cache = json.load(f)
+        cached = cache[ip]
+        if time() - cached["fetched_at"] < INFO_CACHE_MAX_AGE:
+            return cached["model"], cached["firmware"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    try:
+        # gp/gpControl/info is the small identity part of the full gp/gpControl schema
+        try:
+            info = json.loads(urlopen('http://%s/gp/gpControl/info' % ip, timeout=5).read().decode('utf-8'))["info"]
+        except (IOError, ValueError, KeyError):
+            info = json.loads(urlopen('http://%s/gp/gpControl' % ip, timeout=5).read().decode('utf-8'))["info"]
+        model = info["model_name"]
+        firmware = info["firmware_version"]
+    except http.client.BadStatusLine:
+        # Older cameras only answer the legacy API, which reports the firmware alone
+        model, firmware = "", urlopen('http://%s/camera/cv' % ip, timeout=5).read().decode('utf-8')
+    cache[ip] = {"model": model, "firmware": firmware, "fetched_at": time()}
+    try:
+        os.makedirs(os.path.dirname(INFO_CACHE), exist_ok=True)
+        with open(INFO_CACHE, "w") as f:
+            json.dump(cache, f)
+    except OSError:
+        pass
+    return model, firmware
 
 def gopro_live():
     # Use a separate variable for the control IP (always 10.5.5.9)
@@ -43,15 +172,7 @@ def gopro_live():
     MESSAGE = get_command_msg(KEEP_ALIVE_CMD)
     URL = "http://10.5.5.9:8080/live/amba.m3u8"
 
-    try:
-        # Fetch camera control info
-        response_raw = urlopen('http://10.5.5.9/gp/gpControl').read().decode('utf-8')
-        jsondata = json.loads(response_raw)
-        firmware = jsondata["info"]["firmware_version"]
-        model = jsondata["info"]["model_name"]
-    except http.client.BadStatusLine:
-        firmware = urlopen('http://10.5.5.9/camera/cv').read().decode('utf-8')
-        model = ""
+    model, firmware = camera_info(CONTROL_IP)
     
     # Determine streaming IP based on camera model.
     # For many session cameras (including HERO4 Session and HERO5 Session) the stream is on 10.5.5.100;
@@ -79,56 +200,122 @@ def gopro_live():
         print("Recording on camera: " + str(RECORD))
 
         # HERO4 Session (and similar) need a status check before the live feed starts.
+        # Poll quickly at first and back off, instead of hammering the camera in a tight loop.
         if "HX" in firmware:
             connectedStatus = False
+            poll_interval = STATUS_POLL_MIN
             while not connectedStatus:
-                req = urlopen("http://10.5.5.9/gp/gpControl/status")
+                req = urlopen("http://10.5.5.9/gp/gpControl/status", timeout=5)
                 data = req.read()
                 encoding = req.info().get_content_charset('utf-8')
                 json_status = json.loads(data.decode(encoding))
                 if json_status["status"]["31"] >= 1:
                     connectedStatus = True
+                else:
+                    sleep(poll_interval)
+                    poll_interval = min(poll_interval * 1.5, STATUS_POLL_MAX)
 
         # Reduced latency settings:
         #   - Use low_delay flag and disable additional delay with -max_delay 0
         #   - Reduce probe size to 32 (from 8192)
-        #   - Append UDP URL options to reduce buffering: ?fifo_size=0&overrun_nonfatal=1
-        latency_options = "-flags low_delay -max_delay 0 -probesize 32"
-        udp_options = "?fifo_size=0"
-        loglevel_verbose = ""
-        if not VERBOSE:
-            loglevel_verbose = "-loglevel panic"
-        if not SAVE:
-            if STREAM:
-                # Using ffmpeg to restream locally (e.g. to udp://localhost:10000)
-                subprocess.Popen("ffmpeg " + loglevel_verbose +
-                                 " -fflags nobuffer " + latency_options +
-                                 " -f:v mpegts -i udp://"+ stream_ip +":8554" + udp_options +
-                                 " -f mpegts -vcodec copy udp://localhost:10000", shell=True)
-            else:
-                # Direct preview via ffplay with low-latency options
-                subprocess.Popen("ffplay " + loglevel_verbose +
-                                 " -fflags nobuffer " + latency_options +
-                                 " -f:v mpegts -i udp://"+ stream_ip +":8554" + udp_options, shell=True)
-        else:
-            if SAVE_FORMAT == "ts":
-                TS_PARAMS = " -acodec copy -vcodec copy "
-            else:
-                TS_PARAMS = ""
-            save_location_full = SAVE_LOCATION + SAVE_FILENAME + "." + SAVE_FORMAT
+        #   - Keep a small UDP receive FIFO (in 188-byte units, ~0.5 s at 8 Mbps) so late
+        #     datagrams aren't dropped by the socket, without letting latency pile up
+        #   - discardcorrupt drops packets with continuity errors instead of decoding garbage
+        latency_options = ["-fflags", "nobuffer+discardcorrupt",
+                           "-flags", "low_delay", "-max_delay", "0", "-probesize", "32"]
+        udp_options = "?fifo_size=2800&overrun_nonfatal=1"
+        loglevel = [] if VERBOSE else ["-loglevel", "error"]
+        # One ffmpeg ingest fans out to every enabled output through the tee muxer, so
+        # saving, restreaming and previewing can run together without pulling the UDP
+        # feed more than once. onfail=ignore keeps a failing output from stopping the rest.
+        outputs = []
+        save_output = None
+        session_start = time()
+        if SAVE:
+            save_location_full = SAVE_LOCATION + SAVE_FILENAME + "_%03d." + SAVE_FORMAT
             print("Recording locally: " + str(SAVE))
             print("Recording stored in: " + save_location_full)
-            print("Note: Preview is not available when saving the stream.")
-            subprocess.Popen('ffmpeg -i "udp://'+ stream_ip +':8554' + udp_options + '" -fflags nobuffer ' +
-                             latency_options + " -f:v mpegts " +
-                             TS_PARAMS + save_location_full, shell=True)
+            save_muxer = "mpegts" if SAVE_FORMAT == "ts" else SAVE_FORMAT
+            # The segment muxer cuts at keyframes and reuses file numbers after
+            # SAVE_SEGMENT_WRAP segments, so a long session can't fill the disk
+            segment_options = ":segment_time=" + str(SAVE_SEGMENT_SECONDS)
+            if SAVE_SEGMENT_WRAP:
+                segment_options += ":segment_wrap=" + str(SAVE_SEGMENT_WRAP)
+            save_output = len(outputs)
+            outputs.append("[f=segment:segment_format=" + save_muxer + segment_options +
+                           ":onfail=ignore]" + save_location_full)
+        if STREAM:
+            # Restream locally (e.g. to udp://localhost:10000)
+            outputs.append("[f=mpegts:onfail=ignore]udp://localhost:10000")
+        if PREVIEW and outputs:
+            outputs.append("[f=mpegts:onfail=ignore]udp://127.0.0.1:" + str(PREVIEW_PORT))
+
+        # The ingest is restarted whenever it exits; a direct ffplay preview only when
+        # it fails, since closing its window also ends it
+        ingest_cmd = None
+        restart_on_clean_exit = True
+        if outputs:
+            # udp timeout is in microseconds; ffmpeg ends instead of hanging on a stalled feed
+            ingest_cmd = (["ffmpeg"] + loglevel + latency_options +
+                          ["-f:v", "mpegts",
+                           "-i", "udp://" + stream_ip + ":8554" + udp_options + "&timeout=" + str(STALL_MS * 1000),
+                           "-map", "0", "-c", "copy", "-f", "tee", "|".join(outputs)])
+            if PREVIEW:
+                spawn(["ffplay"] + loglevel + latency_options +
+                      ["-f:v", "mpegts", "-i", "udp://127.0.0.1:" + str(PREVIEW_PORT) + udp_options])
+        elif PREVIEW:
+            # Direct preview via ffplay with low-latency options
+            ingest_cmd = (["ffplay"] + loglevel + latency_options +
+                          ["-f:v", "mpegts", "-i", "udp://" + stream_ip + ":8554" + udp_options])
+            restart_on_clean_exit = False
+        progress = ingest_cmd is not None and ingest_cmd[0] == "ffmpeg"
+        ingest = spawn(ingest_cmd, progress) if ingest_cmd else None
         if sys.version_info.major >= 3:
             MESSAGE = bytes(MESSAGE, "utf-8")
         print("Press ctrl+C to quit this application.\n")
+        # One socket for the whole session; deadlines are start + n * period so the
+        # keep-alive doesn't drift by the time spent sending.
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        period = KEEP_ALIVE_PERIOD / 1000
+        next_send = monotonic()
+        last_restart = 0.0
+        stalled_at = None
         while True:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.sendto(MESSAGE, (CONTROL_IP, UDP_PORT))
-            sleep(KEEP_ALIVE_PERIOD/1000)
+            now = monotonic()
+            if now >= next_send:
+                sock.sendto(MESSAGE, (CONTROL_IP, UDP_PORT))
+                next_send += period
+                if next_send < now:
+                    # Fell behind (e.g. the host was suspended): resynchronise rather than burst
+                    next_send = now + period
+            if ingest is not None and ingest.poll() is not None:
+                if ingest.returncode == 0 and not restart_on_clean_exit:
+                    ingest = None
+                elif now - last_restart >= RESTART_BACKOFF:
+                    if stalled_at is None:
+                        # ffmpeg gave up STALL_MS after the last packet
+                        stalled_at = now - STALL_MS / 1000
+                    print("Stream stalled, restarting (ffmpeg exited with %d)" % ingest.returncode)
+                    # Cheapest first: a keep-alive right away, then ask the camera to restart the stream
+                    sock.sendto(MESSAGE, (CONTROL_IP, UDP_PORT))
+                    try:
+                        urlopen("http://10.5.5.9/gp/gpControl/execute?p1=gpStream&a1=proto_v2&c1=restart",
+                                timeout=5).read()
+                    except IOError as e:
+                        print("gpStream restart failed:", e)
+                    if save_output is not None:
+                        # Carry on the segment numbering instead of overwriting this session's files
+                        outputs[save_output] = ("[f=segment:segment_format=" + save_muxer + segment_options +
+                                                ":segment_start_number=" + str(next_segment_number(session_start)) +
+                                                ":onfail=ignore]" + save_location_full)
+                        ingest_cmd[-1] = "|".join(outputs)
+                    ingest = spawn(ingest_cmd, progress)
+                    last_restart = monotonic()
+            elif stalled_at is not None and monotonic() - last_restart > STALL_MS / 1000 + 0.5:
+                # The restarted ingest outlived its stall timeout, so packets are flowing again
+                print("Stream recovered; ingest restarted %.1fs after the stall" % (last_restart - stalled_at))
+                stalled_at = None
+            sleep(min(0.1, max(0.0, next_send - monotonic())))
     else:
         print("branch hero3:", firmware)
         if "Hero3" in firmware or "HERO3+" in firmware:
@@ -138,9 +325,10 @@ def gopro_live():
             Password = str(PASSWORD, 'utf-8')
             text = re.sub(r'\W+', '', Password)
             urlopen("http://10.5.5.9/camera/PV?t=" + text + "&p=%02")
-            subprocess.Popen("ffplay " + URL, shell=True)
+            spawn(["ffplay", URL])
 
 def quit_gopro(signal, frame):
+    reap_children()
     if RECORD:
         urlopen("http://10.5.5.9/gp/gpControl/command/shutter?p=0").read()
     sys.exit(0)
@@ -0,0 +1,273 @@
+import asyncio
+import json
+import time
+from typing import Dict, Iterable, List, Optional, Union
+
+import gopro_commands
+from command_client import endpoint_key
+from metrics import LatencyHistogram
+
+
+class AsyncResponse:
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body.decode("utf-8"))
+
+
+class AsyncCommandClient:
+    """Keep-alive HTTP/1.1 client for one camera built on asyncio streams"""
+
+    def __init__(self, ip: str, port: int = 80, connect_timeout: float = 2.0,
+                 read_timeout: float = 5.0, retries: int = 2):
+        self.ip = ip
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.stats: Dict[str, LatencyHistogram] = {}
+        self.errors: Dict[str, int] = {}
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self):
+        if self._writer is None or self._writer.is_closing():
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.ip, self.port), self.connect_timeout
+            )
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        self._reader = self._writer = None
+
+    async def _request(self, command: str) -> AsyncResponse:
+        await self.connect()
+        self._writer.write(
+            f"GET /{command} HTTP/1.1\r\nHost: {self.ip}\r\nConnection: keep-alive\r\n\r\n".encode("ascii")
+        )
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError("camera closed the connection")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await self._reader.readline()
+                    break
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readline()
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await self._reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await self._reader.read()
+
+        if headers.get("connection", "").lower() == "close" or "content-length" not in headers and \
+                headers.get("transfer-encoding", "").lower() != "chunked":
+            await self.close()
+        return AsyncResponse(status, headers, body)
+
+    async def get(self, command: str) -> Optional[AsyncResponse]:
+        key = endpoint_key(command)
+        async with self._lock:
+            for _ in range(self.retries + 1):
+                start = time.perf_counter()
+                try:
+                    response = await asyncio.wait_for(self._request(command), self.read_timeout)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    await self.close()
+                    continue
+                if response.status >= 500:
+                    continue
+                if response.status >= 400:
+                    break
+                self.stats.setdefault(key, LatencyHistogram()).observe(time.perf_counter() - start)
+                return response
+        self.errors[key] = self.errors.get(key, 0) + 1
+        return None
+
+    def latency_stats(self) -> Dict[str, dict]:
+        stats = {key: hist.snapshot() for key, hist in self.stats.items()}
+        for key, count in self.errors.items():
+            stats.setdefault(key, LatencyHistogram().snapshot())["errors"] = count
+        for snapshot in stats.values():
+            snapshot.setdefault("errors", 0)
+        return stats
+
+
+class AsyncGoProController:
+    """asyncio counterpart of GoProController's camera commands"""
+
+    def __init__(self, ip: str = "10.5.5.9", port: int = 80, connect_timeout: float = 2.0,
+                 read_timeout: float = 5.0, retries: int = 2):
+        self.ip = ip
+        self.client = AsyncCommandClient(ip, port, connect_timeout, read_timeout, retries)
+        self.last_sent: Optional[float] = None
+        self.last_acked: Optional[float] = None
+
+    async def connect(self) -> bool:
+        """Open the keep-alive connection ahead of time so the first command is one round trip"""
+        try:
+            await self.client.connect()
+            return True
+        except (OSError, asyncio.TimeoutError):
+            return False
+
+    async def close(self):
+        await self.client.close()
+
+    async def send_command(self, command: str) -> Optional[AsyncResponse]:
+        self.last_sent = time.monotonic()
+        response = await self.client.get(command)
+        if response is not None:
+            self.last_acked = time.monotonic()
+        return response
+
+    async def status(self) -> Optional[dict]:
+        response = await self.send_command(gopro_commands.STATUS)
+        if response:
+            return response.json()
+        return None
+
+    async def set_mode(self, mode: str) -> bool:
+        command = gopro_commands.mode_command(mode)
+        if command is None:
+            return False
+        return await self.send_command(command) is not None
+
+    async def start_recording(self) -> bool:
+        return await self.send_command(gopro_commands.SHUTTER_ON) is not None
+
+    async def stop_recording(self) -> bool:
+        return await self.send_command(gopro_commands.SHUTTER_OFF) is not None
+
+    async def take_photo(self) -> bool:
+        return await self.send_command(gopro_commands.SHUTTER_ON) is not None
+
+    async def set_video_settings(self, resolution: str, fps: str, fov: str) -> bool:
+        commands = gopro_commands.video_settings_commands(resolution, fps, fov)
+        if commands is None:
+            return False
+        for cmd in commands:
+            if await self.send_command(cmd) is None:
+                return False
+        return True
+
+    def latency_stats(self) -> Dict[str, dict]:
+        return self.client.latency_stats()
+
+
+class FleetResult:
+    """Per-camera results of one fan-out plus the spread of their command timings"""
+
+    def __init__(self, results: Dict[str, object], sent: Dict[str, float], acked: Dict[str, float]):
+        self.results = results
+        self.sent = sent
+        self.acked = acked
+
+    @property
+    def ok(self) -> bool:
+        return all(bool(r) for r in self.results.values())
+
+    @property
+    def failed(self) -> List[str]:
+        return [ip for ip, r in self.results.items() if not r]
+
+    @property
+    def skew(self) -> Optional[float]:
+        """Spread (seconds) of the estimated moment each camera acted on the command.
+
+        A camera acts somewhere between sending the request and receiving the ack;
+        the midpoint of that window is used as its estimate.
+        """
+        points = [(self.sent[ip] + self.acked[ip]) / 2 for ip in self.acked if ip in self.sent]
+        if len(points) < 2:
+            return 0.0 if points else None
+        return max(points) - min(points)
+
+    @property
+    def duration(self) -> Optional[float]:
+        if not self.acked:
+            return None
+        return max(self.acked.values()) - min(self.sent.values())
+
+    def __repr__(self):
+        return f"FleetResult(ok={self.ok}, failed={self.failed}, skew={self.skew}, duration={self.duration})"
+
+
+class CameraFleet:
+    """Fans camera commands out to many cameras at once"""
+
+    def __init__(self, cameras: Iterable[Union[str, AsyncGoProController]], **controller_kwargs):
+        self.cameras: Dict[str, AsyncGoProController] = {}
+        for camera in cameras:
+            if isinstance(camera, str):
+                camera = AsyncGoProController(camera, **controller_kwargs)
+            self.cameras[camera.ip] = camera
+
+    async def connect(self) -> Dict[str, bool]:
+        ips = list(self.cameras)
+        results = await asyncio.gather(*(self.cameras[ip].connect() for ip in ips))
+        return dict(zip(ips, results))
+
+    async def close(self):
+        await asyncio.gather(*(camera.close() for camera in self.cameras.values()))
+
+    async def _fan_out(self, method: str, *args) -> FleetResult:
+        ips = list(self.cameras)
+        sent: Dict[str, float] = {}
+        acked: Dict[str, float] = {}
+
+        async def run(ip):
+            camera = self.cameras[ip]
+            sent[ip] = time.monotonic()
+            try:
+                result = await getattr(camera, method)(*args)
+            except Exception as e:
+                print(f"{ip}: {method} failed: {e}")
+                return None
+            if result:
+                acked[ip] = time.monotonic()
+            return result
+
+        results = await asyncio.gather(*(run(ip) for ip in ips))
+        return FleetResult(dict(zip(ips, results)), sent, acked)
+
+    async def start_recording(self) -> FleetResult:
+        return await self._fan_out("start_recording")
+
+    async def stop_recording(self) -> FleetResult:
+        return await self._fan_out("stop_recording")
+
+    async def take_photo(self) -> FleetResult:
+        return await self._fan_out("take_photo")
+
+    async def set_mode(self, mode: str) -> FleetResult:
+        return await self._fan_out("set_mode", mode)
+
+    async def set_video_settings(self, resolution: str, fps: str, fov: str) -> FleetResult:
+        return await self._fan_out("set_video_settings", resolution, fps, fov)
+
+    async def status(self) -> FleetResult:
+        return await self._fan_out("status")
@@ -0,0 +1,165 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import time
+from typing import Dict, List, Optional
+
+import gopro_commands
+import hls_segmenter
+import live_preview
+import snapshot
+import stream_readiness
+import ts_ingest
+from camera_simulator import CameraSimulator
+from command_client import CommandClient
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results.jsonl")
+
+# Headline numbers compared between runs: (label, path into the results, lower is better)
+HEADLINES = [
+    ("command p50 (s)", ("command_latency", "status", "p50"), True),
+    ("command p95 (s)", ("command_latency", "status", "p95"), True),
+    ("settings pipeline (s)", ("command_latency", "settings_pipeline"), True),
+    ("ingest 60 Mbps CPU (%)", ("ingest", "60", "cpu_percent"), True),
+    ("ingest 60 Mbps loss", ("ingest", "60", "datagram_loss"), True),
+    ("passthrough CPU (%)", ("preview", "passthrough", "cpu_percent"), True),
+    ("transcode CPU (%)", ("preview", "transcode", "ffmpeg_cpu_percent"), True),
+    ("snapshot CPU (%)", ("preview", "snapshot", "ffmpeg_cpu_percent"), True),
+    ("low latency send p95 (s)", ("preview", "low_latency", "send_p95"), True),
+    ("cold start to keyframe (s)", ("time_to_first_frame", "cold_start", "keyframe", "median"), True),
+    ("restart to keyframe (s)", ("time_to_first_frame", "restart", "keyframe", "median"), True),
+]
+
+
+def release_label() -> str:
+    """git describe of the working tree, so results can be lined up against releases"""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty", "--tags"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              timeout=5).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def bench_commands(camera: CameraSimulator, requests: int = 200) -> dict:
+    client = CommandClient(camera.base_url)
+    try:
+        for _ in range(requests):
+            client.get(gopro_commands.STATUS)
+        commands = gopro_commands.video_settings_commands("1080p", "60fps", "Wide")
+        start = time.perf_counter()
+        client.pipeline(commands)
+        pipeline = time.perf_counter() - start
+        return {
+            "status": client.latency_stats().get(gopro_commands.STATUS),
+            "settings_pipeline": pipeline,
+        }
+    finally:
+        client.close()
+
+
+def bench_ingest(rates: List[float], seconds: float) -> Dict[str, dict]:
+    return {f"{rate:g}": ts_ingest.benchmark(rate, seconds) for rate in rates}
+
+
+def bench_preview(seconds: float) -> Dict[str, dict]:
+    results = {
+        "passthrough": hls_segmenter.benchmark("passthrough", "", 8.0, seconds),
+        "low_latency": live_preview.benchmark("", 8.0, seconds),
+    }
+    if shutil.which("ffmpeg"):
+        results["transcode"] = hls_segmenter.benchmark("transcode", "", 8.0, seconds)
+        results["snapshot"] = snapshot.benchmark("", 8.0, seconds)
+    return results
+
+
+def bench_startup(camera_ip: str, runs: int, stream_port: int) -> dict:
+    camera = CameraSimulator(camera_ip, http_port=0, stream_port=stream_port)
+    if not camera.start():
+        return {}
+    try:
+        return stream_readiness.benchmark(camera_ip, camera.http_port, stream_port, runs)
+    finally:
+        camera.stop()
+
+
+def run_suite(camera_ip: str = "127.0.0.2", stream_port: int = 8554, quick: bool = False) -> dict:
+    """Run every benchmark against a simulated camera and return one result record"""
+    seconds = 2.0 if quick else 5.0
+    camera = CameraSimulator(camera_ip, http_port=0, stream_port=stream_port)
+    if not camera.start():
+        return {}
+    try:
+        commands = bench_commands(camera, 50 if quick else 200)
+    finally:
+        camera.stop()
+    return {
+        "release": release_label(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "command_latency": commands,
+        "ingest": bench_ingest([20.0, 60.0] if quick else [20.0, 60.0, 120.0], seconds),
+        "preview": bench_preview(seconds * 2),
+        "time_to_first_frame": bench_startup(camera_ip, 2 if quick else 5, stream_port),
+    }
+
+
+def _lookup(record: dict, path) -> Optional[float]:
+    value = record
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value if isinstance(value, (int, float)) else None
+
+
+def load_results(path: str = RESULTS_FILE) -> List[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_result(record: dict, path: str = RESULTS_FILE):
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def compare(previous: Optional[dict], current: dict) -> str:
+    """Table of the headline numbers, with the change against the previous run"""
+    baseline = previous["release"] if previous else "-"
+    lines = [f"{'metric':<28} {baseline:>16} {current['release']:>16}   change"]
+    for label, path, lower_is_better in HEADLINES:
+        new = _lookup(current, path)
+        old = _lookup(previous, path) if previous else None
+        change = ""
+        if new is not None and old:
+            delta = (new - old) / old * 100
+            worse = delta > 0 if lower_is_better else delta < 0
+            change = f"{delta:+.1f}%" + (" (worse)" if worse and abs(delta) >= 10 else "")
+        fmt = lambda v: "-" if v is None else f"{v:.4g}"
+        lines.append(f"{label:<28} {fmt(old):>16} {fmt(new):>16}   {change}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the controller against a simulated camera")
+    parser.add_argument("--camera-ip", default="127.0.0.2", help="loopback address for the simulated camera")
+    parser.add_argument("--stream-port", type=int, default=8554)
+    parser.add_argument("--quick", action="store_true", help="shorter runs, for a smoke test")
+    parser.add_argument("--results", default=RESULTS_FILE, help="JSON lines file the runs are appended to")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    history = load_results(args.results)
+    record = run_suite(args.camera_ip, args.stream_port, args.quick)
+    if not record:
+        raise SystemExit("Could not start the camera simulator")
+    if not args.no_save:
+        save_result(record, args.results)
+    print(compare(history[-1] if history else None, record))
@@ -0,0 +1,367 @@
+import json
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from ts_ingest import TS_PACKET_SIZE, TS_PACKETS_PER_DATAGRAM, synthetic_datagrams
+
+KEEP_ALIVE_PREFIX = b"_GPHD_:"
+MEDIA_PREFIX = "/videos/DCIM/"
+
+INFO = {"model_name": "HERO5 Session (simulated)", "firmware_version": "HD5.03.02.51.00"}
+# A trimmed gp/gpControl schema: the video settings the controller uses and the
+# filters that rule out combinations the sensor can't do
+SCHEMA = {
+    "info": INFO,
+    "modes": [{
+        "path_segment": "video",
+        "display_name": "Video",
+        "value": 0,
+        "settings": [
+            {"id": 2, "path_segment": "resolution", "display_name": "Resolution",
+             "options": [{"display_name": "4K", "value": 1}, {"display_name": "1080", "value": 9},
+                         {"display_name": "720", "value": 12}]},
+            {"id": 3, "path_segment": "fps", "display_name": "Frames Per Second",
+             "options": [{"display_name": "120", "value": 1}, {"display_name": "30", "value": 5},
+                         {"display_name": "60", "value": 6}]},
+            {"id": 4, "path_segment": "fov", "display_name": "Field of View",
+             "options": [{"display_name": "Wide", "value": 0}, {"display_name": "Medium", "value": 1},
+                         {"display_name": "Narrow", "value": 2}, {"display_name": "Linear", "value": 4}]},
+        ],
+    }],
+    "filters": [
+        {"activated_by": [{"setting_id": 2, "setting_value": 1}], "blacklist": {"setting_id": 3, "values": [1, 6]}},
+        {"activated_by": [{"setting_id": 2, "setting_value": 1}], "blacklist": {"setting_id": 4, "values": [1, 2, 4]}},
+        {"activated_by": [{"setting_id": 2, "setting_value": 9}], "blacklist": {"setting_id": 3, "values": [1]}},
+        {"activated_by": [{"setting_id": 3, "setting_value": 1}], "blacklist": {"setting_id": 4, "values": [4]}},
+    ],
+}
+
+
+class _CameraRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "GoProSimulator/1.0"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        camera: "CameraSimulator" = self.server.camera
+        url = urlsplit(self.path)
+        if url.path.startswith(MEDIA_PREFIX):
+            self._send_media(camera, url.path[len(MEDIA_PREFIX):])
+            return
+        if camera.command_delay:
+            time.sleep(camera.command_delay)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        status, body = camera.handle(url.path.strip("/"), query, self.client_address[0])
+        self._send(status, body)
+
+
+    def _send_media(self, camera: "CameraSimulator", path: str):
+        size = camera.media.get(path)
+        if size is None:
+            self._send(404, {"error": "no such file"})
+            return
+        start = 0
+        match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        self.send_response(206 if match else 200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(size - start))
+        self.send_header("Accept-Ranges", "bytes")
+        if match:
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        self.end_headers()
+        position = start
+        while position < size:
+            # File content is the byte pattern i % 251, so downloads can be checked
+            chunk = bytes((i % 251) for i in range(position, min(size, position + 65536)))
+            self.wfile.write(chunk)
+            position += len(chunk)
+
+
+class CameraSimulator:
+    """Stands in for a HERO5 Session on the local machine.
+
+    Serves the gpControl endpoints the controller uses (status, shutter, mode,
+    settings, gpStream restart/stop) and, while streaming, sends a synthetic H.264
+    MPEG-TS to UDP stream_port of the client that started the stream, at a set
+    bitrate and GOP with optional datagram loss and per-frame send jitter. Like the
+    real camera, the stream stops when keep-alives stop arriving. `media` maps
+    "100GOPRO/GOPR0001.MP4" style paths to file sizes for gpMediaList and for
+    downloads from /videos/DCIM/ on the same HTTP port, with Range support.
+
+    Run it on its own loopback address (e.g. 127.0.0.2) so its keep-alive socket
+    doesn't compete with a controller ingest bound to the same port.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", http_port: int = 80, stream_port: int = 8554,
+                 mbps: float = 4.0, fps: float = 30.0, gop: int = 30, loss: float = 0.0,
+                 jitter: float = 0.0, command_delay: float = 0.0, startup_delay: float = 0.1,
+                 keep_alive_timeout: Optional[float] = 10.0, seed: Optional[int] = None,
+                 media: Optional[Dict[str, int]] = None):
+        self.host = host
+        self.http_port = http_port
+        self.stream_port = stream_port
+        self.mbps = mbps
+        self.fps = fps
+        self.gop = gop
+        self.loss = loss
+        self.jitter = jitter
+        self.command_delay = command_delay
+        self.startup_delay = startup_delay
+        self.keep_alive_timeout = keep_alive_timeout
+        self.media: Dict[str, int] = dict(media or {})
+        self.mode = 0
+        self.recording = False
+        self.settings: Dict[str, int] = {"2": 9, "3": 5, "4": 0}
+        self.requests = 0
+        self.setting_commands = 0
+        self.keep_alives = 0
+        self.last_keep_alive: Optional[float] = None
+        self.datagrams_sent = 0
+        self.datagrams_dropped = 0
+        self.stream_target: Optional[Tuple[str, int]] = None
+        self.httpd: Optional[ThreadingHTTPServer] = None
+        self._keep_alive_sock: Optional[socket.socket] = None
+        self._stream_thread: Optional[threading.Thread] = None
+        self._streaming = False
+        self._running = False
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def start(self) -> bool:
+        if self._running:
+            return True
+        try:
+            httpd = ThreadingHTTPServer((self.host, self.http_port), _CameraRequestHandler)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.host, self.stream_port))
+            sock.settimeout(0.2)
+        except OSError as e:
+            print(f"Error starting camera simulator on {self.host}: {e}")
+            return False
+        httpd.daemon_threads = True
+        httpd.camera = self
+        self.httpd = httpd
+        self.http_port = httpd.server_address[1]
+        self._keep_alive_sock = sock
+        self._running = True
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        threading.Thread(target=self._receive_keep_alives, daemon=True).start()
+        return True
+
+    def stop(self):
+        self._running = False
+        self.stop_stream()
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+        if self._keep_alive_sock:
+            self._keep_alive_sock.close()
+            self._keep_alive_sock = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.http_port}"
+
+    @property
+    def streaming(self) -> bool:
+        return self._streaming
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "status": {
+                    "1": 1,  # internal battery present
+                    "2": 3,  # internal battery level
+                    "8": int(self.recording),  # busy
+                    "10": int(self.recording),  # encoding active
+                    "31": 1,  # connected clients
+                    "32": int(self._streaming),  # streaming
+                    "43": self.mode,
+                },
+                "settings": dict(self.settings),
+            }
+
+    def media_list(self) -> dict:
+        folders: Dict[str, list] = {}
+        for path, size in sorted(self.media.items()):
+            directory, name = path.split("/", 1)
+            folders.setdefault(directory, []).append({"n": name, "s": str(size), "mod": "1500000000"})
+        return {
+            "id": str(hash(tuple(sorted(self.media.items()))) & 0xFFFFFFFF),
+            "media": [{"d": d, "fs": fs} for d, fs in folders.items()],
+        }
+
+    def handle(self, path: str, query: dict, client: str) -> Tuple[int, dict]:
+        """Route one gpControl request; returns (HTTP status, JSON body)"""
+        with self._lock:
+            self.requests += 1
+        if path == "gp/gpControl":
+            return 200, SCHEMA
+        if path == "gp/gpControl/info":
+            return 200, {"info": INFO}
+        if path == "gp/gpControl/status":
+            return 200, self.status()
+        if path == "gp/gpMediaList":
+            return 200, self.media_list()
+        if path == "gp/gpControl/command/shutter" and query.get("p") in ("0", "1"):
+            with self._lock:
+                self.recording = query["p"] == "1"
+            return 200, {}
+        if path == "gp/gpControl/command/mode" and query.get("p", "").isdigit():
+            with self._lock:
+                self.mode = int(query["p"])
+            return 200, {}
+        if path.startswith("gp/gpControl/setting/"):
+            parts = path.split("/")
+            if len(parts) == 5 and parts[3].isdigit() and parts[4].isdigit():
+                with self._lock:
+                    self.settings[parts[3]] = int(parts[4])
+                    self._apply_filters(parts[3])
+                    self.setting_commands += 1
+                return 200, {}
+        if path == "gp/gpControl/execute" and query.get("p1") == "gpStream":
+            if query.get("c1") == "restart":
+                self.start_stream((client, self.stream_port))
+                return 200, {}
+            if query.get("c1") == "stop":
+                self.stop_stream()
+                return 200, {}
+        return 404, {"error": "unknown command"}
+
+    def _apply_filters(self, changed: str):
+        """Like the camera, move settings the change has ruled out to their first allowed option"""
+        for f in SCHEMA["filters"]:
+            activated = all(self.settings.get(str(a["setting_id"])) == a["setting_value"] for a in f["activated_by"])
+            target = str(f["blacklist"]["setting_id"])
+            if target == changed or not activated or self.settings.get(target) not in f["blacklist"]["values"]:
+                continue
+            setting = next(e for e in SCHEMA["modes"][0]["settings"] if str(e["id"]) == target)
+            self.settings[target] = next(o["value"] for o in setting["options"]
+                                         if o["value"] not in f["blacklist"]["values"])
+
+    def start_stream(self, target: Tuple[str, int]):
+        """(Re)start the synthetic stream towards target; a restart begins with PSI and an IDR"""
+        self.stop_stream()
+        self.stream_target = target
+        self.last_keep_alive = time.monotonic()
+        self._streaming = True
+        self._stream_thread = threading.Thread(target=self._stream, daemon=True)
+        self._stream_thread.start()
+
+    def stop_stream(self):
+        self._streaming = False
+        if self._stream_thread and self._stream_thread is not threading.current_thread():
+            self._stream_thread.join(timeout=1)
+        self._stream_thread = None
+
+    def _receive_keep_alives(self):
+        sock = self._keep_alive_sock
+        while self._running:
+            try:
+                data, _ = sock.recvfrom(64)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if data.startswith(KEEP_ALIVE_PREFIX):
+                self.keep_alives += 1
+                self.last_keep_alive = time.monotonic()
+
+    def _stream(self):
+        datagram_size = TS_PACKET_SIZE * TS_PACKETS_PER_DATAGRAM
+        per_frame = max(1, round(self.mbps * 1e6 / 8 / self.fps / datagram_size))
+        frames = synthetic_datagrams(None, gop=self.gop, datagrams_per_frame=per_frame, fps=self.fps)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.startup_delay:
+            time.sleep(self.startup_delay)
+        start = time.monotonic()
+        frame = 0
+        try:
+            while self._streaming:
+                # Frame n is due at start + n / fps; jitter only delays it, never reorders
+                due = start + frame / self.fps + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if self.keep_alive_timeout is not None and \
+                        time.monotonic() - self.last_keep_alive > self.keep_alive_timeout:
+                    print("Camera simulator: no keep-alive, stopping stream")
+                    self._streaming = False
+                    break
+                for _ in range(per_frame):
+                    datagram = next(frames)
+                    if self.loss and self._random.random() < self.loss:
+                        self.datagrams_dropped += 1
+                        continue
+                    try:
+                        sock.sendto(datagram, self.stream_target)
+                        self.datagrams_sent += 1
+                    except OSError:
+                        self.datagrams_dropped += 1
+                frame += 1
+        finally:
+            sock.close()
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "setting_commands": self.setting_commands,
+            "keep_alives": self.keep_alives,
+            "streaming": self._streaming,
+            "stream_target": self.stream_target,
+            "datagrams_sent": self.datagrams_sent,
+            "datagrams_dropped": self.datagrams_dropped,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulate a HERO5 Session camera on this machine")
+    parser.add_argument("--host", default="127.0.0.2")
+    parser.add_argument("--http-port", type=int, default=80)
+    parser.add_argument("--stream-port", type=int, default=8554)
+    parser.add_argument("--mbps", type=float, default=4.0)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--gop", type=int, default=30)
+    parser.add_argument("--loss", type=float, default=0.0, help="probability of dropping each datagram")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximum extra delay per frame (seconds)")
+    parser.add_argument("--command-delay", type=float, default=0.0, help="added HTTP response time (seconds)")
+    args = parser.parse_args()
+    camera = CameraSimulator(args.host, args.http_port, args.stream_port, args.mbps, args.fps, args.gop,
+                             args.loss, args.jitter, args.command_delay)
+    if camera.start():
+        print(f"Simulated camera at {camera.base_url}, streaming to UDP {args.stream_port} on restart")
+        try:
+            while True:
+                time.sleep(5)
+                print(json.dumps(camera.stats()))
+        except KeyboardInterrupt:
+            camera.stop()
@@ -0,0 +1,273 @@
+import json
+import os
+import re
+import time
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+from command_client import CommandClient
+
+SCHEMA = "gp/gpControl"
+INFO = "gp/gpControl/info"
+CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "gopro-controller")
+
+
+class Setting(NamedTuple):
+    id: int
+    name: str            # path_segment, e.g. "resolution"
+    display_name: str
+    mode: str            # the mode's path_segment, e.g. "video"
+    options: Dict[int, str]
+
+
+class Filter(NamedTuple):
+    """While every activated_by (setting, value) pair holds, setting_id can't take these values"""
+    activated_by: Tuple[Tuple[int, int], ...]
+    setting_id: int
+    values: frozenset
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[^0-9a-z]", "", str(text).lower())
+
+
+class CapabilitySchema:
+    """The settings, options and option filters a camera model/firmware supports.
+
+    Built from the camera's gp/gpControl JSON. Settings are looked up by name
+    (path_segment or display name) and option values by display name, so requests
+    can be validated and mapped to IDs locally without asking the camera.
+    """
+
+    def __init__(self, raw: dict):
+        self.raw = raw
+        info = raw.get("info", {})
+        self.model = info.get("model_name", "")
+        self.firmware = info.get("firmware_version", "")
+        self.settings: Dict[int, Setting] = {}
+        for mode in raw.get("modes", []):
+            for entry in mode.get("settings", []):
+                setting = Setting(int(entry["id"]), entry.get("path_segment", ""), entry.get("display_name", ""),
+                                  mode.get("path_segment", ""),
+                                  {int(o["value"]): str(o.get("display_name", o["value"]))
+                                   for o in entry.get("options", [])})
+                self.settings.setdefault(setting.id, setting)
+        self.filters: List[Filter] = []
+        for entry in raw.get("filters", []):
+            blacklist = entry.get("blacklist", {})
+            self.filters.append(Filter(
+                tuple((int(a["setting_id"]), int(a["setting_value"])) for a in entry.get("activated_by", [])),
+                int(blacklist.get("setting_id", -1)),
+                frozenset(int(v) for v in blacklist.get("values", [])),
+            ))
+        # Setting a -> settings whose allowed values depend on a
+        self.dependents: Dict[int, set] = {}
+        for f in self.filters:
+            for setting_id, _ in f.activated_by:
+                if setting_id != f.setting_id:
+                    self.dependents.setdefault(setting_id, set()).add(f.setting_id)
+
+    @property
+    def key(self) -> str:
+        return schema_key(self.model, self.firmware)
+
+    def setting(self, name, mode: Optional[str] = None) -> Optional[Setting]:
+        """Look a setting up by ID, path_segment or display name"""
+        if isinstance(name, int) or str(name).isdigit():
+            return self.settings.get(int(name))
+        wanted = _normalize(name)
+        for setting in self.settings.values():
+            if mode and setting.mode != mode:
+                continue
+            if wanted in (_normalize(setting.name), _normalize(setting.display_name)):
+                return setting
+        return None
+
+    def option(self, setting: Setting, display) -> Optional[int]:
+        """Option value for a display name such as "1080p", "60fps" or "Wide" (or a raw value)"""
+        if isinstance(display, int) and display in setting.options:
+            return display
+        wanted = _normalize(display)
+        # The UI says "1080p" and "60fps" where schemas often say "1080" and "60"
+        candidates = [wanted, re.sub(r"(p|fps)$", "", wanted)]
+        for value, name in setting.options.items():
+            if _normalize(name) in candidates:
+                return value
+        if wanted.isdigit() and int(wanted) in setting.options:
+            return int(wanted)
+        return None
+
+    def blocked(self, setting_id: int, value: int, settings: Mapping[int, int]) -> Optional[Filter]:
+        """The filter that rules out value for setting_id given the other settings, if any"""
+        for f in self.filters:
+            if f.setting_id == setting_id and value in f.values and \
+                    all(settings.get(a) == v for a, v in f.activated_by):
+                return f
+        return None
+
+    def resolve(self, requested: Mapping, mode: Optional[str] = None) -> Tuple[Dict[int, int], List[str]]:
+        """Map {"resolution": "1080p", ...} to {2: 9, ...}; returns (settings, errors)"""
+        resolved = {}
+        errors = []
+        for name, display in requested.items():
+            setting = self.setting(name, mode)
+            if setting is None:
+                errors.append(f"{self.model} has no setting {name!r}")
+                continue
+            value = self.option(setting, display)
+            if value is None:
+                errors.append(f"{setting.display_name or setting.name} has no option {display!r} "
+                              f"(options: {', '.join(setting.options.values())})")
+                continue
+            resolved[setting.id] = value
+        return resolved, errors
+
+    def validate(self, target: Mapping[int, int], keys: Optional[Iterable[int]] = None) -> List[str]:
+        """Errors for combinations of target settings that the filters rule out.
+
+        With keys, only those settings are checked (against all of target), so a
+        current value the filters don't allow can't block an unrelated change.
+        """
+        errors = []
+        for setting_id in (target if keys is None else keys):
+            value = target[setting_id]
+            f = self.blocked(setting_id, value, target)
+            if f is not None:
+                setting = self.settings.get(setting_id)
+                causes = ", ".join(
+                    f"{self.settings[a].display_name if a in self.settings else a}="
+                    f"{self.settings[a].options.get(v, v) if a in self.settings else v}"
+                    for a, v in f.activated_by)
+                name = setting.display_name if setting else setting_id
+                shown = setting.options.get(value, value) if setting else value
+                errors.append(f"{name}={shown} is not available with {causes}")
+        return errors
+
+    def plan(self, changes: Mapping[int, int], current: Mapping[int, int]) -> List[Tuple[int, int]]:
+        """The (setting, value) commands that take current to current + changes, in dependency order.
+
+        Settings already at their value are skipped unless a setting they depend on
+        changes first, since the camera may adjust dependents when that happens.
+        """
+        changed = {s for s, v in changes.items() if current.get(s) != v}
+        for s in list(changed):
+            changed |= {d for d in self._all_dependents(s) if d in changes}
+        ordered = []
+        remaining = set(changed)
+        while remaining:
+            # Parents first: a setting is ready once no remaining setting constrains it
+            ready = sorted(s for s in remaining
+                           if not any(s in self._all_dependents(p) for p in remaining if p != s))
+            if not ready:
+                # A cycle in the filters; fall back to ID order, which suits GoPro schemas
+                ready = sorted(remaining)
+            ordered.append(ready[0])
+            remaining.discard(ready[0])
+        return [(s, changes[s]) for s in ordered]
+
+    def _all_dependents(self, setting_id: int) -> set:
+        seen = set()
+        stack = [setting_id]
+        while stack:
+            for d in self.dependents.get(stack.pop(), ()):
+                if d not in seen:
+                    seen.add(d)
+                    stack.append(d)
+        seen.discard(setting_id)
+        return seen
+
+
+def schema_key(model: str, firmware: str) -> str:
+    return re.sub(r"[^0-9A-Za-z.]+", "_", f"{model}_{firmware}").strip("_") or "unknown"
+
+
+class SchemaCache:
+    """gp/gpControl schemas on disk, one file per model and firmware.
+
+    The small gp/gpControl/info response identifies the camera; the full schema is
+    only fetched the first time a model/firmware is seen.
+    """
+
+    def __init__(self, directory: str = CACHE_DIRECTORY):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, key: str) -> Optional[CapabilitySchema]:
+        try:
+            with open(self._path(key)) as f:
+                return CapabilitySchema(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, schema: CapabilitySchema):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = self._path(schema.key) + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(schema.raw, f)
+            os.replace(tmp, self._path(schema.key))
+        except OSError as e:
+            print(f"Could not cache the camera schema: {e}")
+
+    def fetch(self, client: CommandClient) -> Optional[CapabilitySchema]:
+        """The camera's schema, from disk when this model/firmware has been seen before"""
+        response = client.get(INFO)
+        info = None
+        if response is not None:
+            try:
+                info = response.json().get("info")
+            except ValueError:
+                pass
+        if info:
+            schema = self.load(schema_key(info.get("model_name", ""), info.get("firmware_version", "")))
+            if schema is not None:
+                self.hits += 1
+                return schema
+        self.misses += 1
+        response = client.get(SCHEMA)
+        if response is None:
+            return None
+        try:
+            schema = CapabilitySchema(response.json())
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Could not parse the camera schema: {e}")
+            return None
+        self.save(schema)
+        return schema
+
+
+def current_settings(status: Optional[dict]) -> Dict[int, int]:
+    """The "settings" section of a gpControl/status response with integer keys"""
+    if not status:
+        return {}
+    return {int(k): int(v) for k, v in status.get("settings", {}).items() if str(k).isdigit()}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show a camera's settings schema and plan a settings change")
+    parser.add_argument("--ip", default="10.5.5.9")
+    parser.add_argument("--cache", default=CACHE_DIRECTORY)
+    parser.add_argument("settings", nargs="*", help="name=value, e.g. resolution=1080p fps=60fps")
+    args = parser.parse_args()
+
+    client = CommandClient(f"http://{args.ip}")
+    start = time.perf_counter()
+    schema = SchemaCache(args.cache).fetch(client)
+    if schema is None:
+        raise SystemExit("Could not read the camera schema")
+    print(f"{schema.model} {schema.firmware}: {len(schema.settings)} settings, {len(schema.filters)} filters "
+          f"({time.perf_counter() - start:.3f}s)")
+    requested = dict(s.split("=", 1) for s in args.settings)
+    changes, errors = schema.resolve(requested)
+    status = client.get("gp/gpControl/status")
+    current = current_settings(status.json() if status is not None else None)
+    errors += schema.validate({**current, **changes}, changes)
+    if errors:
+        raise SystemExit("\n".join(errors))
+    for setting_id, value in schema.plan(changes, current):
+        print(f"gp/gpControl/setting/{setting_id}/{value}")
@@ -0,0 +1,180 @@
+import http.client
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import LatencyHistogram
+
+
+def endpoint_key(command: str) -> str:
+    """Collapse a command into its endpoint, e.g. gp/gpControl/setting/2/9 -> gp/gpControl/setting"""
+    path = command.split("?", 1)[0].strip("/")
+    return "/".join(part for part in path.split("/") if not part.isdigit())
+
+
+class CommandClient:
+    """Pooled keep-alive HTTP client for one camera with timeouts, retries and latency stats"""
+
+    def __init__(self, base_url: str, connect_timeout: float = 2.0, read_timeout: float = 5.0,
+                 retries: int = 2, pool_size: int = 4):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.stats: Dict[str, LatencyHistogram] = {}
+        self.errors: Dict[str, int] = {}
+        self._stats_lock = threading.Lock()
+        # The pipelined settings connection, kept open between batches like the pool's
+        self._pipe: Optional[socket.socket] = None
+        self._pipe_file: Optional[_SharedFileSocket] = None
+        self._pipe_lock = threading.Lock()
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=0.1,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _histogram(self, command: str) -> LatencyHistogram:
+        key = endpoint_key(command)
+        with self._stats_lock:
+            hist = self.stats.get(key)
+            if hist is None:
+                hist = self.stats[key] = LatencyHistogram()
+            return hist
+
+    def _record_error(self, command: str):
+        key = endpoint_key(command)
+        with self._stats_lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def get(self, command: str, timeout: Optional[Tuple[float, float]] = None) -> Optional[requests.Response]:
+        start = time.perf_counter()
+        try:
+            response = self.session.get(f"{self.base_url}/{command}", timeout=timeout or self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            self._record_error(command)
+            return None
+        self._histogram(command).observe(time.perf_counter() - start)
+        return response
+
+    def pipeline(self, commands: Sequence[str]) -> List[bool]:
+        """Send commands back-to-back on one connection and read the responses in order.
+
+        The camera applies settings in request order, so this keeps the ordering of a
+        serial loop while paying a single round trip. The connection stays open for the
+        next batch; one the camera has closed in the meantime is reopened once. If the
+        camera drops the connection mid-batch, the failure is counted under "pipeline"
+        and the unanswered commands are replayed one by one through the pool.
+        """
+        results: List[bool] = []
+        parts = urlsplit(self.base_url)
+        requests_raw = b"".join(
+            f"GET {parts.path.rstrip('/')}/{cmd} HTTP/1.1\r\nHost: {parts.netloc}\r\n\r\n".encode("ascii")
+            for cmd in commands
+        )
+        with self._pipe_lock:
+            for _ in range(2):
+                reused = self._pipe is not None
+                start = time.perf_counter()
+                try:
+                    sock, shared = self._pipeline_connection(parts)
+                    sock.sendall(requests_raw)
+                    for cmd in commands:
+                        response = http.client.HTTPResponse(shared, method="GET")
+                        response.begin()
+                        response.read()
+                        ok = 200 <= response.status < 300
+                        if ok:
+                            self._histogram(cmd).observe(time.perf_counter() - start)
+                        else:
+                            self._record_error(cmd)
+                        results.append(ok)
+                        if response.will_close:
+                            self._close_pipeline()
+                            break
+                except (OSError, http.client.HTTPException):
+                    self._close_pipeline()
+                    if reused and not results:
+                        # The camera closed the idle connection; nothing was applied yet
+                        continue
+                    self._record_error("pipeline")
+                break
+
+        for cmd in commands[len(results):]:
+            results.append(self.get(cmd) is not None)
+        return results
+
+    def _pipeline_connection(self, parts) -> Tuple[socket.socket, "_SharedFileSocket"]:
+        if self._pipe is None:
+            sock = socket.create_connection((parts.hostname, parts.port or 80), timeout=self.timeout[0])
+            sock.settimeout(self.timeout[1])
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._pipe = sock
+            self._pipe_file = _SharedFileSocket(sock.makefile("rb"))
+        return self._pipe, self._pipe_file
+
+    def _close_pipeline(self):
+        if self._pipe is not None:
+            self._pipe_file.close()
+            self._pipe.close()
+            self._pipe = None
+            self._pipe_file = None
+
+    def latency_stats(self) -> Dict[str, dict]:
+        with self._stats_lock:
+            items = list(self.stats.items())
+            errors = dict(self.errors)
+        stats = {key: hist.snapshot() for key, hist in items}
+        for key, count in errors.items():
+            stats.setdefault(key, LatencyHistogram().snapshot())["errors"] = count
+        for snapshot in stats.values():
+            snapshot.setdefault("errors", 0)
+        return stats
+
+    def close(self):
+        with self._pipe_lock:
+            self._close_pipeline()
+        self.session.close()
+
+
+class _SharedFileSocket:
+    """Lets consecutive HTTPResponse objects read from one buffered stream"""
+
+    def __init__(self, fp):
+        self._raw = fp
+        self._fp = _UnclosableFile(fp)
+
+    def makefile(self, *args, **kwargs):
+        return self._fp
+
+    def close(self):
+        self._raw.close()
+
+
+class _UnclosableFile:
+    """HTTPResponse closes its file once the body is read; keep the shared one open"""
+
+    def __init__(self, fp):
+        self._fp = fp
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+    def close(self):
+        pass
@@ -0,0 +1,296 @@
+import atexit
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence
+
+# Every running supervised child by pid; re-entrant because reap_all() may run in a
+# signal handler that interrupted the main thread while it held the lock
+_children: Dict[int, "FFmpegProcess"] = {}
+_children_lock = threading.RLock()
+# With the "level" log flag ffmpeg tags each line, after any "[h264 @ 0x...]" context, with its level
+_LOG_LEVEL = re.compile(r"\[(trace|debug|verbose|info|warning|error|fatal|panic)\] ")
+
+
+def _number(value: str) -> Optional[float]:
+    """"1234.5kbits/s", "1.01x", "30.00" -> float; None for N/A"""
+    value = value.strip().rstrip("x")
+    if value.endswith("kbits/s"):
+        value = value[:-len("kbits/s")]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class FFmpegProgress:
+    """The latest block of ffmpeg's machine-readable -progress output.
+
+    encode_lag is how far the output timeline has fallen behind the wall clock since
+    the first report: it stays near zero while ffmpeg keeps up with the live input
+    and grows by the shortfall when it can't (speed below 1x).
+    """
+
+    def __init__(self):
+        self.frame = 0
+        self.fps: Optional[float] = None
+        self.bitrate_kbps: Optional[float] = None
+        self.total_size = 0
+        self.out_time = 0.0
+        self.dup_frames = 0
+        self.drop_frames = 0
+        self.speed: Optional[float] = None
+        self.encode_lag = 0.0
+        self.reports = 0
+        self.ended = False
+        self.updated_at: Optional[float] = None
+        self._first: Optional[tuple] = None
+        self._block: Dict[str, str] = {}
+
+    def feed(self, line: str) -> bool:
+        """Take one key=value line; returns True when it completed a report"""
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return False
+        if key != "progress":
+            self._block[key] = value
+            return False
+        block, self._block = self._block, {}
+        now = time.monotonic()
+        self.frame = int(_number(block.get("frame", "")) or self.frame)
+        self.fps = _number(block.get("fps", "N/A"))
+        self.bitrate_kbps = _number(block.get("bitrate", "N/A"))
+        self.total_size = int(_number(block.get("total_size", "")) or self.total_size)
+        out_time_us = _number(block.get("out_time_us", block.get("out_time_ms", "N/A")))
+        if out_time_us is not None and out_time_us >= 0:
+            self.out_time = out_time_us / 1e6
+        self.dup_frames = int(_number(block.get("dup_frames", "")) or self.dup_frames)
+        self.drop_frames = int(_number(block.get("drop_frames", "")) or self.drop_frames)
+        self.speed = _number(block.get("speed", "N/A"))
+        if self._first is None:
+            self._first = (now, self.out_time)
+        self.encode_lag = max(0.0, (now - self._first[0]) - (self.out_time - self._first[1]))
+        self.reports += 1
+        self.ended = value == "end"
+        self.updated_at = now
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "frame": self.frame,
+            "fps": self.fps,
+            "bitrate_kbps": self.bitrate_kbps,
+            "speed": self.speed,
+            "dup_frames": self.dup_frames,
+            "drop_frames": self.drop_frames,
+            "encode_lag": self.encode_lag,
+            "out_time": self.out_time,
+            "progress_age": time.monotonic() - self.updated_at if self.updated_at else None,
+        }
+
+
+class FFmpegProcess:
+    """An ffmpeg/ffplay child with its progress and log read on background threads.
+
+    args is an argument list and is never passed through a shell. For ffmpeg,
+    -progress is pointed at a pipe of its own, so stdout stays free for media; the
+    reader threads never block the caller. The last log_lines lines of stderr are
+    kept for stats (and printed unless echo_log is off). Every running process is registered so that
+    reap_all() - run at interpreter exit and by install_signal_handlers() - can
+    stop it; a child that exits on its own is reaped and unregistered by its log reader.
+    ffmpeg and ffplay get the "level" log flag, so echoed lines carry their own level.
+    """
+
+    def __init__(self, args: Sequence[str], name: str = "", stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                 progress: bool = True, log_lines: int = 20, echo_log: bool = True):
+        self.args = [str(arg) for arg in args]
+        self.name = name or os.path.basename(self.args[0])
+        self.stdin_mode = stdin
+        self.stdout_mode = stdout
+        self.progress_enabled = progress and os.path.basename(self.args[0]).startswith("ffmpeg")
+        self.echo_log = echo_log
+        self.progress = FFmpegProgress()
+        self.log: Deque[str] = deque(maxlen=log_lines)
+        self.process: Optional[subprocess.Popen] = None
+        self.started_at: Optional[float] = None
+
+    def command(self, progress_fd: Optional[int] = None) -> List[str]:
+        args = list(self.args)
+        extra = []
+        if progress_fd is not None:
+            extra += ["-progress", f"pipe:{progress_fd}", "-nostats"]
+        if self.stdin_mode is not subprocess.PIPE and os.path.basename(args[0]).startswith("ffmpeg"):
+            # Otherwise ffmpeg reads the terminal for interactive commands
+            extra.append("-nostdin")
+        if os.path.basename(args[0]).startswith(("ffmpeg", "ffplay")):
+            # Keep the caller's log level (ffmpeg's default is info) and only add the flag
+            for i, arg in enumerate(args[1:-1], 1):
+                if arg in ("-loglevel", "-v"):
+                    level = args[i + 1]
+                    if "level" not in level and not level.startswith(("+", "-")):
+                        args[i + 1] = f"level+{level}"
+                    break
+            else:
+                extra += ["-loglevel", "level+info"]
+        return args[:1] + extra + args[1:]
+
+    def start(self) -> subprocess.Popen:
+        """Spawn the child; raises OSError like Popen when it can't be started"""
+        read_fd = write_fd = None
+        if self.progress_enabled:
+            read_fd, write_fd = os.pipe()
+        try:
+            self.process = subprocess.Popen(self.command(write_fd), stdin=self.stdin_mode,
+                                            stdout=self.stdout_mode, stderr=subprocess.PIPE,
+                                            pass_fds=(write_fd,) if write_fd is not None else ())
+        except OSError:
+            if read_fd is not None:
+                os.close(read_fd)
+                os.close(write_fd)
+            raise
+        self.started_at = time.monotonic()
+        self.progress = FFmpegProgress()
+        with _children_lock:
+            _children[self.process.pid] = self
+        if write_fd is not None:
+            os.close(write_fd)
+            threading.Thread(target=self._read_progress, args=(os.fdopen(read_fd, "rb"),), daemon=True).start()
+        threading.Thread(target=self._read_log, args=(self.process,), daemon=True).start()
+        return self.process
+
+    def _read_progress(self, pipe):
+        progress = self.progress
+        with pipe:
+            for line in iter(pipe.readline, b""):
+                progress.feed(line.decode(errors="replace"))
+
+    def _read_log(self, process: subprocess.Popen):
+        for line in iter(process.stderr.readline, b""):
+            text = line.decode(errors="replace").strip()
+            self.log.append(text)
+            if self.echo_log:
+                match = _LOG_LEVEL.search(text)
+                if match:
+                    message = text[:match.start()] + text[match.end():]
+                    print(f"FFmpeg {match.group(1)} ({self.name}): {message}")
+                else:
+                    print(f"FFmpeg ({self.name}): {text}")
+        process.stderr.close()
+        # stderr closes when the child exits; reap it so its pid can't be mistaken for a reused one
+        process.wait()
+        self._unregister(process)
+
+    def _unregister(self, process: subprocess.Popen):
+        with _children_lock:
+            if _children.get(process.pid) is self:
+                del _children[process.pid]
+
+    @property
+    def stdin(self):
+        return self.process.stdin if self.process else None
+
+    @property
+    def stdout(self):
+        return self.process.stdout if self.process else None
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+
+    def poll(self) -> Optional[int]:
+        return self.process.poll() if self.process else None
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout: float = 5.0) -> Optional[int]:
+        """Close stdin so ffmpeg can finish its output, then terminate, then kill; reaps the child"""
+        process = self.process
+        if process is None:
+            return None
+        if process.stdin:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+        if process.poll() is None:
+            process.terminate()
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        self._unregister(process)
+        return process.returncode
+
+    def stats(self) -> dict:
+        stats = self.progress.stats() if self.progress_enabled else {}
+        stats.update({
+            "name": self.name,
+            "pid": self.pid,
+            "returncode": self.poll(),
+            "uptime": time.monotonic() - self.started_at if self.started_at else None,
+            "last_log": self.log[-1] if self.log else None,
+        })
+        return stats
+
+
+def children() -> List[FFmpegProcess]:
+    """Supervised children that are still running"""
+    with _children_lock:
+        for pid, child in list(_children.items()):
+            if child.process.poll() is not None:
+                del _children[pid]
+        return list(_children.values())
+
+
+def reap_all(timeout: float = 2.0):
+    """Stop every supervised child that is still running"""
+    for child in children():
+        child.stop(timeout)
+
+
+atexit.register(reap_all)
+
+
+def install_signal_handlers(signals: Sequence[int] = (signal.SIGINT, signal.SIGTERM)):
+    """Reap the children before the process dies of SIGINT/SIGTERM; call from the main thread.
+
+    The previous handler still runs afterwards, so Ctrl+C raises KeyboardInterrupt as usual.
+    """
+    for signum in signals:
+        previous = signal.getsignal(signum)
+
+        def handler(signum, frame, previous=previous):
+            reap_all()
+            if callable(previous):
+                previous(signum, frame)
+            elif previous != signal.SIG_IGN:
+                raise SystemExit(128 + signum)
+
+        signal.signal(signum, handler)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Run ffmpeg under the supervisor and print its live progress")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="ffmpeg arguments, e.g. -re -i in.ts -f null -")
+    parser.add_argument("--interval", type=float, default=1.0)
+    args = parser.parse_args()
+    install_signal_handlers()
+    child = FFmpegProcess(["ffmpeg"] + args.args)
+    try:
+        child.start()
+    except OSError as e:
+        raise SystemExit(f"error starting ffmpeg: {e}")
+    while child.running:
+        time.sleep(args.interval)
+        print(json.dumps(child.stats()))
+    print(json.dumps(child.stats()))
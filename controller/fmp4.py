@@ -0,0 +1,310 @@
+import struct
+from typing import List, NamedTuple, Optional, Tuple
+
+TIMESCALE = 90000  # MPEG-TS PTS/DTS clock
+TS_WRAP = 1 << 33
+
+NAL_NON_IDR = 1
+NAL_IDR = 5
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+# trun sample_flags: a sync sample depends on nothing; others depend on earlier frames
+SYNC_SAMPLE_FLAGS = 0x02000000
+NON_SYNC_SAMPLE_FLAGS = 0x01010000
+
+# Profiles whose SPS carries chroma format, bit depths and scaling lists
+HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+
+def split_nals(annexb: bytes) -> List[bytes]:
+    """Split an Annex B byte stream on its 00 00 01 / 00 00 00 01 start codes"""
+    nals = []
+    start = annexb.find(b"\x00\x00\x01")
+    while start != -1:
+        start += 3
+        end = annexb.find(b"\x00\x00\x01", start)
+        nal = annexb[start:end if end != -1 else len(annexb)]
+        if end != -1 and nal.endswith(b"\x00"):
+            # The next start code was the four-byte form
+            nal = nal[:-1]
+        if nal:
+            nals.append(nal)
+        start = end
+    return nals
+
+
+class _BitReader:
+    def __init__(self, data: bytes):
+        # Drop emulation prevention bytes (00 00 03 -> 00 00)
+        self.data = data.replace(b"\x00\x00\x03", b"\x00\x00")
+        self.pos = 0
+
+    def bit(self) -> int:
+        byte = self.data[self.pos >> 3]
+        self.pos += 1
+        return (byte >> (7 - ((self.pos - 1) & 7))) & 1
+
+    def bits(self, count: int) -> int:
+        value = 0
+        for _ in range(count):
+            value = value << 1 | self.bit()
+        return value
+
+    def ue(self) -> int:
+        zeros = 0
+        while not self.bit():
+            zeros += 1
+            if zeros > 31:
+                raise ValueError("bad exp-Golomb code")
+        return (1 << zeros) - 1 + self.bits(zeros)
+
+    def se(self) -> int:
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def parse_sps(sps: bytes) -> Tuple[int, int]:
+    """(width, height) in pixels from an H.264 SPS NAL unit, after cropping"""
+    r = _BitReader(sps[1:])
+    profile = r.bits(8)
+    r.bits(16)  # constraint flags, level
+    r.ue()      # seq_parameter_set_id
+    chroma_format = 1
+    separate_planes = 0
+    if profile in HIGH_PROFILES:
+        chroma_format = r.ue()
+        if chroma_format == 3:
+            separate_planes = r.bit()
+        r.ue()  # bit_depth_luma_minus8
+        r.ue()  # bit_depth_chroma_minus8
+        r.bit()  # qpprime_y_zero_transform_bypass_flag
+        if r.bit():  # seq_scaling_matrix_present_flag
+            for i in range(8 if chroma_format != 3 else 12):
+                if r.bit():
+                    last = following = 8
+                    for _ in range(16 if i < 6 else 64):
+                        if following:
+                            following = (last + r.se() + 256) % 256
+                        last = following or last
+    r.ue()  # log2_max_frame_num_minus4
+    poc_type = r.ue()
+    if poc_type == 0:
+        r.ue()
+    elif poc_type == 1:
+        r.bit()
+        r.se()
+        r.se()
+        for _ in range(r.ue()):
+            r.se()
+    r.ue()  # max_num_ref_frames
+    r.bit()  # gaps_in_frame_num_value_allowed_flag
+    width_mbs = r.ue() + 1
+    height_map_units = r.ue() + 1
+    frame_mbs_only = r.bit()
+    if not frame_mbs_only:
+        r.bit()  # mb_adaptive_frame_field_flag
+    r.bit()  # direct_8x8_inference_flag
+    crop = (0, 0, 0, 0)
+    if r.bit():
+        crop = (r.ue(), r.ue(), r.ue(), r.ue())
+    if chroma_format == 0 or separate_planes:
+        unit_x, unit_y = 1, 2 - frame_mbs_only
+    else:
+        unit_x = 2 if chroma_format in (1, 2) else 1
+        unit_y = (2 if chroma_format == 1 else 1) * (2 - frame_mbs_only)
+    width = width_mbs * 16 - (crop[0] + crop[1]) * unit_x
+    height = (2 - frame_mbs_only) * height_map_units * 16 - (crop[2] + crop[3]) * unit_y
+    return width, height
+
+
+def codec_string(sps: bytes) -> str:
+    """The MSE/RFC 6381 codec string for an SPS, e.g. avc1.4d401f"""
+    return "avc1." + sps[1:4].hex()
+
+
+def _box(kind: bytes, *payload: bytes) -> bytes:
+    body = b"".join(payload)
+    return struct.pack(">I", 8 + len(body)) + kind + body
+
+
+def _full_box(kind: bytes, version: int, flags: int, *payload: bytes) -> bytes:
+    return _box(kind, struct.pack(">I", version << 24 | flags), *payload)
+
+
+_MATRIX = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+
+def init_segment(sps: bytes, pps: bytes, width: int, height: int, track_id: int = 1) -> bytes:
+    """ftyp + moov for one fragmented H.264 track (avc1, parameter sets in avcC)"""
+    avcc = _box(b"avcC", bytes([1, sps[1], sps[2], sps[3], 0xFF, 0xE1]), struct.pack(">H", len(sps)), sps,
+                b"\x01", struct.pack(">H", len(pps)), pps)
+    avc1 = _box(b"avc1", bytes(6), struct.pack(">H", 1), bytes(16), struct.pack(">HH", width, height),
+                struct.pack(">II", 0x00480000, 0x00480000), bytes(4), struct.pack(">H", 1), bytes(32),
+                struct.pack(">Hh", 0x0018, -1), avcc)
+    stbl = _box(b"stbl",
+                _full_box(b"stsd", 0, 0, struct.pack(">I", 1), avc1),
+                _full_box(b"stts", 0, 0, bytes(4)),
+                _full_box(b"stsc", 0, 0, bytes(4)),
+                _full_box(b"stsz", 0, 0, bytes(8)),
+                _full_box(b"stco", 0, 0, bytes(4)))
+    minf = _box(b"minf",
+                _full_box(b"vmhd", 0, 1, bytes(8)),
+                _box(b"dinf", _full_box(b"dref", 0, 0, struct.pack(">I", 1), _full_box(b"url ", 0, 1))),
+                stbl)
+    mdia = _box(b"mdia",
+                _full_box(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, TIMESCALE, 0, 0x55C4, 0)),
+                _full_box(b"hdlr", 0, 0, bytes(4), b"vide", bytes(12), b"VideoHandler\x00"),
+                minf)
+    tkhd = _full_box(b"tkhd", 0, 3, struct.pack(">IIIII", 0, 0, track_id, 0, 0), bytes(8),
+                     struct.pack(">hhhH", 0, 0, 0, 0), _MATRIX, struct.pack(">II", width << 16, height << 16))
+    mvhd = _full_box(b"mvhd", 0, 0, struct.pack(">IIII", 0, 0, 1000, 0), struct.pack(">IH", 0x10000, 0x0100),
+                     bytes(10), _MATRIX, bytes(24), struct.pack(">I", track_id + 1))
+    mvex = _box(b"mvex", _full_box(b"trex", 0, 0, struct.pack(">IIIII", track_id, 1, 0, 0, 0)))
+    ftyp = _box(b"ftyp", b"isom", struct.pack(">I", 0x200), b"isom", b"iso6", b"avc1", b"mp41")
+    return ftyp + _box(b"moov", mvhd, _box(b"trak", tkhd, mdia), mvex)
+
+
+def media_fragment(sequence: int, decode_time: int, duration: int, composition_offset: int, sample: bytes,
+                   keyframe: bool, track_id: int = 1) -> bytes:
+    """moof + mdat carrying a single sample"""
+    # data-offset, sample duration, size, flags and composition time offset present
+    trun_flags = 0x000001 | 0x000100 | 0x000200 | 0x000400 | 0x000800
+
+    def moof(data_offset: int) -> bytes:
+        trun = _full_box(b"trun", 1, trun_flags, struct.pack(">Ii", 1, data_offset),
+                         struct.pack(">IIIi", duration, len(sample),
+                                     SYNC_SAMPLE_FLAGS if keyframe else NON_SYNC_SAMPLE_FLAGS, composition_offset))
+        return _box(b"moof",
+                    _full_box(b"mfhd", 0, 0, struct.pack(">I", sequence)),
+                    _box(b"traf",
+                         # default-base-is-moof: data offsets count from the start of this moof
+                         _full_box(b"tfhd", 0, 0x020000, struct.pack(">I", track_id)),
+                         _full_box(b"tfdt", 1, 0, struct.pack(">Q", decode_time)),
+                         trun))
+
+    size = len(moof(0))
+    return moof(size + 8) + _box(b"mdat", sample)
+
+
+def _pes_timestamp(data: bytes, offset: int) -> int:
+    b = data[offset:offset + 5]
+    return ((b[0] >> 1) & 0x07) << 30 | b[1] << 22 | (b[2] >> 1) << 15 | b[3] << 7 | b[4] >> 1
+
+
+def parse_pes(pes: bytes) -> Tuple[Optional[int], Optional[int], bytes]:
+    """(pts, dts, elementary stream payload) of a PES packet; timestamps None when absent"""
+    if len(pes) < 9 or pes[:3] != b"\x00\x00\x01":
+        return None, None, b""
+    header_length = pes[8]
+    timestamps = pes[7] >> 6
+    pts = _pes_timestamp(pes, 9) if timestamps & 0x2 and len(pes) >= 14 else None
+    dts = _pes_timestamp(pes, 14) if timestamps == 0x3 and len(pes) >= 19 else pts
+    return pts, dts, pes[9 + header_length:]
+
+
+class Fragment(NamedTuple):
+    kind: str          # "init" or "media"
+    data: bytes
+    keyframe: bool
+    arrival: float     # monotonic arrival of the access unit's first datagram
+
+
+class FMP4Muxer:
+    """Turns H.264 PES packets into an init segment and one-sample fMP4 fragments.
+
+    A sample's duration is only known once the next access unit arrives, so each
+    fragment is emitted one access unit late. Output starts at the first IDR that
+    follows an SPS and PPS; a changed SPS (e.g. a new resolution) produces a new
+    init segment. Decode times come from the PES DTS, falling back to arrival
+    times when a stream's timestamps are missing or don't advance.
+    """
+
+    def __init__(self, default_duration: int = TIMESCALE // 30):
+        self.default_duration = default_duration
+        self.sps: Optional[bytes] = None
+        self.pps: Optional[bytes] = None
+        self.codec: Optional[str] = None
+        self.width = 0
+        self.height = 0
+        self.sequence = 0
+        self.access_units = 0
+        self._started = False
+        self._pending: Optional[Tuple[int, int, bytes, bool, float]] = None
+        self._last_raw: Optional[int] = None
+        self._last_dts: Optional[int] = None
+        self._last_arrival: Optional[float] = None
+
+    def reset(self):
+        """Forget the pending access unit and wait for the next IDR, e.g. after loss"""
+        self._pending = None
+        self._started = False
+
+    def _timestamp(self, dts: Optional[int], arrival: float) -> int:
+        if dts is not None and self._last_raw is not None:
+            step = (dts - self._last_raw) % TS_WRAP
+            if 0 < step < TIMESCALE * 10:
+                self._last_raw = dts
+                return self._last_dts + step
+        if dts is not None:
+            self._last_raw = dts
+        if self._last_dts is None:
+            return 0
+        step = round((arrival - self._last_arrival) * TIMESCALE) if self._last_arrival is not None else 0
+        return self._last_dts + max(1, step or self.default_duration)
+
+    def add_pes(self, pes: bytes, arrival: float) -> List[Fragment]:
+        pts, dts, payload = parse_pes(pes)
+        if not payload:
+            return []
+        self.access_units += 1
+        nals = split_nals(payload)
+        out = []
+        keyframe = False
+        sample = []
+        for nal in nals:
+            nal_type = nal[0] & 0x1F
+            if nal_type == NAL_SPS:
+                if nal != self.sps:
+                    self.sps = nal
+                    self.codec = codec_string(nal)
+                    try:
+                        self.width, self.height = parse_sps(nal)
+                    except (IndexError, ValueError):
+                        self.width = self.height = 0
+                    self._started = False
+            elif nal_type == NAL_PPS:
+                if nal != self.pps:
+                    self.pps = nal
+                    self._started = False
+            elif nal_type == NAL_AUD:
+                continue
+            else:
+                keyframe = keyframe or nal_type == NAL_IDR
+                sample.append(struct.pack(">I", len(nal)) + nal)
+        if not sample:
+            return out
+        decode_time = self._timestamp(dts, arrival)
+        self._last_dts = decode_time
+        self._last_arrival = arrival
+        offset = (pts - dts) % TS_WRAP if pts is not None and dts is not None else 0
+        if self._pending is not None:
+            out.append(self._flush(decode_time))
+        if not self._started:
+            if not keyframe or self.sps is None or self.pps is None:
+                return out
+            self._started = True
+            out.append(Fragment("init", init_segment(self.sps, self.pps, self.width, self.height), True, arrival))
+        self._pending = (decode_time, offset if offset < TIMESCALE else 0, b"".join(sample), keyframe, arrival)
+        return out
+
+    def _flush(self, next_decode_time: int) -> Fragment:
+        decode_time, offset, sample, keyframe, arrival = self._pending
+        self._pending = None
+        duration = next_decode_time - decode_time
+        if not 0 < duration < TIMESCALE:
+            duration = self.default_duration
+        self.sequence += 1
+        return Fragment("media", media_fragment(self.sequence, decode_time, duration, offset, sample, keyframe),
+                        keyframe, arrival)
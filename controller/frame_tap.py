@@ -0,0 +1,357 @@
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Deque, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    # Frames are still available as memoryviews without NumPy
+    np = None
+
+from ffmpeg_supervisor import FFmpegProcess
+from stream_tee import Sink
+from ts_ingest import UDPIngest
+
+POLICIES = ("latest", "queue", "block")
+
+# Bytes per pixel as (numerator, denominator) and the array shape for width w, height h
+PIXEL_FORMATS = {
+    "gray": ((1, 1), lambda w, h: (h, w)),
+    "rgb24": ((3, 1), lambda w, h: (h, w, 3)),
+    "bgr24": ((3, 1), lambda w, h: (h, w, 3)),
+    "rgba": ((4, 1), lambda w, h: (h, w, 4)),
+    "bgra": ((4, 1), lambda w, h: (h, w, 4)),
+    # Planar I420: the Y plane followed by the quarter-size U and V planes
+    "yuv420p": ((3, 2), lambda w, h: (h * 3 // 2, w)),
+}
+
+
+class Frame:
+    """One decoded frame, backed by a slot of the tap's preallocated ring.
+
+    `data` is a memoryview of the slot and `array` a NumPy view of it (None without
+    NumPy); neither is a copy. The slot is reused once the frame is released, which
+    happens on release(), at the end of a with block, or when the next frame is
+    fetched from the tap. Copy the array to keep it longer.
+    """
+
+    __slots__ = ("index", "received_at", "data", "array", "_tap", "_slot")
+
+    def __init__(self, tap: "FrameTap", slot: int, index: int, received_at: float):
+        self._tap = tap
+        self._slot = slot
+        self.index = index
+        self.received_at = received_at
+        self.data = tap._views[slot]
+        self.array = tap._arrays[slot] if tap._arrays else None
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.received_at
+
+    def release(self):
+        if self._slot is not None:
+            self._tap._release(self._slot)
+            self._slot = None
+
+    def __enter__(self) -> "Frame":
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class FrameTap(Sink):
+    """Decodes the live stream with ffmpeg into raw frames for vision models.
+
+    ffmpeg scales to width x height and converts to pix_fmt, and each frame is read
+    straight into one of a fixed set of preallocated buffers. What happens when the
+    consumer falls behind depends on policy:
+
+    - "latest": only the newest frame is kept; older undelivered frames are dropped
+    - "queue": up to `depth` frames are kept; the oldest is dropped when full
+    - "block": up to `depth` frames are kept and the decoder waits for the consumer;
+      the camera stream is never held up, so the tap's ingest cursor overruns
+      instead and decoding resumes at the next keyframe
+
+    Dropped frames are counted in stats along with the delivered ones. While the
+    "block" policy is waiting for the consumer the tap counts as producing output, so
+    a slow consumer isn't mistaken for a hung decoder.
+    """
+
+    kind = "frames"
+    jitter_buffer = True
+
+    def __init__(self, width: int, height: int, ingest: Optional[UDPIngest] = None, pix_fmt: str = "rgb24",
+                 policy: str = "latest", depth: int = 4, fps: Optional[float] = None):
+        super().__init__(ingest)
+        if pix_fmt not in PIXEL_FORMATS:
+            raise ValueError(f"pix_fmt must be one of {tuple(PIXEL_FORMATS)}")
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}")
+        self.width = width
+        self.height = height
+        self.pix_fmt = pix_fmt
+        self.policy = policy
+        self.depth = 1 if policy == "latest" else max(1, depth)
+        self.fps = fps
+        (num, den), shape = PIXEL_FORMATS[pix_fmt]
+        self.frame_size = width * height * num // den
+        self.shape: Tuple[int, ...] = shape(width, height)
+        self.ffmpeg: Optional[FFmpegProcess] = None
+        self.process: Optional[subprocess.Popen] = None
+        self.decoded = 0
+        self.delivered = 0
+        self.dropped = 0
+        # One slot being filled, `depth` queued and one held by the consumer
+        slots = self.depth + 2
+        self._buffers = [bytearray(self.frame_size) for _ in range(slots)]
+        self._views = [memoryview(buffer) for buffer in self._buffers]
+        self._arrays = [np.frombuffer(buffer, dtype=np.uint8).reshape(self.shape)
+                        for buffer in self._buffers] if np is not None else None
+        # Frames that arrive while every slot is taken are read here and dropped
+        self._scratch = memoryview(bytearray(self.frame_size))
+        self._free: Deque[int] = deque(range(slots))
+        self._queued: Deque[Tuple[int, int, float]] = deque()
+        self._held: Optional[Frame] = None
+        self._cond = threading.Condition()
+        self._tapping = False
+        self._ended = False
+        self._restarting = False
+        self._blocked = False
+        self._last_output_at: Optional[float] = None
+        self._frame_reader: Optional[threading.Thread] = None
+
+    def command(self) -> List[str]:
+        filters = f"scale={self.width}:{self.height}"
+        if self.fps:
+            # Drop frames before scaling them
+            filters = f"fps={self.fps}," + filters
+        return [
+            'ffmpeg',
+            '-loglevel', 'error',
+            '-fflags', 'nobuffer',
+            '-flags', 'low_delay', '-probesize', '32',
+            '-f', 'mpegts',
+            '-i', 'pipe:0',
+            '-an',
+            '-vf', filters,
+            '-pix_fmt', self.pix_fmt,
+            '-f', 'rawvideo',
+            'pipe:1'
+        ]
+
+    def open(self):
+        self.ffmpeg = FFmpegProcess(self.command(), name="frame tap", stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            self.process = self.ffmpeg.start()
+        except OSError as e:
+            self._fail(f"error starting ffmpeg: {e}")
+            return False
+        self._tapping = True
+        self._ended = False
+        self._frame_reader = threading.Thread(target=self._read_frames, args=(self.process,), daemon=True)
+        self._frame_reader.start()
+
+    def write(self, seq, view, flags, arrival):
+        try:
+            self.process.stdin.write(view)
+        except (BrokenPipeError, ValueError, OSError) as e:
+            self._fail(f"ffmpeg input closed: {e}")
+
+    def idle(self):
+        if not self._running:
+            return
+        try:
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError, OSError) as e:
+            self._fail(f"ffmpeg input closed: {e}")
+
+    def stop(self):
+        # Wake the frame reader and any consumer; the reader then drains ffmpeg so a
+        # decoder blocked on a full pipe lets the sink thread finish its write
+        with self._cond:
+            self._tapping = False
+            self._cond.notify_all()
+        super().stop()
+
+    def restart(self) -> bool:
+        # Consumers blocked in get() wait for the new decoder instead of seeing the end
+        self._restarting = True
+        try:
+            return super().restart()
+        finally:
+            with self._cond:
+                self._restarting = False
+                self._cond.notify_all()
+
+    def close(self):
+        if self.ffmpeg:
+            self.ffmpeg.stop()
+        # The old reader must be gone before a restarted decoder reuses the slots
+        if self._frame_reader:
+            self._frame_reader.join(timeout=2)
+            self._frame_reader = None
+        self.process = None
+
+    @property
+    def last_output_at(self) -> Optional[float]:
+        return time.monotonic() if self._blocked else self._last_output_at
+
+    def _acquire_slot(self) -> Optional[int]:
+        """A slot to decode the next frame into, or None to read it into scratch and drop it"""
+        with self._cond:
+            if self.policy == "block":
+                while self._tapping and (not self._free or len(self._queued) >= self.depth):
+                    self._blocked = True
+                    self._cond.wait()
+                self._blocked = False
+            if not self._tapping:
+                return None
+            if self._free:
+                return self._free.popleft()
+            if self._queued:
+                # Every free slot is gone; recycle the oldest undelivered frame
+                self.dropped += 1
+                return self._queued.popleft()[0]
+            return None
+
+    def _read_frames(self, process: subprocess.Popen):
+        stdout = process.stdout
+        while True:
+            slot = self._acquire_slot()
+            view = self._views[slot] if slot is not None else self._scratch
+            filled = 0
+            while filled < self.frame_size:
+                count = stdout.readinto(view[filled:])
+                if not count:
+                    break
+                filled += count
+            if filled < self.frame_size:
+                if slot is not None:
+                    with self._cond:
+                        self._free.append(slot)
+                break
+            self.decoded += 1
+            self._last_output_at = time.monotonic()
+            if slot is None:
+                if self._tapping:
+                    self.dropped += 1
+                continue
+            with self._cond:
+                if len(self._queued) >= self.depth:
+                    self.dropped += 1
+                    self._free.append(self._queued.popleft()[0])
+                self._queued.append((slot, self.decoded, time.monotonic()))
+                self._cond.notify_all()
+        with self._cond:
+            self._ended = True
+            self._cond.notify_all()
+
+    def _release(self, slot: int):
+        with self._cond:
+            self._free.append(slot)
+            if self._held is not None and self._held._slot == slot:
+                self._held = None
+            self._cond.notify_all()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Frame]:
+        """The next frame under the tap's policy, or None on timeout or when the tap stops.
+
+        The frame returned by the previous call is released first.
+        """
+        if self._held is not None:
+            self._held.release()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while not self._queued:
+                if (not self._tapping or self._ended) and not self._restarting:
+                    return None
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            slot, index, received_at = self._queued.popleft()
+            self.delivered += 1
+            self._held = Frame(self, slot, index, received_at)
+            self._cond.notify_all()
+            return self._held
+
+    def frames(self, timeout: Optional[float] = None) -> Iterator[Frame]:
+        """Yield frames until the tap stops (or no frame arrives within timeout)"""
+        while True:
+            frame = self.get(timeout)
+            if frame is None:
+                return
+            yield frame
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({
+            "width": self.width,
+            "height": self.height,
+            "pix_fmt": self.pix_fmt,
+            "policy": self.policy,
+            "decoded": self.decoded,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "queued": len(self._queued),
+            "returncode": self.process.poll() if self.process else None,
+            "ffmpeg": self.ffmpeg.stats() if self.ffmpeg else None,
+        })
+        return stats
+
+
+def benchmark(source: str, policy: str = "latest", model_seconds: float = 0.1, width: int = 640,
+              height: int = 360, mbps: float = 8.0, seconds: float = 10.0) -> dict:
+    """Frames delivered and dropped for a consumer that takes model_seconds per frame"""
+    import multiprocessing
+
+    from hls_segmenter import _replay
+
+    ingest = UDPIngest(port=0, host="127.0.0.1")
+    if not ingest.start():
+        return {}
+    tap = FrameTap(width, height, ingest, policy=policy)
+    if not tap.start():
+        ingest.stop()
+        return {"policy": policy, "error": tap.error}
+    sender = multiprocessing.Process(target=_replay, args=(source, ingest.port, seconds, mbps))
+    sender.start()
+    ages = []
+    deadline = time.monotonic() + seconds
+    for frame in tap.frames(timeout=1.0):
+        ages.append(frame.age)
+        time.sleep(model_seconds)
+        if time.monotonic() > deadline:
+            break
+    sender.join()
+    tap.stop()
+    ingest.stop()
+    ages.sort()
+    return {
+        "policy": policy,
+        "model_seconds": model_seconds,
+        "frame_age_p50": ages[len(ages) // 2] if ages else None,
+        "frame_age_max": ages[-1] if ages else None,
+        "stats": tap.stats(),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Compare frame tap drop policies with a slow consumer")
+    parser.add_argument("source", help="MPEG-TS capture to replay")
+    parser.add_argument("--policy", choices=POLICIES + ("all",), default="all")
+    parser.add_argument("--model-seconds", type=float, default=0.1, help="simulated inference time per frame")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+    policies = POLICIES if args.policy == "all" else (args.policy,)
+    print(json.dumps([benchmark(args.source, p, args.model_seconds, args.width, args.height,
+                                seconds=args.seconds) for p in policies], indent=2))
@@ -0,0 +1,34 @@
+from typing import List, Optional
+
+STATUS = "gp/gpControl/status"
+SHUTTER_ON = "gp/gpControl/command/shutter?p=1"
+SHUTTER_OFF = "gp/gpControl/command/shutter?p=0"
+STREAM_STOP = "gp/gpControl/execute?p1=gpStream&c1=stop"
+STREAM_RESTART = "gp/gpControl/execute?p1=gpStream&a1=proto_v2&c1=restart"
+
+MODE_MAP = {"video": 0, "photo": 1, "burst": 2, "timelapse": 2}
+RES_MAP = {"4K": 1, "1080p": 9, "720p": 12}
+FPS_MAP = {"30fps": 5, "60fps": 6}
+FOV_MAP = {
+    "Wide": 0,
+    "Medium": 1,
+    "Narrow": 2,
+    "Linear": 4
+}
+
+
+def mode_command(mode: str) -> Optional[str]:
+    if mode.lower() not in MODE_MAP:
+        return None
+    return f"gp/gpControl/command/mode?p={MODE_MAP[mode.lower()]}"
+
+
+def video_settings_commands(resolution: str, fps: str, fov: str) -> Optional[List[str]]:
+    try:
+        return [
+            f"gp/gpControl/setting/2/{RES_MAP[resolution]}",
+            f"gp/gpControl/setting/3/{FPS_MAP[fps]}",
+            f"gp/gpControl/setting/4/{FOV_MAP[fov]}"
+        ]
+    except KeyError:
+        return None
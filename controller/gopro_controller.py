@@ -1,253 +1,603 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import requests
-from typing import Optional
+from typing import Callable, List, Optional
+import os
 import subprocess
-import threading
+import sys
 import time
-import os
-import socket
+
+import gopro_commands
+from capabilities import CapabilitySchema, SchemaCache, current_settings
+from command_client import CommandClient
+from frame_tap import FrameTap
+from status_watcher import StatusWatcher
+from hls_segmenter import HLSSegmenter, HLSTranscoder
+from hls_server import HLSServer
+from jitter_buffer import JitterBuffer
+from keepalive import default_scheduler
+from live_preview import LivePreview, player_html
+from media import MediaClient
+from metrics import REGISTRY, Metric, counter, gauge, histogram
+from recorder import PrerollRecorder
+from segment_store import SegmentStore
+from snapshot import Snapshot, SnapshotSink
+from stream_readiness import StreamReadiness, wait_until_quiet
+from stream_tee import Sink, StreamTee
+from ts_ingest import PCRDriftEstimator, UDPIngest
+from watchdog import StreamWatchdog
 
 class GoProController:
-    def __init__(self, ip: str = "10.5.5.9"):
+    def __init__(self, ip: str = "10.5.5.9", connect_timeout: float = 2.0,
+                 read_timeout: float = 5.0, retries: int = 2, preview_host: str = "localhost",
+                 preview_http_port: int = 0, stall_ms: int = 1000):
         self.ip = ip
         self.base_url = f"http://{ip}"
-        self.stream_process = None
+        self.tee: Optional[StreamTee] = None
         self.stream_active = False
         self.preview_port = 8554
+        self.client = CommandClient(
+            self.base_url,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retries=retries
+        )
+        self.status_watcher = StatusWatcher(self._fetch_status)
+        self.ingest: Optional[UDPIngest] = None
+        self.preview_host = preview_host
+        self.segment_store = SegmentStore()
+        self.hls_server = HLSServer(self.segment_store, port=preview_http_port)
+        self.keep_alive = default_scheduler()
+        self.readiness = StreamReadiness()
+        self.first_packet_timeout = 5.0
+        self.first_segment_timeout = 10.0
+        self.pcr_drift = PCRDriftEstimator()
+        self._media: Optional[MediaClient] = None
+        self.schema_cache = SchemaCache()
+        self._schema: Optional[CapabilitySchema] = None
+        self.settings_errors: List[str] = []
+        self.watchdog = StreamWatchdog(
+            lambda: self.ingest,
+            lambda: dict(self.tee.sinks) if self.tee else {},
+            {
+                "keep_alive": lambda: self.keep_alive.send_now(self.ip, self.preview_port),
+                "restart_stream": lambda: self.client.get(gopro_commands.STREAM_RESTART),
+                "restart_pipeline": self._restart_pipeline,
+            },
+            lambda name: self.tee.restart(name) if self.tee else False,
+            stall_ms=stall_ms,
+        )
+        REGISTRY.register(f"camera:{ip}", self.collect_metrics)
 
     def send_command(self, command: str) -> Optional[requests.Response]:
-        try:
-            response = requests.get(f"{self.base_url}/{command}")
-            response.raise_for_status()
-            return response
-        except requests.exceptions.RequestException:
-            return None
-
-    def status(self) -> Optional[dict]:
-        response = self.send_command("gp/gpControl/status")
+        response = self.client.get(command)
+        if command != gopro_commands.STATUS:
+            self.status_watcher.boost()
+        return response
+
+    def send_commands(self, commands: list) -> bool:
+        """Pipeline several commands over one connection, preserving their order"""
+        ok = all(self.client.pipeline(commands))
+        self.status_watcher.boost()
+        return ok
+
+    def latency_stats(self) -> dict:
+        """Per-endpoint command latency histograms"""
+        return self.client.latency_stats()
+
+    def _fetch_status(self) -> Optional[dict]:
+        response = self.send_command(gopro_commands.STATUS)
         if response:
             return response.json()
         return None
 
+    def status(self, max_age: Optional[float] = None) -> Optional[dict]:
+        """Camera status, served from the watcher's cache when it is fresh enough"""
+        self.status_watcher.start()
+        return self.status_watcher.get(max_age)
+
+    def subscribe_status(self, callback: Callable[[dict], None]) -> Callable[[], None]:
+        """Receive only the changed status/settings keys; returns an unsubscribe function"""
+        self.status_watcher.start()
+        return self.status_watcher.subscribe(callback)
+
+    def start_ingest(self) -> Optional[UDPIngest]:
+        """Receive the camera's UDP MPEG-TS feed in-process"""
+        if self.ingest is None:
+            ingest = UDPIngest(port=self.preview_port)
+            if not ingest.start():
+                return None
+            self.ingest = ingest
+            self.tee = StreamTee(ingest)
+            self.readiness.attach(ingest)
+            self.pcr_drift = PCRDriftEstimator()
+            ingest.indexer.on_pcr = self.pcr_drift.update
+        return self.ingest
+
+    def stop_ingest(self):
+        if self.tee is not None:
+            self.tee.stop()
+            self.tee = None
+        if self.ingest is not None:
+            self.readiness.detach()
+            self.ingest.stop()
+            self.ingest = None
+
+    def ingest_stats(self) -> Optional[dict]:
+        """Throughput, loss and TS index counters of the in-process ingest"""
+        return self.ingest.stats() if self.ingest else None
+
+    def start_stream(self) -> bool:
+        """Start the camera's live stream, the local ingest and the keep-alive"""
+        if self.stream_active:
+            return True
+        # Listen before asking the camera to stream so the first packet isn't missed
+        if not self.start_ingest():
+            return False
+        # Register with the shared scheduler that sends _GPHD_:0:0:2:0 keep-alives
+        # for every camera from one socket; control commands still go to self.ip
+        self.keep_alive.add(self.ip, self.preview_port)
+        if not self.enable_preview_mode() or not self.readiness.wait("first_packet", self.first_packet_timeout):
+            print(f"Stream did not start, reached phases: {self.readiness.timings()}")
+            self.keep_alive.remove(self.ip, self.preview_port)
+            self.stop_ingest()
+            return False
+        self.stream_active = True
+        self.watchdog.start()
+        return True
+
+    def startup_timings(self) -> dict:
+        """Seconds from the restart command to each startup phase of the last stream start"""
+        return self.readiness.timings()
+
+    def stop_stream(self):
+        self.watchdog.stop()
+        self.send_command(gopro_commands.STREAM_STOP)
+        self.stream_active = False
+        self.keep_alive.remove(self.ip, self.preview_port)
+        self.stop_ingest()
+
+    def _restart_pipeline(self):
+        """Rebind the ingest socket and restart every sink in place, then restart the camera's stream"""
+        ingest, tee = self.ingest, self.tee
+        if ingest is None or tee is None:
+            return
+        ingest.stop()
+        ingest.start()
+        for name in list(tee.sinks):
+            tee.restart(name)
+        self.client.get(gopro_commands.STREAM_RESTART)
+        self.keep_alive.send_now(self.ip, self.preview_port)
+
+    def attach_sink(self, name: str, sink: Sink) -> bool:
+        """Fan the single ingest out to another sink (file, UDP restream, HLS, tap...)"""
+        if not self.start_stream():
+            return False
+        return self.tee.attach(name, sink)
+
+    def detach_sink(self, name: str) -> Optional[Sink]:
+        """Detach a sink; the stream stops once no sinks are left"""
+        if self.tee is None:
+            return None
+        sink = self.tee.detach(name)
+        if not self.tee.sinks:
+            self.stop_stream()
+        return sink
+
+    def sink_stats(self) -> dict:
+        return self.tee.stats() if self.tee else {}
+
+    @property
+    def preview_pipeline(self) -> Optional[Sink]:
+        return self.tee.get("preview") if self.tee else None
+
+    @property
+    def preview_active(self) -> bool:
+        return self.preview_pipeline is not None
+
+    def close(self):
+        self.watchdog.stop()
+        if self.preview_active:
+            self.stop_preview()
+        if self.stream_active:
+            self.stop_stream()
+        self.status_watcher.stop()
+        self.client.close()
+        if self._media is not None:
+            self._media.close()
+        REGISTRY.unregister(f"camera:{self.ip}")
+
+    def collect_metrics(self) -> List[Metric]:
+        """Per-stage latency histograms and stream health for the /metrics endpoint.
+
+        Stage latencies are measured from the user-space receive timestamp of each
+        datagram; they don't include time spent in the kernel socket buffer.
+        """
+        camera = self.ip
+        metrics = []
+        for endpoint, hist in self.client.stats.items():
+            metrics.append(histogram("gopro_command_latency_seconds", "Camera HTTP command round trip",
+                                     hist, camera=camera, endpoint=endpoint))
+        ingest = self.ingest
+        if ingest is not None:
+            indexer = ingest.indexer
+            last_age = time.monotonic() - ingest.last_packet_at if ingest.last_packet_at else None
+            metrics += [
+                histogram("gopro_ingest_index_seconds", "Datagram receive to TS index complete",
+                          ingest.index_latency, camera=camera),
+                counter("gopro_ingest_datagrams_total", "Datagrams received", ingest.datagrams, camera=camera),
+                counter("gopro_ingest_bytes_total", "Bytes received", ingest.bytes, camera=camera),
+                counter("gopro_ts_cc_errors_total", "MPEG-TS continuity counter errors",
+                        indexer.cc_errors, camera=camera),
+                counter("gopro_ts_lost_packets_total", "TS packets lost according to continuity counters",
+                        indexer.lost_packets, camera=camera),
+                gauge("gopro_ingest_last_packet_age_seconds", "Time since the last datagram", last_age,
+                      camera=camera),
+                gauge("gopro_pcr_drift_ppm", "Camera PCR clock rate versus local clock", self.pcr_drift.drift_ppm,
+                      camera=camera),
+                gauge("gopro_pcr_offset_seconds", "Arrival delay accumulated against the PCR timeline",
+                      self.pcr_drift.offset, camera=camera),
+            ]
+        if self.tee is not None:
+            for name, sink in list(self.tee.sinks.items()):
+                reader = sink._reader
+                metrics += [
+                    histogram("gopro_sink_lag_seconds", "Datagram arrival to handled by the sink",
+                              sink.lag, camera=camera, sink=name),
+                    counter("gopro_sink_dropped_datagrams_total", "Datagrams a slow sink skipped",
+                            reader.skipped if reader else 0, camera=camera, sink=name),
+                ]
+                if isinstance(reader, JitterBuffer):
+                    metrics += [
+                        gauge("gopro_jitter_buffer_delay_seconds", "Current reorder/loss wait of the jitter buffer",
+                              reader.delay, camera=camera, sink=name),
+                        gauge("gopro_jitter_seconds", "Smoothed inter-arrival jitter", reader.jitter,
+                              camera=camera, sink=name),
+                        counter("gopro_jitter_buffer_reordered_total", "Datagrams put back in order",
+                                reader.reordered, camera=camera, sink=name),
+                        counter("gopro_jitter_buffer_gaps_total", "Gaps given up on, resuming at a keyframe",
+                                reader.gaps, camera=camera, sink=name),
+                        counter("gopro_jitter_buffer_late_total", "Datagrams that arrived after their gap was given up on",
+                                reader.late, camera=camera, sink=name),
+                        counter("gopro_jitter_buffer_discarded_total", "Datagrams discarded while waiting for a keyframe",
+                                reader.discarded, camera=camera, sink=name),
+                    ]
+                if isinstance(sink, HLSSegmenter):
+                    metrics.append(histogram("gopro_segment_publish_seconds",
+                                             "First datagram of a segment to segment published",
+                                             sink.segment_latency, camera=camera))
+                if isinstance(sink, LivePreview):
+                    metrics += [
+                        histogram("gopro_live_send_seconds", "Access unit arrival to fragment sent to a viewer",
+                                  sink.send_latency, camera=camera),
+                        gauge("gopro_live_viewers", "Connected low latency preview viewers", sink.viewers,
+                              camera=camera),
+                        counter("gopro_live_dropped_fragments_total", "Fragments skipped for slow viewers",
+                                sink.dropped_fragments, camera=camera),
+                        counter("gopro_live_viewers_timed_out_total", "Viewers disconnected for not reading",
+                                sink.viewers_timed_out, camera=camera),
+                    ]
+                if isinstance(sink, FrameTap):
+                    metrics += [
+                        counter("gopro_frame_tap_delivered_total", "Decoded frames handed to the consumer",
+                                sink.delivered, camera=camera, sink=name),
+                        counter("gopro_frame_tap_dropped_total", "Decoded frames dropped under the tap's policy",
+                                sink.dropped, camera=camera, sink=name),
+                    ]
+                ffmpeg = getattr(sink, "ffmpeg", None)
+                if ffmpeg is not None and ffmpeg.progress.updated_at is not None:
+                    progress = ffmpeg.progress
+                    metrics += [
+                        gauge("gopro_ffmpeg_fps", "Frames per second ffmpeg is producing", progress.fps,
+                              camera=camera, sink=name),
+                        gauge("gopro_ffmpeg_bitrate_kbps", "ffmpeg output bitrate", progress.bitrate_kbps,
+                              camera=camera, sink=name),
+                        gauge("gopro_ffmpeg_speed", "ffmpeg processing speed relative to real time",
+                              progress.speed, camera=camera, sink=name),
+                        gauge("gopro_ffmpeg_encode_lag_seconds", "How far ffmpeg's output has fallen behind real time",
+                              progress.encode_lag, camera=camera, sink=name),
+                        counter("gopro_ffmpeg_dropped_frames_total", "Frames ffmpeg dropped to keep up",
+                                progress.drop_frames, camera=camera, sink=name),
+                        counter("gopro_ffmpeg_duplicated_frames_total", "Frames ffmpeg duplicated to fill gaps",
+                                progress.dup_frames, camera=camera, sink=name),
+                    ]
+                if isinstance(sink, SnapshotSink):
+                    latest = sink.latest
+                    metrics += [
+                        histogram("gopro_snapshot_seconds", "Keyframe arrival to thumbnail cached",
+                                  sink.snapshot_latency, camera=camera),
+                        gauge("gopro_snapshot_age_seconds", "Age of the cached thumbnail",
+                              latest.age if latest else None, camera=camera),
+                        counter("gopro_snapshot_decode_errors_total", "Keyframes ffmpeg failed to decode",
+                                sink.decode_errors, camera=camera),
+                    ]
+        metrics += [
+            histogram("gopro_segment_serve_seconds", "Segment published to first requested by a player",
+                      self.segment_store.serve_latency, camera=camera),
+            counter("gopro_segments_evicted_total", "Segments evicted from the in-memory store",
+                    self.segment_store.evicted, camera=camera),
+        ]
+        watchdog = self.watchdog
+        metrics += [
+            histogram("gopro_stream_recovery_seconds", "Last packet before a stall to first packet after recovery",
+                      watchdog.recovery, camera=camera),
+            counter("gopro_stream_stalls_total", "Stalls detected by the watchdog", watchdog.stalls, camera=camera),
+            counter("gopro_stream_recovery_failures_total", "Recovery attempts where every action failed",
+                    watchdog.failures, camera=camera),
+        ]
+        for action, count in watchdog.recovered_by.items():
+            metrics.append(counter("gopro_stream_recoveries_total", "Stalls recovered, by the action that worked",
+                                   count, camera=camera, action=action))
+        for name, count in watchdog.sink_restarts.items():
+            metrics.append(counter("gopro_sink_restarts_total", "Sinks restarted after dying or stalling",
+                                   count, camera=camera, sink=name))
+        return metrics
+
     def set_mode(self, mode: str) -> bool:
-        mode_map = {"video": 0, "photo": 1, "burst": 2, "timelapse": 2}
-        if mode.lower() not in mode_map:
+        command = gopro_commands.mode_command(mode)
+        if command is None:
             return False
-        response = self.send_command(f"gp/gpControl/command/mode?p={mode_map[mode.lower()]}")
+        response = self.send_command(command)
         return response is not None
 
     def start_recording(self) -> bool:
-        response = self.send_command("gp/gpControl/command/shutter?p=1")
-        return response is not None
+        response = self.send_command(gopro_commands.SHUTTER_ON)
+        if response is None:
+            return False
+        # A local pre-roll recorder follows the camera's shutter, once the camera has started
+        self.record_locally(True)
+        return True
 
     def stop_recording(self) -> bool:
-        response = self.send_command("gp/gpControl/command/shutter?p=0")
+        response = self.send_command(gopro_commands.SHUTTER_OFF)
+        self.record_locally(False)
         return response is not None
 
+    def enable_preroll(self, directory: str, **options) -> bool:
+        """Keep the last seconds of the live stream in memory, ready to be recorded locally"""
+        return self.attach_sink("recorder", PrerollRecorder(directory, **options))
+
+    def disable_preroll(self):
+        self.detach_sink("recorder")
+
+    def record_locally(self, active: bool) -> bool:
+        """Start (with the buffered pre-roll) or stop the local recording; False without a recorder"""
+        recorder = self.tee.get("recorder") if self.tee else None
+        if recorder is None:
+            return False
+        if active:
+            recorder.trigger()
+        else:
+            recorder.release()
+        return True
+
+    def enable_snapshots(self, width: int = 320, interval: float = 2.0, **options) -> bool:
+        """Keep a JPEG thumbnail of a recent keyframe, without running the preview decoder"""
+        return self.attach_sink("snapshot", SnapshotSink(width=width, interval=interval, **options))
+
+    def disable_snapshots(self):
+        self.detach_sink("snapshot")
+
+    def snapshot(self, max_age: Optional[float] = None) -> Optional[Snapshot]:
+        """The cached thumbnail if it is younger than max_age seconds; None without one"""
+        sink = self.tee.get("snapshot") if self.tee else None
+        return sink.snapshot(max_age) if sink else None
+
+    def frame_tap(self, width: int, height: int, pix_fmt: str = "rgb24", policy: str = "latest",
+                  depth: int = 4, fps: Optional[float] = None, name: str = "frames") -> Optional[FrameTap]:
+        """Decoded frames as NumPy arrays for analytics; iterate tap.frames() or call tap.get()"""
+        tap = FrameTap(width, height, pix_fmt=pix_fmt, policy=policy, depth=depth, fps=fps)
+        return tap if self.attach_sink(name, tap) else None
+
     def take_photo(self) -> bool:
-        response = self.send_command("gp/gpControl/command/shutter?p=1")
+        response = self.send_command(gopro_commands.SHUTTER_ON)
         return response is not None
 
+    def capabilities(self) -> Optional[CapabilitySchema]:
+        """The camera's settings schema, cached on disk per model and firmware"""
+        if self._schema is None:
+            self._schema = self.schema_cache.fetch(self.client)
+        return self._schema
+
+    def apply_settings(self, requested: dict, mode: Optional[str] = None) -> bool:
+        """Validate {"resolution": "1080p", ...} against the schema and send only what changes.
+
+        Errors are left in settings_errors. Settings go out in dependency order, so
+        e.g. the resolution is set before the frame rates it allows.
+        """
+        schema = self.capabilities()
+        if schema is None:
+            self.settings_errors = ["could not read the camera's settings schema"]
+            return False
+        changes, errors = schema.resolve(requested, mode)
+        current = current_settings(self.status(max_age=1.0))
+        errors += schema.validate({**current, **changes}, changes)
+        self.settings_errors = errors
+        if errors:
+            print("Invalid settings: " + "; ".join(errors))
+            return False
+        commands = [f"gp/gpControl/setting/{setting_id}/{value}"
+                    for setting_id, value in schema.plan(changes, current)]
+        if not commands:
+            return True
+        return self.send_commands(commands)
+
     def set_video_settings(self, resolution: str, fps: str, fov: str) -> bool:
-        res_map = {"4K": 1, "1080p": 9, "720p": 12}
-        fps_map = {"30fps": 5, "60fps": 6}
-        fov_map = {
-            "Wide": 0,
-            "Medium": 1,
-            "Narrow": 2,
-            "Linear": 4
-        }
+        if self.capabilities() is not None:
+            return self.apply_settings({"resolution": resolution, "fps": fps, "fov": fov}, mode="video")
+        commands = gopro_commands.video_settings_commands(resolution, fps, fov)
+        if commands is None:
+            return False
+        return self.send_commands(commands)
 
-        try:
-            commands = [
-                f"gp/gpControl/setting/2/{res_map[resolution]}",
-                f"gp/gpControl/setting/3/{fps_map[fps]}",
-                f"gp/gpControl/setting/4/{fov_map[fov]}"
-            ]
+    def media(self, directory: str, concurrency: int = 4) -> MediaClient:
+        """Media listing/download client for this camera, writing under directory"""
+        if self._media is None or self._media.directory != directory or self._media.concurrency != concurrency:
+            if self._media is not None:
+                self._media.close()
+            self._media = MediaClient(self.ip, directory, concurrency)
+        return self._media
 
-            for cmd in commands:
-                if not self.send_command(cmd):
-                    return False
-            return True
-        except KeyError:
-            return False
+    def download_media(self, directory: str, concurrency: int = 4,
+                       on_progress: Optional[Callable[[dict], None]] = None) -> dict:
+        """Fetch every file on the SD card that isn't already in directory"""
+        return self.media(directory, concurrency).download(on_progress=on_progress)
 
     def enable_preview_mode(self) -> bool:
         """Enable preview mode on the GoPro using proto_v2 restart for reduced latency"""
         try:
-            # First, stop any existing stream
-            self.send_command("gp/gpControl/execute?p1=gpStream&c1=stop")
-            time.sleep(2)  # Wait for the previous stream to stop
+            # First, stop any existing stream and wait until its packets stop arriving
+            self.send_command(gopro_commands.STREAM_STOP)
+            wait_until_quiet(self.ingest)
 
             # Use the proto_v2 restart command for low latency streaming
-            response = self.send_command("gp/gpControl/execute?p1=gpStream&a1=proto_v2&c1=restart")
+            self.readiness.begin()
+            self.readiness.mark("command")
+            response = self.send_command(gopro_commands.STREAM_RESTART)
             if not response:
                 return False
-
-            # (Optional) Additional settings can be applied here if needed
-            time.sleep(3)  # Allow time for the stream to initialize
+            self.readiness.mark("ack")
             return True
         except Exception as e:
             print(f"Error enabling preview mode: {e}")
             return False
 
-    def check_preview_port(self) -> bool:
-        """Check if the preview port is available"""
+    def start_preview(self, mode: str = "passthrough",
+                      on_progress: Optional[Callable[[str, str], None]] = None) -> bool:
+        """Start the preview.
+
+        mode="passthrough" segments the camera's H.264 at keyframes without re-encoding
+        and falls back to transcoding if the GOP structure doesn't allow it;
+        mode="transcode" always re-encodes with libx264; mode="low_latency" skips HLS
+        and pushes fMP4 fragments to browsers over a WebSocket. on_progress receives
+        (level, message) pairs, level being "info", "error" or "success".
+        """
+        report = on_progress or (lambda level, message: print(message))
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.settimeout(5)
-            sock.bind(('', self.preview_port))
-            print("Successfully bound to preview port")
-            sock.close()
-            return True
-        except Exception as e:
-            print(f"Error checking preview port: {e}")
-            return False
+            report("info", "Initializing low latency preview stream...")
 
-    def start_preview(self) -> bool:
-        try:
-            st.info("Initializing low latency preview stream...")
-
-            st.write("Testing GoPro connection...")
+            report("info", "Testing GoPro connection...")
             status = self.status()
             if status:
-                st.write("GoPro is responding to commands")
+                report("info", "GoPro is responding to commands")
             else:
-                st.error("GoPro is not responding to commands")
+                report("error", "GoPro is not responding to commands")
                 return False
 
-            st.write("Enabling low latency preview mode...")
-            if not self.enable_preview_mode():
-                st.error("Failed to enable preview mode on GoPro")
+            report("info", "Enabling low latency preview mode...")
+            if not self.start_stream():
+                report("error", "Failed to enable preview mode on GoPro or bind the preview port")
                 return False
 
-            # Determine streaming IP based on camera model (Session cameras stream from 10.5.5.100)
-            stream_ip = self.ip  # default
-            if status and "info" in status and "model_name" in status["info"]:
-                model = status["info"]["model_name"]
-                if "Session" in model:
-                    stream_ip = "10.5.5.100"
-            st.write(f"Using stream IP: {stream_ip}")
-
-            st.write("Checking preview port...")
-            if not self.check_preview_port():
-                st.error("No data received on preview port. Check GoPro connection.")
+            if not self.hls_server.start():
+                report("error", "Could not start the preview HTTP server")
                 return False
+            self.segment_store.clear()
 
-            output_path = "stream.m3u8"
-            if os.path.exists(output_path):
-                os.remove(output_path)
-
-            # Set low latency options (adapted from provided logic)
-            latency_options = ['-flags', 'low_delay', '-max_delay', '0', '-probesize', '32']
-            udp_options = "?fifo_size=0"
-
-            ffmpeg_cmd = [
-                'ffmpeg',
-                '-fflags', 'nobuffer'
-            ] + latency_options + [
-                '-f', 'mpegts',
-                '-i', f'udp://{stream_ip}:{self.preview_port}{udp_options}',
-                '-pix_fmt', 'yuv420p',
-                '-c:v', 'libx264',
-                '-preset', 'ultrafast',
-                '-tune', 'zerolatency',
-                '-f', 'hls',
-                '-hls_time', '1',
-                '-hls_list_size', '3',
-                '-hls_flags', 'delete_segments+omit_endlist',
-                '-hls_segment_type', 'mpegts',
-                output_path
-            ]
+            if mode == "low_latency":
+                pipeline = LivePreview(self.ingest)
+                self.hls_server.live = pipeline
+            elif mode == "passthrough":
+                pipeline = HLSSegmenter(self.ingest, self.segment_store, on_fallback=self._fallback_to_transcode)
+            else:
+                pipeline = HLSTranscoder(self.ingest, self.segment_store, self._upload_url())
+            if not self.tee.attach("preview", pipeline):
+                report("error", "Failed to start the preview pipeline")
+                self.stop_preview()
+                return False
 
-            # Print FFmpeg command for debugging
-            print("FFmpeg command:", " ".join(ffmpeg_cmd))
-
-            self.stream_process = subprocess.Popen(
-                ffmpeg_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
-            )
-
-            def monitor_ffmpeg():
-                while self.stream_process:
-                    error = self.stream_process.stderr.readline()
-                    if error and 'error' in error.lower():
-                        print(f"FFmpeg error: {error.strip()}")
-
-            threading.Thread(target=monitor_ffmpeg, daemon=True).start()
-
-            # Start a keep-alive thread to continuously send UDP messages to the camera
-            def send_keep_alive():
-                KEEP_ALIVE_PERIOD = 2.5  # seconds
-                # The keep-alive message follows the format: _GPHD_:0:0:2:0\n
-                message = "_GPHD_:0:0:2:0\n".encode('utf-8')
-                udp_port = self.preview_port  # typically 8554
-                control_ip = self.ip  # control commands are still sent to self.ip
-                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                while self.stream_active:
-                    try:
-                        sock.sendto(message, (control_ip, udp_port))
-                    except Exception as e:
-                        print("Keep-alive error:", e)
-                    time.sleep(KEEP_ALIVE_PERIOD)
-
-            self.stream_active = True
-            threading.Thread(target=send_keep_alive, daemon=True).start()
-
-            # Wait for the output HLS file to be created as a sign the stream is up
-            timeout = 10
-            start_time = time.time()
-            while not os.path.exists(output_path):
-                if time.time() - start_time > timeout:
-                    st.error("Timeout waiting for stream to start")
+            # The first segment lands in the store right after the second keyframe (the
+            # low latency init segment at the first), so wait on that event rather than polling
+            if isinstance(pipeline, LivePreview):
+                ready = pipeline.wait_ready
+            else:
+                ready = lambda timeout: self.segment_store.wait_for(0, timeout)
+            deadline = time.monotonic() + self.first_segment_timeout
+            while not ready(0.5):
+                if time.monotonic() > deadline:
+                    report("error", f"Timeout waiting for stream to start (reached {self.readiness.state})")
                     self.stop_preview()
                     return False
-                if self.stream_process.poll() is not None:
-                    error_output = self.stream_process.stderr.read()
-                    st.error(f"FFmpeg process failed: {error_output}")
+                pipeline = self.preview_pipeline
+                if pipeline is None or not pipeline.running and not isinstance(pipeline, HLSSegmenter):
+                    report("error", f"Preview pipeline failed: {pipeline.stats() if pipeline else 'stopped'}")
                     self.stop_preview()
                     return False
-                time.sleep(0.5)
+            self.readiness.mark("ready")
+            report("info", "Startup timings (s): " + ", ".join(
+                f"{phase} {seconds:.2f}" for phase, seconds in self.startup_timings().items()
+            ))
 
-            st.success("Low latency preview stream started successfully")
+            report("success",
+                   f"Low latency preview stream started successfully ({self.preview_pipeline.stats()['mode']})")
             return True
 
         except Exception as e:
-            st.error(f"Error starting preview: {str(e)}")
+            report("error", f"Error starting preview: {str(e)}")
             self.stop_preview()
             return False
 
+    def _fallback_to_transcode(self, reason: str):
+        """Called from the segmenter thread when passthrough segmenting isn't possible"""
+        if self.tee is None:
+            return
+        self.segment_store.clear()
+        self.tee.attach("preview", HLSTranscoder(self.ingest, self.segment_store, self._upload_url()))
+
+    def _upload_url(self) -> str:
+        return f"http://127.0.0.1:{self.hls_server.port}"
+
+    def preview_url(self) -> str:
+        """Playlist URL of this camera's embedded HLS server, or the WebSocket URL in low latency mode"""
+        if isinstance(self.preview_pipeline, LivePreview):
+            return self.hls_server.live_url(self.preview_host)
+        return self.hls_server.url(self.preview_host)
+
+    def keep_alive_stats(self) -> Optional[dict]:
+        """Send counts and send-time jitter of this camera's keep-alive"""
+        return self.keep_alive.stats().get(f"{self.ip}:{self.preview_port}")
+
+    def preview_stats(self) -> Optional[dict]:
+        if not self.preview_pipeline:
+            return None
+        stats = self.preview_pipeline.stats()
+        stats["store"] = self.segment_store.stats()
+        return stats
+
     def stop_preview(self) -> bool:
         try:
-            self.send_command("gp/gpControl/execute?p1=gpStream&c1=stop")
-
-            if self.stream_process:
-                self.stream_process.terminate()
-                try:
-                    self.stream_process.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    self.stream_process.kill()
-                self.stream_process = None
-
-            self.stream_active = False
-
-            try:
-                if os.path.exists("stream.m3u8"):
-                    os.remove("stream.m3u8")
-                for file in os.listdir():
-                    if file.startswith("stream") and file.endswith(".ts"):
-                        os.remove(file)
-            except Exception as e:
-                print(f"Error cleaning up stream files: {e}")
-
+            self.hls_server.live = None
+            if self.detach_sink("preview"):
+                self.segment_store.clear()
+            self.hls_server.stop()
+            if self.stream_active and not self.sink_stats():
+                self.stop_stream()
             return True
 
         except Exception as e:
             print(f"Error stopping preview: {e}")
             return False
 
+def manager_client():
+    """Client for the stream manager daemon, starting the daemon in the background if needed"""
+    from stream_manager import ManagerClient
+
+    client = ManagerClient()
+    if client.available():
+        return client
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stream_manager.py")
+    # A session of its own, so the daemon outlives this Streamlit server
+    subprocess.Popen([sys.executable, script], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + 5.0
+    while time.monotonic() < deadline:
+        if client.available():
+            return client
+        time.sleep(0.2)
+    client.close()
+    return None
+
+
 def main():
     st.set_page_config(
         page_title="GoPro HERO5 Session Controller",
@@ -257,37 +607,69 @@ def main():
 
     st.title("GoPro HERO5 Session Controller")
 
-    if "gopro" not in st.session_state:
-        st.session_state.gopro = None
+    # The stream manager owns the cameras and their pipelines; this script only
+    # sends it requests, so no rerun ever waits on the camera for long
+    if st.session_state.get("manager") is None:
+        st.session_state.manager = manager_client()
+    manager = st.session_state.manager
+    if manager is None:
+        st.error("Could not reach or start the stream manager (python stream_manager.py)")
+        return
+    if "camera_ip" not in st.session_state:
+        st.session_state.camera_ip = None
+    if "commands" not in st.session_state:
+        st.session_state.commands = []
 
     with st.sidebar:
         st.header("Connection Settings")
         gopro_ip = st.text_input("GoPro IP Address", "10.5.5.9")
 
         if st.button("Connect to GoPro"):
-            try:
-                controller = GoProController(ip=gopro_ip)
-                status = controller.status()
-                if status:
-                    st.session_state.gopro = controller
-                    st.success("Connected to GoPro successfully!")
-                else:
-                    st.error("Could not connect to GoPro. Check IP and connection.")
-            except Exception as e:
-                st.error(f"Connection error: {str(e)}")
+            if manager.connect(gopro_ip) is not None:
+                st.session_state.camera_ip = gopro_ip
+            else:
+                st.error("The stream manager did not accept the connection request")
+
+    ip = st.session_state.camera_ip
+    camera = manager.camera(ip) if ip else None
+    # The manager has a controller for the camera once it has answered a status request
+    connected = camera is not None and "stream_active" in camera
+
+    def require_connection() -> bool:
+        if not connected:
+            st.error("Please connect to GoPro first")
+        return connected
+
+    # Camera commands run as jobs in the manager; their outcome is reported on a later rerun
+    def command(job: Optional[dict], success: str, failure: str):
+        if job is None:
+            st.error(failure)
+        else:
+            st.session_state.commands.append({"ip": ip, "id": job["id"], "success": success, "failure": failure})
+
+    def report_commands():
+        pending = []
+        for sent in st.session_state.commands:
+            job = manager.job(sent["ip"], sent["id"])
+            if job is None or job["state"] == "failed":
+                st.error(sent["failure"])
+            elif job["state"] == "done":
+                st.success(sent["success"])
+            else:
+                pending.append(sent)
+        st.session_state.commands = pending
+
+    with st.sidebar:
+        if camera is not None:
+            st.caption(f"{ip}: {camera['state']}")
 
         st.header("Camera Mode")
         mode_options = ["Video", "Photo", "Burst", "TimeLapse"]
         selected_mode = st.radio("Select Mode", mode_options)
 
         if st.button("Set Mode"):
-            if st.session_state.gopro:
-                if st.session_state.gopro.set_mode(selected_mode):
-                    st.success(f"Mode set to {selected_mode}")
-                else:
-                    st.error("Failed to set mode")
-            else:
-                st.error("Please connect to GoPro first")
+            if require_connection():
+                command(manager.set_mode(ip, selected_mode), f"Mode set to {selected_mode}", "Failed to set mode")
 
         if selected_mode == "Video":
             st.header("Video Settings")
@@ -296,63 +678,140 @@ def main():
             fov = st.selectbox("Field of View", ["Wide", "Medium", "Narrow", "Linear"])
 
             if st.button("Apply Video Settings"):
-                if st.session_state.gopro:
-                    if st.session_state.gopro.set_video_settings(resolution, framerate, fov):
-                        st.success("Video settings applied successfully")
-                    else:
-                        st.error("Failed to apply video settings")
-                else:
-                    st.error("Please connect to GoPro first")
+                if require_connection():
+                    command(manager.set_video_settings(ip, resolution, framerate, fov),
+                            "Video settings applied successfully", "Failed to apply video settings")
 
     st.header("Camera Controls")
     col1, col2, col3 = st.columns(3)
 
     with col1:
         if st.button("Start Recording", use_container_width=True):
-            if st.session_state.gopro:
-                if st.session_state.gopro.start_recording():
-                    st.success("Recording started")
-                else:
-                    st.error("Failed to start recording")
-            else:
-                st.error("Please connect to GoPro first")
+            if require_connection():
+                command(manager.start_recording(ip), "Recording started", "Failed to start recording")
 
     with col2:
         if st.button("Stop Recording", use_container_width=True):
-            if st.session_state.gopro:
-                if st.session_state.gopro.stop_recording():
-                    st.success("Recording stopped")
-                else:
-                    st.error("Failed to stop recording")
-            else:
-                st.error("Please connect to GoPro first")
+            if require_connection():
+                command(manager.stop_recording(ip), "Recording stopped", "Failed to stop recording")
 
     with col3:
         if st.button("Take Photo", use_container_width=True):
-            if st.session_state.gopro:
-                if st.session_state.gopro.take_photo():
-                    st.success("Photo taken")
-                else:
-                    st.error("Failed to take photo")
-            else:
-                st.error("Please connect to GoPro first")
+            if require_connection():
+                command(manager.take_photo(ip), "Photo taken", "Failed to take photo")
+
+    report_commands()
+
+    if connected:
+        with st.expander("Command Latency"):
+            st.json(camera["latency"])
+
+    # Toggles act on change only: the pipeline is shared with every other viewer,
+    # so a viewer's unchanged checkbox must never tear it down
+    def toggle(key: str, start: Callable[[], Optional[dict]], stop: Callable[[], Optional[dict]]):
+        if not connected:
+            return
+        if st.session_state[key]:
+            start()
+        else:
+            stop()
+
+    sinks = camera.get("sinks", {}) if connected else {}
 
     st.header("Live Preview")
-    preview_enabled = st.checkbox("Enable Preview Stream", value=False)
-
-    if st.session_state.gopro:
-        if preview_enabled:
-            if not st.session_state.gopro.stream_active:
-                if st.session_state.gopro.start_preview():
-                    st.video("stream.m3u8")
-                else:
-                    st.error("Failed to start preview stream")
-        else:
-            if st.session_state.gopro.stream_active:
-                st.session_state.gopro.stop_preview()
+    preview_mode = st.radio(
+        "Preview Mode",
+        ["Passthrough", "Transcode", "Low latency"],
+        horizontal=True,
+        help="Passthrough segments the camera's H.264 without re-encoding; Transcode re-encodes with libx264; "
+             "Low latency skips HLS and streams fMP4 to the browser over a WebSocket (well under a second behind)"
+    )
+    st.checkbox(
+        "Enable Preview Stream", value=connected and camera["preview_active"], key=f"preview_{ip}",
+        on_change=toggle,
+        args=(f"preview_{ip}", lambda: manager.start_preview(ip, preview_mode.lower().replace(" ", "_")),
+              lambda: manager.stop_preview(ip))
+    )
+    if connected:
+        if camera["preview_url"] and (camera["preview"] or {}).get("mode") == "low_latency":
+            # The MSE player connects straight to the camera's preview server over a WebSocket
+            components.html(player_html(camera["preview_url"]), height=520)
+        elif camera["preview_url"]:
+            st.video(camera["preview_url"])
+        elif camera["state"] == "starting preview":
+            st.info("Starting the preview stream...")
     else:
         st.error("Please connect to GoPro first")
 
+    st.checkbox(
+        "Show keyframe thumbnail", value="snapshot" in sinks, key=f"snapshot_{ip}",
+        help="Decodes one keyframe every few seconds; much cheaper than the live preview",
+        on_change=toggle,
+        args=(f"snapshot_{ip}", lambda: manager.attach_output(ip, "snapshot"),
+              lambda: manager.detach_output(ip, "snapshot"))
+    )
+    if "snapshot" in sinks:
+        jpeg = manager.snapshot(ip)
+        if jpeg:
+            st.image(jpeg, caption=f"Keyframe from {camera['snapshot_age']:.1f}s ago")
+        else:
+            st.info("Waiting for the next keyframe")
+
+    st.header("Stream Outputs")
+    st.caption("Outputs share the preview's single ingest and can be toggled while it runs")
+    st.text_input("Save location", "/tmp/goprofeed.ts", key="save_path")
+    st.checkbox(
+        "Save stream to file", value="file" in sinks, key=f"file_{ip}", on_change=toggle,
+        args=(f"file_{ip}", lambda: manager.attach_output(ip, "file", path=st.session_state.save_path),
+              lambda: manager.detach_output(ip, "file"))
+    )
+
+    def restream():
+        host, _, port = st.session_state.restream_target.rpartition(":")
+        if not port.isdigit():
+            st.error("Restream target must be host:port")
+            return None
+        return manager.attach_output(ip, "udp", host=host or "127.0.0.1", port=int(port))
+
+    st.text_input("Restream target (host:port)", "127.0.0.1:10000", key="restream_target")
+    st.checkbox(
+        "Restream over UDP", value="udp" in sinks, key=f"udp_{ip}", on_change=toggle,
+        args=(f"udp_{ip}", restream, lambda: manager.detach_output(ip, "udp"))
+    )
+
+    st.text_input("Pre-roll recording folder", "/tmp/gopro-recordings", key="preroll_location")
+    st.slider("Pre-roll (seconds)", 0, 60, 10, key="preroll_seconds")
+    st.checkbox(
+        "Pre-roll local recording", value="recorder" in sinks, key=f"recorder_{ip}",
+        help="Buffers the last seconds of the stream; Start Recording also saves them locally in rotated segments",
+        on_change=toggle,
+        args=(f"recorder_{ip}",
+              lambda: manager.attach_output(ip, "recorder", directory=st.session_state.preroll_location,
+                                            preroll_seconds=st.session_state.preroll_seconds),
+              lambda: manager.detach_output(ip, "recorder"))
+    )
+
+    if sinks:
+        with st.expander("Output Statistics"):
+            st.json(sinks)
+
+    st.header("Media")
+    media_location = st.text_input("Download folder", "/tmp/gopro-media")
+    media_concurrency = st.slider("Parallel downloads", 1, 8, 4)
+    if st.button("Download new media"):
+        if require_connection():
+            manager.download_media(ip, media_location, media_concurrency)
+    progress = camera.get("download") if camera else None
+    if progress:
+        st.progress(min(1.0, progress["fraction"]))
+        st.text(f"{progress['files_done']}/{progress['files_total']} files, {progress['mbps']:.1f} Mbit/s")
+
+    if camera and camera["messages"]:
+        with st.expander("Activity", expanded=camera["state"] == "starting preview"):
+            for message in camera["messages"][-10:]:
+                show = {"error": st.error, "success": st.success}.get(message["level"], st.write)
+                show(message["message"])
+
     st.markdown("""
     ### Usage Notes
     1. Ensure your computer is connected to the GoPro's WiFi network
@@ -361,7 +820,16 @@ def main():
     4. FFmpeg must be installed for preview streaming
     5. For best streaming performance, keep the GoPro and computer in close proximity
     6. If the preview stream is laggy, try disabling and re-enabling it
+    7. Cameras run in the stream manager (stream_manager.py), which this page starts if needed;
+       it keeps running across page reloads, and every open page shares its streams
+    8. Low latency preview mode plays in browsers with Media Source Extensions and H.264 support;
+       the browser connects to the camera's preview port directly, so it must be reachable
     """)
 
+    # Poll while the manager is still working on something for this camera
+    if st.session_state.commands or camera and any(job["state"] in ("queued", "running") for job in camera["jobs"]):
+        time.sleep(1.0)
+        st.rerun()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,355 @@
+import subprocess
+import time
+from typing import Callable, List, Optional
+
+from ffmpeg_supervisor import FFmpegProcess
+from metrics import STAGE_BUCKETS, LatencyHistogram
+from segment_store import SegmentStore
+from stream_tee import Sink
+from ts_ingest import (FLAG_DISCONTINUITY, FLAG_KEYFRAME, FLAG_PSI, PCR_HZ, UDPIngest,
+                       pes_start_offset, psi_packets)
+
+
+class Segment:
+    def __init__(self, discontinuity: bool = False):
+        # Numbered when it is published, so dropped segments leave no gaps
+        self.sequence: Optional[int] = None
+        self.discontinuity = discontinuity
+        self.data = bytearray()
+        self.duration = 0.0
+        self.first_arrival: Optional[float] = None
+        self.last_arrival: Optional[float] = None
+        self.first_pcr: Optional[int] = None
+        self.last_pcr: Optional[int] = None
+
+    def media_duration(self) -> float:
+        if self.first_pcr is not None and self.last_pcr is not None and self.last_pcr > self.first_pcr:
+            return (self.last_pcr - self.first_pcr) / PCR_HZ
+        if self.first_arrival is not None and self.last_arrival is not None:
+            return self.last_arrival - self.first_arrival
+        return 0.0
+
+
+class HLSSegmenter(Sink):
+    """Cuts the ingested MPEG-TS into HLS segments at keyframes, without re-encoding.
+
+    Segments start at the TS packet that opens a keyframe PES and carry a copy of the
+    latest PAT/PMT, so each one is independently decodable. If the stream never shows
+    a keyframe within keyframe_timeout (e.g. an open GOP with no IDR/RAI marking),
+    on_fallback is called so the caller can switch to the transcoding path.
+
+    A segment cut short by lost datagrams is dropped, and the next one published is
+    marked as a discontinuity in the playlist.
+    """
+
+    kind = "hls"
+    jitter_buffer = True
+
+    def __init__(self, ingest: Optional[UDPIngest], store: SegmentStore, target_duration: float = 1.0,
+                 keyframe_timeout: float = 3.0, on_fallback: Optional[Callable[[str], None]] = None):
+        super().__init__(ingest)
+        self.store = store
+        self.target_duration = target_duration
+        self.keyframe_timeout = keyframe_timeout
+        self.on_fallback = on_fallback
+        self.segments_written = 0
+        self.segments_dropped = 0
+        self.publish_latency: Optional[float] = None
+        # First datagram of a segment arriving -> segment published (includes its own duration)
+        self.segment_latency = LatencyHistogram(STAGE_BUCKETS)
+        self.first_segment_at: Optional[float] = None
+        self.fallback_reason: Optional[str] = None
+        self._psi = b""
+        self._current: Optional[Segment] = None
+        self._sequence = 0
+        self._waiting_since: Optional[float] = None
+        self._discontinuity = False
+
+    def open(self):
+        self._waiting_since = None
+
+    def close(self):
+        # A restart resumes at a later keyframe, so the next segment doesn't follow on
+        self._current = None
+        self._waiting_since = None
+        self._discontinuity = self.segments_written > 0
+
+    def cleanup(self):
+        self.store.clear()
+
+    def write(self, seq, view, flags, arrival):
+        ingest = self.ingest
+        if flags & FLAG_PSI:
+            self._psi = psi_packets(view, ingest.indexer.pmt_pids) or self._psi
+        self._handle(view, flags, arrival, ingest.pcrs[seq % ingest.slots])
+
+    def idle(self):
+        if self._running and self._current is None and self._waiting_since is not None and \
+                time.monotonic() - self._waiting_since > self.keyframe_timeout:
+            self._fallback("no keyframe within %.1fs" % self.keyframe_timeout)
+
+    def _handle(self, view, flags: int, arrival: float, pcr: int):
+        segment = self._current
+        if flags & FLAG_DISCONTINUITY and segment is not None:
+            # Datagrams were lost inside this segment; drop it and restart at this keyframe
+            self.segments_dropped += 1
+            self._current = segment = None
+            self._discontinuity = True
+            self._waiting_since = None
+        if segment is None:
+            if self._waiting_since is None:
+                self._waiting_since = arrival
+            if not flags & FLAG_KEYFRAME:
+                if arrival - self._waiting_since > self.keyframe_timeout:
+                    self._fallback("no keyframe within %.1fs" % self.keyframe_timeout)
+                return
+            cut = pes_start_offset(view, self.ingest.indexer.video_pid)
+            self._open_segment()
+            self._write(view[cut:], arrival, pcr)
+            return
+
+        if flags & FLAG_KEYFRAME and segment.media_duration() >= self.target_duration:
+            cut = pes_start_offset(view, self.ingest.indexer.video_pid)
+            if cut:
+                self._write(view[:cut], arrival, -1)
+            self._close_segment(arrival)
+            self._open_segment()
+            self._write(view[cut:], arrival, pcr)
+            return
+
+        self._write(view, arrival, pcr)
+        if segment.media_duration() > self.keyframe_timeout:
+            self._fallback("GOP longer than %.1fs" % self.keyframe_timeout)
+
+    def _open_segment(self):
+        self._current = Segment(self._discontinuity)
+        self._current.data += self._psi
+        self._discontinuity = False
+        self._waiting_since = None
+
+    def _write(self, view, arrival: float, pcr: int):
+        segment = self._current
+        segment.data += view
+        if segment.first_arrival is None:
+            segment.first_arrival = arrival
+        segment.last_arrival = arrival
+        if pcr >= 0:
+            if segment.first_pcr is None:
+                segment.first_pcr = pcr
+            segment.last_pcr = pcr
+
+    def _close_segment(self, now: float):
+        segment = self._current
+        segment.sequence = self._sequence
+        self._sequence += 1
+        self.store.add(segment.sequence, segment.data, segment.media_duration(), segment.discontinuity)
+        self.last_output_at = time.monotonic()
+        self.segments_written += 1
+        published = time.monotonic()
+        self.publish_latency = published - now
+        if segment.first_arrival is not None:
+            self.segment_latency.observe(published - segment.first_arrival)
+        if self.first_segment_at is None:
+            self.first_segment_at = time.monotonic()
+
+    def _fallback(self, reason: str):
+        self.fallback_reason = reason
+        self._running = False
+        self._current = None
+        print(f"Passthrough segmenting unavailable ({reason}), falling back to transcoding")
+        if self.on_fallback:
+            self.on_fallback(reason)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({
+            "mode": "passthrough",
+            "segments_written": self.segments_written,
+            "segments_dropped": self.segments_dropped,
+            "publish_latency": self.publish_latency,
+            "fallback_reason": self.fallback_reason,
+        })
+        return stats
+
+
+class HLSTranscoder(Sink):
+    """Re-encodes the ingested stream to HLS with libx264; the fallback for awkward GOPs.
+
+    ffmpeg uploads its segments and playlists with HTTP PUT to the camera's HLSServer,
+    so the transcoded output lands in the same in-memory SegmentStore.
+    """
+
+    kind = "hls"
+    jitter_buffer = True
+
+    def __init__(self, ingest: Optional[UDPIngest], store: SegmentStore, upload_url: str,
+                 target_duration: float = 1.0):
+        super().__init__(ingest)
+        self.store = store
+        self.upload_url = upload_url.rstrip("/")
+        self.target_duration = target_duration
+        self.ffmpeg: Optional[FFmpegProcess] = None
+        self.process: Optional[subprocess.Popen] = None
+
+    def command(self) -> List[str]:
+        # A restarted transcoder carries on the segment numbering, so players keep going
+        start_number = self.store.last_sequence + 1 if self.store.last_sequence is not None else 0
+        return [
+            'ffmpeg',
+            '-loglevel', 'error',
+            '-fflags', 'nobuffer',
+            '-flags', 'low_delay', '-max_delay', '0', '-probesize', '32',
+            '-f', 'mpegts',
+            '-i', 'pipe:0',
+            '-pix_fmt', 'yuv420p',
+            '-c:v', 'libx264',
+            '-preset', 'ultrafast',
+            '-tune', 'zerolatency',
+            '-f', 'hls',
+            '-hls_time', str(self.target_duration),
+            '-hls_list_size', str(self.store.list_size),
+            '-start_number', str(start_number),
+            '-hls_flags', 'omit_endlist',
+            '-hls_segment_type', 'mpegts',
+            '-method', 'PUT',
+            '-http_persistent', '1',
+            '-hls_segment_filename', f"{self.upload_url}/{self.store.name}%d.ts",
+            f"{self.upload_url}/{self.store.name}.m3u8"
+        ]
+
+    def open(self):
+        self.ffmpeg = FFmpegProcess(self.command(), name="hls transcoder", stdin=subprocess.PIPE)
+        try:
+            self.process = self.ffmpeg.start()
+        except OSError as e:
+            self._fail(f"error starting ffmpeg: {e}")
+            return False
+
+    def write(self, seq, view, flags, arrival):
+        try:
+            self.process.stdin.write(view)
+        except (BrokenPipeError, ValueError, OSError) as e:
+            self._fail(f"ffmpeg input closed: {e}")
+
+    def idle(self):
+        if not self._running:
+            return
+        try:
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError, OSError) as e:
+            self._fail(f"ffmpeg input closed: {e}")
+
+    def close(self):
+        if self.ffmpeg:
+            self.ffmpeg.stop()
+            self.process = None
+
+    def cleanup(self):
+        self.store.clear()
+
+    @property
+    def running(self) -> bool:
+        return self._running and self.process is not None and self.process.poll() is None
+
+    @property
+    def last_output_at(self) -> Optional[float]:
+        # ffmpeg's segments reach the store over HTTP PUT rather than through this sink
+        return self.store.updated_at
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({
+            "mode": "transcode",
+            "returncode": self.process.poll() if self.process else None,
+            "ffmpeg": self.ffmpeg.stats() if self.ffmpeg else None,
+        })
+        return stats
+
+
+def _replay(path: str, port: int, seconds: float, mbps: float):
+    """Send a capture (or the synthetic pattern) to the ingest port in real time"""
+    import socket
+    from ts_ingest import TS_PACKET_SIZE, TS_PACKETS_PER_DATAGRAM, synthetic_datagrams
+
+    size = TS_PACKET_SIZE * TS_PACKETS_PER_DATAGRAM
+    if path:
+        with open(path, "rb") as f:
+            data = f.read()
+        datagrams = [data[i:i + size] for i in range(0, len(data) - len(data) % TS_PACKET_SIZE, size)]
+    else:
+        datagrams = list(synthetic_datagrams(8 * 30 * 16))
+    rate = mbps * 1e6 / 8 / size
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = time.monotonic()
+    sent = 0
+    while time.monotonic() - start < seconds:
+        due = int((time.monotonic() - start) * rate)
+        while sent < due:
+            sock.sendto(datagrams[sent % len(datagrams)], ("127.0.0.1", port))
+            sent += 1
+        time.sleep(0.0005)
+    sock.close()
+
+
+def benchmark(mode: str = "passthrough", source: str = "", mbps: float = 8.0, seconds: float = 10.0) -> dict:
+    """CPU and startup/publish latency of one preview mode, fed from a local sender"""
+    import multiprocessing
+    import resource
+
+    from hls_server import HLSServer
+
+    store = SegmentStore()
+    server = HLSServer(store, host="127.0.0.1")
+    ingest = UDPIngest(port=0, host="127.0.0.1")
+    if not server.start() or not ingest.start():
+        return {}
+    if mode == "passthrough":
+        pipeline = HLSSegmenter(ingest, store)
+    else:
+        pipeline = HLSTranscoder(ingest, store, f"http://127.0.0.1:{server.port}")
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    if pipeline.start() is False:
+        ingest.stop()
+        return {"mode": mode, "error": "pipeline failed to start"}
+    sender = multiprocessing.Process(target=_replay, args=(source, ingest.port, seconds, mbps))
+    sender.start()
+    first_playlist = None
+    while sender.is_alive():
+        if first_playlist is None and store.last_sequence is not None:
+            first_playlist = time.monotonic() - wall_start
+        time.sleep(0.01)
+    sender.join()
+    # The sender is reaped first, so only the ffmpeg child lands in this delta
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    pipeline.stop()
+    ingest.stop()
+    server.stop()
+    wall = time.monotonic() - wall_start
+    cpu = time.process_time() - cpu_start
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    child_cpu = (children.ru_utime - children_before.ru_utime) + (children.ru_stime - children_before.ru_stime)
+    pipeline.cleanup()
+    return {
+        "mode": mode,
+        "source": source or "synthetic",
+        "mbps": mbps,
+        "cpu_percent": 100.0 * cpu / wall,
+        "ffmpeg_cpu_percent": 100.0 * child_cpu / wall,
+        "time_to_first_playlist": first_playlist,
+        "stats": pipeline.stats(),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Compare passthrough and transcoding HLS preview modes")
+    parser.add_argument("--mode", choices=["passthrough", "transcode", "both"], default="both")
+    parser.add_argument("--source", default="", help="MPEG-TS capture to replay (default: synthetic stream)")
+    parser.add_argument("--mbps", type=float, default=8.0)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+    modes = ["passthrough", "transcode"] if args.mode == "both" else [args.mode]
+    print(json.dumps([benchmark(m, args.source, args.mbps, args.seconds) for m in modes], indent=2))
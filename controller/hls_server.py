@@ -0,0 +1,172 @@
+import ipaddress
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from live_preview import LIVE_PATH, PLAYER_PATH, player_html
+from segment_store import SEGMENT_NAME, SegmentStore
+
+EXTINF_ENTRY = re.compile(r"#EXTINF:(?P<duration>[\d.]+),?[^\n]*\n(?P<uri>[^\n#]+)")
+
+
+class _HLSRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "GoProHLS/1.0"
+    # Headers and body go out in separate writes; without this keep-alive clients stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):
+        store: SegmentStore = self.server.store
+        url = urlsplit(self.path)
+        filename = url.path.rsplit("/", 1)[-1]
+
+        if url.path in (LIVE_PATH, PLAYER_PATH):
+            live = self.server.owner.live
+            if live is None:
+                self._send(404, b"no low latency preview running")
+            elif url.path == PLAYER_PATH:
+                self._send(200, player_html(LIVE_PATH).encode("utf-8"), "text/html; charset=utf-8")
+            elif self.command == "GET":
+                # The handler thread stays with the viewer for as long as it is connected
+                live.serve(self)
+            else:
+                self._send(200)
+            return
+
+        if filename == f"{store.name}.m3u8":
+            query = parse_qs(url.query)
+            if "_HLS_msn" in query:
+                # Blocking playlist reload: hold the request until the segment exists
+                try:
+                    msn = int(query["_HLS_msn"][0])
+                except ValueError:
+                    self._send(400, b"bad _HLS_msn")
+                    return
+                store.wait_for(msn, self.server.block_timeout)
+            playlist = store.playlist()
+            if playlist is None:
+                self._send(404, b"no segments yet")
+                return
+            self._send(200, playlist.encode("utf-8"), "application/vnd.apple.mpegurl")
+            return
+
+        data = store.segment(filename)
+        if data is None:
+            self._send(404, b"not found")
+            return
+        self._send(200, bytes(data), "video/mp2t")
+
+    do_HEAD = do_GET
+
+    def do_PUT(self):
+        """Accept segments and playlists from an ffmpeg HLS muxer running with -method PUT"""
+        if not self._local_upload():
+            return
+        store: SegmentStore = self.server.store
+        filename = urlsplit(self.path).path.rsplit("/", 1)[-1]
+        body = self._read_body()
+        if body is None:
+            self.close_connection = True
+            self._send(400, b"bad Content-Length or chunk size")
+            return
+
+        match = SEGMENT_NAME.match(filename)
+        if match and match.group("name") == store.name:
+            store.add(int(match.group("sequence")), body, 0.0)
+        elif filename.endswith(".m3u8"):
+            durations = {}
+            for entry in EXTINF_ENTRY.finditer(body.decode("utf-8", errors="replace")):
+                segment = SEGMENT_NAME.match(entry.group("uri").strip().rsplit("/", 1)[-1])
+                if segment:
+                    durations[int(segment.group("sequence"))] = float(entry.group("duration"))
+            store.set_durations(durations)
+        self._send(201)
+
+    def do_DELETE(self):
+        if self._local_upload():
+            self._send(204)
+
+    def _local_upload(self) -> bool:
+        """Uploads only come from the ffmpeg muxer on this machine; refuse them from the network"""
+        if ipaddress.ip_address(self.client_address[0]).is_loopback:
+            return True
+        self.close_connection = True
+        self._send(403, b"uploads are only accepted from this machine")
+        return False
+
+    def _read_body(self) -> Optional[bytes]:
+        """The request body, plain or chunked; None if its framing headers don't parse"""
+        try:
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0], 16)
+                    if size < 0:
+                        return None
+                    if size == 0:
+                        self.rfile.readline()
+                        return b"".join(chunks)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            return None
+        return self.rfile.read(length) if length >= 0 else None
+
+
+class HLSServer:
+    """Serves one camera's SegmentStore over HTTP, and its low latency preview when one is set as live"""
+
+    def __init__(self, store: SegmentStore, host: str = "", port: int = 0, block_timeout: float = 6.0):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.block_timeout = block_timeout
+        self.live = None
+        self.httpd: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> bool:
+        if self.httpd:
+            return True
+        try:
+            httpd = ThreadingHTTPServer((self.host, self.port), _HLSRequestHandler)
+        except OSError as e:
+            print(f"Error starting HLS server: {e}")
+            return False
+        httpd.daemon_threads = True
+        httpd.store = self.store
+        httpd.block_timeout = self.block_timeout
+        httpd.owner = self
+        self.httpd = httpd
+        self.port = httpd.server_address[1]
+        self._thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def url(self, host: str = "localhost") -> str:
+        return f"http://{host}:{self.port}/{self.store.name}.m3u8"
+
+    def live_url(self, host: str = "localhost") -> str:
+        return f"ws://{host}:{self.port}{LIVE_PATH}"
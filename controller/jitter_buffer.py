@@ -0,0 +1,187 @@
+import time
+from typing import List, Optional, Tuple
+
+from ts_ingest import FLAG_DISCONTINUITY, FLAG_KEYFRAME, FLAG_PCR, PCR_HZ, SYNC_BYTE, TS_PACKET_SIZE, UDPIngest
+
+
+def video_cc_range(view, pid: Optional[int]) -> Tuple[Optional[int], Optional[int]]:
+    """Continuity counters of the first and last payload-carrying packets of pid in a datagram"""
+    if pid is None:
+        return None, None
+    first = last = None
+    for pos in range(0, len(view) - len(view) % TS_PACKET_SIZE, TS_PACKET_SIZE):
+        if view[pos] != SYNC_BYTE or ((view[pos + 1] & 0x1F) << 8 | view[pos + 2]) != pid:
+            continue
+        b3 = view[pos + 3]
+        if not b3 & 0x10:
+            continue
+        last = b3 & 0x0F
+        if first is None:
+            first = last
+    return first, last
+
+
+class _Pending:
+    __slots__ = ("seq", "view", "flags", "arrival", "first_cc", "last_cc")
+
+    def __init__(self, seq, view, flags, arrival, first_cc, last_cc):
+        self.seq = seq
+        self.view = view
+        self.flags = flags
+        self.arrival = arrival
+        self.first_cc = first_cc
+        self.last_cc = last_cc
+
+
+class JitterBuffer:
+    """Drop-in replacement for a RingReader that repairs the order of the video PID.
+
+    Datagrams that continue the video PID's continuity counters are released at once,
+    so a clean link adds no latency. A datagram that skips ahead is held for up to
+    `delay` seconds waiting for the missing one; reordered datagrams are put back in
+    order. If the gap doesn't fill in time it is declared lost, and everything up to
+    the next random-access point is discarded so decoders never see a broken GOP.
+    The first datagram after such a skip carries FLAG_DISCONTINUITY. Streams whose
+    keyframes can't be detected resume after max_skip seconds instead.
+
+    `delay` follows the measured inter-arrival jitter (RFC 3550 style, from PCR versus
+    arrival time) and grows whenever a datagram shows up after its gap was given up on.
+    """
+
+    def __init__(self, ingest: UDPIngest, min_delay: float = 0.005, max_delay: float = 0.5,
+                 jitter_multiplier: float = 4.0, max_skip: float = 2.0, max_reorder: int = 8,
+                 from_latest: bool = True):
+        self.ingest = ingest
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.jitter_multiplier = jitter_multiplier
+        self.max_skip = max_skip
+        # 16 full datagrams bring a 4-bit continuity counter back to where it was, so
+        # looking further ahead than this for the missing datagram would be ambiguous
+        self.max_reorder = max_reorder
+        self.delay = min_delay
+        self.jitter = 0.0
+        self.received = 0
+        self.released = 0
+        self.reordered = 0
+        self.gaps = 0
+        self.lost_packets = 0
+        self.late = 0
+        self.discarded = 0
+        self._reader = ingest.reader(from_latest)
+        self._pending: List[_Pending] = []
+        self._expected_cc: Optional[int] = None
+        self._skipping = False
+        self._skip_since = 0.0
+        # Gap given up on: (first missing cc, missing packets, waiting since, received count then)
+        self._missing: Optional[Tuple[int, int, float, int]] = None
+        self._last_transit: Optional[float] = None
+
+    @property
+    def overruns(self) -> int:
+        return self._reader.overruns
+
+    @property
+    def skipped(self) -> int:
+        return self._reader.skipped
+
+    def read(self, timeout: Optional[float] = None, max_items: int = 1024) -> List[Tuple[int, memoryview, int, float]]:
+        """Same contract as RingReader.read, in repaired order and minus discarded datagrams"""
+        if self._pending:
+            hold = self._pending[0].arrival + self.delay - time.monotonic()
+            timeout = max(0.0, hold) if timeout is None else max(0.0, min(timeout, hold))
+        video_pid = self.ingest.indexer.video_pid
+        pcrs = self.ingest.pcrs
+        slots = self.ingest.slots
+        for seq, view, flags, arrival in self._reader.read(timeout, max_items):
+            self.received += 1
+            if flags & FLAG_PCR:
+                self._update_jitter(pcrs[seq % slots], arrival)
+            first_cc, last_cc = video_cc_range(view, video_pid)
+            if self._is_late(first_cc, last_cc, arrival):
+                continue
+            self._pending.append(_Pending(seq, view, flags & ~FLAG_DISCONTINUITY, arrival, first_cc, last_cc))
+        return self._release(time.monotonic())
+
+    def _update_jitter(self, pcr: int, arrival: float):
+        if pcr < 0:
+            return
+        transit = arrival - pcr / PCR_HZ
+        if self._last_transit is not None:
+            d = abs(transit - self._last_transit)
+            # A PCR wrap or a stream restart jumps the transit time; start over from there
+            if d < 1.0:
+                self.jitter += (d - self.jitter) / 16
+        self._last_transit = transit
+        target = min(self.max_delay, max(self.min_delay, self.jitter_multiplier * self.jitter))
+        # Grow at once, shrink slowly so one quiet second doesn't undo a known-bad link
+        self.delay = target if target > self.delay else self.delay + (target - self.delay) * 0.01
+
+    def _is_late(self, first_cc: Optional[int], last_cc: Optional[int], arrival: float) -> bool:
+        """A datagram that exactly fills the start of a gap that was already given up on"""
+        if first_cc is None or self._missing is None or first_cc == self._expected_cc:
+            return False
+        start, count, since, received = self._missing
+        # Beyond 16 datagrams the counters repeat, so a match no longer proves anything
+        if self.received - received > 16 or arrival - since > self.max_delay:
+            self._missing = None
+            return False
+        filled = (last_cc + 1 - start) & 0x0F
+        if first_cc != start or not 0 < filled <= count:
+            return False
+        self._missing = ((last_cc + 1) & 0x0F, count - filled, since, received) if filled < count else None
+        self.late += 1
+        self.delay = min(self.max_delay, max(self.delay, (arrival - since) * 1.25))
+        return True
+
+    def _release(self, now: float) -> List[Tuple[int, memoryview, int, float]]:
+        out = []
+        pending = self._pending
+        while pending:
+            index = 0
+            if self._expected_cc is not None:
+                index = next((i for i, p in enumerate(pending[:self.max_reorder])
+                              if p.first_cc is None or p.first_cc == self._expected_cc), -1)
+                if index > 0:
+                    self.reordered += 1
+                elif index < 0:
+                    head = pending[0]
+                    if now - head.arrival < self.delay:
+                        break
+                    # The missing datagram didn't turn up in time: resume at the next keyframe
+                    count = (head.first_cc - self._expected_cc) & 0x0F
+                    self._missing = (self._expected_cc, count, head.arrival, self.received)
+                    self.gaps += 1
+                    self.lost_packets += count
+                    self._skipping = True
+                    self._skip_since = head.arrival
+                    index = 0
+            item = pending.pop(index)
+            if item.last_cc is not None:
+                self._expected_cc = (item.last_cc + 1) & 0x0F
+            if self._skipping:
+                if not item.flags & FLAG_KEYFRAME and item.arrival - self._skip_since < self.max_skip:
+                    self.discarded += 1
+                    continue
+                self._skipping = False
+                item.flags |= FLAG_DISCONTINUITY
+            if not self._reader.valid(item.seq):
+                self.discarded += 1
+                continue
+            self.released += 1
+            out.append((item.seq, item.view, item.flags, item.arrival))
+        return out
+
+    def stats(self) -> dict:
+        return {
+            "delay": self.delay,
+            "jitter": self.jitter,
+            "pending": len(self._pending),
+            "received": self.received,
+            "released": self.released,
+            "reordered": self.reordered,
+            "gaps": self.gaps,
+            "lost_packets": self.lost_packets,
+            "late": self.late,
+            "discarded": self.discarded,
+        }
@@ -0,0 +1,178 @@
+import heapq
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from metrics import LatencyHistogram
+
+KEEP_ALIVE_MESSAGE = "_GPHD_:0:0:2:0\n".encode("utf-8")
+KEEP_ALIVE_PERIOD = 2.5  # seconds
+KEEP_ALIVE_PORT = 8554
+JITTER_BUCKETS = (0.0001, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+
+class _Camera:
+    def __init__(self, ip: str, port: int, period: float, message: bytes, first_due: float):
+        self.ip = ip
+        self.port = port
+        self.period = period
+        self.message = message
+        self.anchor = first_due
+        self.ticks = 0
+        self.sent = 0
+        self.errors = 0
+        self.skipped = 0
+        self.last_sent: Optional[float] = None
+        self.jitter = LatencyHistogram(JITTER_BUCKETS)
+
+    def due(self) -> float:
+        # Deadlines are anchor + n * period, so send delays never accumulate into drift
+        return self.anchor + self.ticks * self.period
+
+
+class KeepAliveScheduler:
+    """Sends the UDP keep-alive for every registered camera from one thread and one socket.
+
+    Cameras sit in a heap ordered by their next deadline; each deadline is derived
+    from the camera's anchor time rather than from when the previous send happened.
+    """
+
+    def __init__(self):
+        self.sock: Optional[socket.socket] = None
+        self._cameras: Dict[Tuple[str, int], _Camera] = {}
+        self._heap: List[Tuple[float, int, Tuple[str, int]]] = []
+        self._generation = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, ip: str, port: int = KEEP_ALIVE_PORT, period: float = KEEP_ALIVE_PERIOD,
+            message: bytes = KEEP_ALIVE_MESSAGE):
+        """Register a camera; its first keep-alive goes out immediately"""
+        key = (ip, port)
+        with self._cond:
+            camera = _Camera(ip, port, period, message, time.monotonic())
+            self._cameras[key] = camera
+            self._generation += 1
+            heapq.heappush(self._heap, (camera.due(), self._generation, key))
+            self._cond.notify()
+        self._ensure_running()
+
+    def remove(self, ip: str, port: int = KEEP_ALIVE_PORT):
+        with self._cond:
+            self._cameras.pop((ip, port), None)
+            self._cond.notify()
+
+    def send_now(self, ip: str, port: int = KEEP_ALIVE_PORT) -> bool:
+        """Send an out-of-schedule keep-alive, e.g. while recovering a stalled stream"""
+        with self._cond:
+            camera = self._cameras.get((ip, port))
+            message = camera.message if camera else KEEP_ALIVE_MESSAGE
+            sock = self._socket()
+        try:
+            sock.sendto(message, (ip, port))
+            return True
+        except OSError as e:
+            print("Keep-alive error:", e)
+            return False
+
+    def cameras(self) -> List[str]:
+        with self._cond:
+            return [f"{ip}:{port}" for ip, port in self._cameras]
+
+    def stats(self) -> Dict[str, dict]:
+        """Per-camera send counts and send-time jitter (seconds late versus schedule)"""
+        with self._cond:
+            cameras = list(self._cameras.values())
+        return {
+            f"{c.ip}:{c.port}": {
+                "sent": c.sent,
+                "errors": c.errors,
+                "skipped": c.skipped,
+                "jitter": c.jitter.snapshot(),
+            }
+            for c in cameras
+        }
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+        self._thread = None
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def _socket(self) -> socket.socket:
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return self.sock
+
+    def _ensure_running(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._socket()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    # Drop heap entries for cameras that were removed or re-added
+                    while self._heap and self._heap[0][2] not in self._cameras:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    due, _, key = self._heap[0]
+                    delay = due - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                if not self._running:
+                    return
+                _, generation, key = heapq.heappop(self._heap)
+                camera = self._cameras.get(key)
+                if camera is None or camera.due() != due:
+                    continue
+                sock = self.sock
+
+            now = time.monotonic()
+            camera.jitter.observe(now - due)
+            try:
+                sock.sendto(camera.message, (camera.ip, camera.port))
+                camera.sent += 1
+                camera.last_sent = now
+            except OSError as e:
+                camera.errors += 1
+                print("Keep-alive error:", e)
+
+            with self._cond:
+                camera.ticks += 1
+                # If we fell more than a whole period behind, skip the missed ticks
+                # instead of bursting them out back to back
+                behind = int((time.monotonic() - camera.due()) // camera.period)
+                if behind > 0:
+                    camera.ticks += behind
+                    camera.skipped += behind
+                if self._cameras.get(key) is camera:
+                    heapq.heappush(self._heap, (camera.due(), generation, key))
+
+
+_default_scheduler: Optional[KeepAliveScheduler] = None
+_default_lock = threading.Lock()
+
+
+def default_scheduler() -> KeepAliveScheduler:
+    """Process-wide scheduler shared by every controller"""
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = KeepAliveScheduler()
+        return _default_scheduler
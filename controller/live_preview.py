@@ -0,0 +1,549 @@
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Optional, Set
+
+import ws_protocol
+from fmp4 import FMP4Muxer, Fragment
+from metrics import STAGE_BUCKETS, LatencyHistogram
+from stream_tee import Sink
+from ts_ingest import FLAG_DISCONTINUITY, H264_STREAM_TYPES, TS_PACKET_SIZE, UDPIngest
+
+LIVE_PATH = "/live"
+PLAYER_PATH = "/live.html"
+
+# MSE player: appends the fragments in "sequence" mode, so frames skipped for a slow
+# client leave no gap in the timeline, and jumps to the live edge when it falls behind
+PLAYER_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>GoPro live preview</title></head>
+<body style="margin:0;background:#000">
+<video id="video" autoplay muted playsinline style="width:100%;max-height:__HEIGHT__px;background:#000"></video>
+<div id="status" style="font:12px monospace;color:#999;padding:2px 4px">connecting...</div>
+<script>
+(function () {
+  const url = new URL("__URL__", window.location.href).href.replace(/^http/, "ws");
+  const maxBehind = __MAX_BEHIND__;
+  const video = document.getElementById("video");
+  const status = document.getElementById("status");
+  let socket = null, source = null, buffer = null, codec = null, queue = [];
+
+  function pump() {
+    if (!buffer || buffer.updating || !queue.length) return;
+    try {
+      buffer.appendBuffer(queue.shift());
+    } catch (e) {
+      status.textContent = "append failed: " + e;
+      socket.close();
+    }
+  }
+
+  function open(newCodec) {
+    const type = 'video/mp4; codecs="' + newCodec + '"';
+    if (buffer && newCodec !== codec && buffer.changeType) buffer.changeType(type);
+    codec = newCodec;
+    if (source) return;
+    source = new MediaSource();
+    source.addEventListener("sourceopen", function () {
+      buffer = source.addSourceBuffer('video/mp4; codecs="' + codec + '"');
+      buffer.mode = "sequence";
+      buffer.addEventListener("updateend", pump);
+      pump();
+      video.play().catch(function () {});
+    });
+    video.src = URL.createObjectURL(source);
+  }
+
+  function reset() {
+    queue = [];
+    buffer = null;
+    codec = null;
+    source = null;
+    video.removeAttribute("src");
+    video.load();
+  }
+
+  function connect() {
+    socket = new WebSocket(url);
+    socket.binaryType = "arraybuffer";
+    socket.onmessage = function (event) {
+      if (typeof event.data === "string") {
+        const info = JSON.parse(event.data);
+        if (!MediaSource.isTypeSupported('video/mp4; codecs="' + info.codec + '"')) {
+          status.textContent = "this browser can't play " + info.codec;
+          return;
+        }
+        open(info.codec);
+        return;
+      }
+      queue.push(event.data);
+      pump();
+    };
+    socket.onclose = function () {
+      status.textContent = "reconnecting...";
+      reset();
+      setTimeout(connect, 1000);
+    };
+  }
+
+  setInterval(function () {
+    if (!buffer || !video.buffered.length) return;
+    const end = video.buffered.end(video.buffered.length - 1);
+    if (end - video.currentTime > maxBehind) video.currentTime = end - 0.05;
+    if (!buffer.updating && video.currentTime > 30) {
+      try { buffer.remove(0, video.currentTime - 10); } catch (e) {}
+    }
+    status.textContent = "live, " + Math.round((end - video.currentTime) * 1000) + " ms buffered";
+  }, 250);
+
+  connect();
+})();
+</script>
+</body></html>
+"""
+
+
+def player_html(url: str = LIVE_PATH, height: int = 480, max_behind: float = 0.3) -> str:
+    """The MSE player page for a live WebSocket URL (ws://, http:// or a path on the same host)"""
+    return (PLAYER_HTML.replace("__URL__", url).replace("__HEIGHT__", str(height))
+            .replace("__MAX_BEHIND__", str(max_behind)))
+
+
+class LiveClient:
+    """One WebSocket viewer and its send queue.
+
+    When the viewer falls behind - more than max_queue_bytes queued, or the oldest
+    queued fragment older than max_delay - the queue is dropped and nothing more is
+    sent until the next keyframe, so a slow viewer skips ahead instead of drifting
+    further behind live or holding anyone else up.
+
+    The socket's send buffer is capped at send_buffer bytes so a backlog builds up in
+    the queue, where it is visible, rather than in the kernel. A viewer that accepts
+    nothing for send_timeout seconds is disconnected.
+    """
+
+    def __init__(self, handler, max_queue_bytes: int = 2 * 1024 * 1024, max_delay: float = 0.5,
+                 send_buffer: int = 256 * 1024, send_timeout: float = 2.0):
+        self.address = "%s:%s" % handler.client_address[:2]
+        self.connection: socket.socket = handler.connection
+        self.rfile = handler.rfile
+        self.max_queue_bytes = max_queue_bytes
+        self.max_delay = max_delay
+        self.connected_at = time.monotonic()
+        self.sent = 0
+        self.sent_bytes = 0
+        self.dropped = 0
+        self.skips = 0
+        self.timed_out = False
+        self.waiting_keyframe = True
+        try:
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+            # A send-only timeout: the _read thread keeps blocking on the same socket
+            if sys.platform == "win32":
+                timeout = struct.pack("<L", int(send_timeout * 1000))
+            else:
+                timeout = struct.pack("ll", int(send_timeout), int(send_timeout % 1 * 1e6))
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, timeout)
+        except OSError as e:
+            print(f"Live viewer {self.address}: could not bound the send buffer: {e}")
+        self._queue: Deque[tuple] = deque()
+        self._queued_bytes = 0
+        self._cond = threading.Condition()
+        self._open = True
+
+    def push(self, frame: bytes, fragment: Optional[Fragment] = None):
+        """Queue an encoded WebSocket frame; fragment is None for control and header frames"""
+        with self._cond:
+            if not self._open:
+                return
+            if fragment is not None and fragment.kind == "media":
+                if self._queue and (self._queued_bytes + len(frame) > self.max_queue_bytes or
+                                    time.monotonic() - self._queue[0][1] > self.max_delay):
+                    self._skip()
+                if self.waiting_keyframe and not fragment.keyframe:
+                    self.dropped += 1
+                    return
+                self.waiting_keyframe = False
+            media = fragment is not None and fragment.kind == "media"
+            self._queue.append((frame, fragment.arrival if fragment else time.monotonic(), media))
+            self._queued_bytes += len(frame)
+            self._cond.notify()
+
+    def _skip(self):
+        # Only whole unsent media fragments are dropped, so the viewer's decoder sees a
+        # clean cut; init segments and control frames still go out
+        kept = deque(item for item in self._queue if not item[2])
+        self.dropped += len(self._queue) - len(kept)
+        self._queue = kept
+        self._queued_bytes = sum(len(item[0]) for item in kept)
+        self.skips += 1
+        self.waiting_keyframe = True
+
+    def resync(self):
+        """Send nothing more until the next keyframe, e.g. after stream loss"""
+        with self._cond:
+            self.waiting_keyframe = True
+
+    def close(self):
+        with self._cond:
+            self._open = False
+            self._cond.notify()
+
+    def disconnect(self):
+        """Close and unblock a send stuck on a viewer that stopped reading"""
+        self.close()
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    @property
+    def open(self) -> bool:
+        return self._open
+
+    def serve(self, latency: LatencyHistogram):
+        """Send queued frames until the viewer disconnects; runs on the request handler's thread"""
+        threading.Thread(target=self._read, daemon=True).start()
+        try:
+            while True:
+                with self._cond:
+                    while self._open and not self._queue:
+                        self._cond.wait()
+                    if not self._open:
+                        break
+                    frame, arrival, media = self._queue.popleft()
+                    self._queued_bytes -= len(frame)
+                self.connection.sendall(frame)
+                self.sent += 1
+                self.sent_bytes += len(frame)
+                if media:
+                    latency.observe(time.monotonic() - arrival)
+        except (BlockingIOError, socket.timeout):
+            self.timed_out = True
+            print(f"Live viewer {self.address} stopped reading; disconnecting")
+        except OSError:
+            pass
+        finally:
+            self.close()
+            if self.timed_out:
+                self.disconnect()
+            else:
+                try:
+                    self.connection.sendall(ws_protocol.encode_frame(ws_protocol.close_payload(1001),
+                                                                     ws_protocol.OP_CLOSE))
+                except OSError:
+                    pass
+
+    def _read(self):
+        # Viewers only send control frames; answer pings and notice when they leave
+        try:
+            while self._open:
+                frame = ws_protocol.read_frame(self.rfile)
+                if frame is None or frame[0] == ws_protocol.OP_CLOSE:
+                    break
+                if frame[0] == ws_protocol.OP_PING:
+                    self.push(ws_protocol.encode_frame(frame[2], ws_protocol.OP_PONG))
+        except (OSError, ValueError):
+            pass
+        self.close()
+
+    def stats(self) -> dict:
+        return {
+            "address": self.address,
+            "connected": time.monotonic() - self.connected_at,
+            "sent": self.sent,
+            "sent_bytes": self.sent_bytes,
+            "dropped": self.dropped,
+            "skips": self.skips,
+            "timed_out": self.timed_out,
+            "queued_bytes": self._queued_bytes,
+        }
+
+
+class LivePreview(Sink):
+    """Low-latency preview: the camera's H.264 remuxed to fMP4 and pushed over WebSocket.
+
+    Each access unit becomes a one-frame fragment as soon as the next one starts, with
+    no re-encoding and no segmenting, and goes straight to every connected viewer for
+    playback through Media Source Extensions. Viewers connect to LIVE_PATH on the
+    camera's preview HTTP server; PLAYER_PATH serves a player page. A viewer gets the
+    codec and init segment when it connects and starts at the next keyframe. Viewers
+    stay connected across restarts of the sink.
+    """
+
+    kind = "live"
+    jitter_buffer = True
+
+    def __init__(self, ingest: Optional[UDPIngest] = None, max_queue_bytes: int = 2 * 1024 * 1024,
+                 max_delay: float = 0.5, send_buffer: int = 256 * 1024, send_timeout: float = 2.0):
+        super().__init__(ingest)
+        self.max_queue_bytes = max_queue_bytes
+        self.max_delay = max_delay
+        self.send_buffer = send_buffer
+        self.send_timeout = send_timeout
+        self.muxer = FMP4Muxer()
+        self.fragments = 0
+        self.keyframes = 0
+        self.viewers_served = 0
+        self.viewers_timed_out = 0
+        self._departed_dropped = 0
+        self._departed_skips = 0
+        # First datagram of an access unit -> its fragment handed to a viewer's socket
+        self.send_latency = LatencyHistogram(STAGE_BUCKETS)
+        self._pes: Optional[bytearray] = None
+        self._pes_arrival = 0.0
+        self._header: Optional[bytes] = None
+        self._init: Optional[bytes] = None
+        self._clients: Set[LiveClient] = set()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._restarting = False
+
+    def open(self):
+        stream_type = self.ingest.indexer.video_stream_type
+        if stream_type is not None and stream_type not in H264_STREAM_TYPES:
+            self._fail("the low latency preview needs H.264; use the HLS preview for this camera")
+            return False
+        self.muxer.reset()
+        self._pes = None
+
+    def close(self):
+        self._pes = None
+        if not self._restarting:
+            with self._lock:
+                clients, self._clients = list(self._clients), set()
+            for client in clients:
+                client.disconnect()
+            self._ready.clear()
+
+    def restart(self) -> bool:
+        # Viewers stay connected and resume at the next keyframe
+        self._restarting = True
+        try:
+            return super().restart()
+        finally:
+            self._restarting = False
+
+    def write(self, seq, view, flags, arrival):
+        if flags & FLAG_DISCONTINUITY:
+            # The jitter buffer resumes at a keyframe; drop the access unit that spans the gap
+            self._pes = None
+            self.muxer.reset()
+        pid = self.ingest.indexer.video_pid
+        if pid is None:
+            return
+        for pos in range(0, len(view) - len(view) % TS_PACKET_SIZE, TS_PACKET_SIZE):
+            if ((view[pos + 1] & 0x1F) << 8 | view[pos + 2]) != pid:
+                continue
+            control = view[pos + 3] >> 4 & 0x3
+            if not control & 0x1:
+                continue
+            payload = pos + 4 + (1 + view[pos + 4] if control & 0x2 else 0)
+            if view[pos + 1] & 0x40:
+                if self._pes is not None:
+                    self._publish(self.muxer.add_pes(bytes(self._pes), self._pes_arrival))
+                self._pes = bytearray()
+                self._pes_arrival = arrival
+            if self._pes is not None and payload < pos + TS_PACKET_SIZE:
+                self._pes += view[payload:pos + TS_PACKET_SIZE]
+
+    def _publish(self, fragments: List[Fragment]):
+        for fragment in fragments:
+            if fragment.kind == "init":
+                self._header = ws_protocol.encode_frame(json.dumps({
+                    "codec": self.muxer.codec, "width": self.muxer.width, "height": self.muxer.height,
+                }).encode("utf-8"), ws_protocol.OP_TEXT)
+                self._init = ws_protocol.encode_frame(fragment.data)
+                with self._lock:
+                    clients = list(self._clients)
+                for client in clients:
+                    client.resync()
+                    client.push(self._header)
+                    client.push(self._init)
+                self._ready.set()
+                continue
+            self.fragments += 1
+            if fragment.keyframe:
+                self.keyframes += 1
+            frame = ws_protocol.encode_frame(fragment.data)
+            with self._lock:
+                clients = list(self._clients)
+            for client in clients:
+                client.push(frame, fragment)
+
+    def wait_ready(self, timeout: float) -> bool:
+        """Block until the init segment exists, i.e. viewers can start playing"""
+        return self._ready.wait(timeout)
+
+    def serve(self, handler):
+        """Take over an HTTP request that asked for a WebSocket upgrade and stream to it"""
+        if not ws_protocol.handshake(handler):
+            return
+        client = LiveClient(handler, self.max_queue_bytes, self.max_delay, self.send_buffer, self.send_timeout)
+        with self._lock:
+            self._clients.add(client)
+            self.viewers_served += 1
+            header, init = self._header, self._init
+        if header and init:
+            client.push(header)
+            client.push(init)
+        try:
+            client.serve(self.send_latency)
+        finally:
+            with self._lock:
+                self._clients.discard(client)
+                self._departed_dropped += client.dropped
+                self._departed_skips += client.skips
+                self.viewers_timed_out += client.timed_out
+
+    @property
+    def viewers(self) -> int:
+        return len(self._clients)
+
+    @property
+    def dropped_fragments(self) -> int:
+        """Fragments skipped for slow viewers, including viewers that have left"""
+        with self._lock:
+            return self._departed_dropped + sum(client.dropped for client in self._clients)
+
+    @property
+    def skips(self) -> int:
+        """Times a slow viewer was skipped ahead to the next keyframe, including viewers that have left"""
+        with self._lock:
+            return self._departed_skips + sum(client.skips for client in self._clients)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        with self._lock:
+            clients = list(self._clients)
+        stats.update({
+            "mode": "low_latency",
+            "codec": self.muxer.codec,
+            "width": self.muxer.width,
+            "height": self.muxer.height,
+            "fragments": self.fragments,
+            "keyframes": self.keyframes,
+            "viewers": len(clients),
+            "viewers_served": self.viewers_served,
+            "dropped_fragments": self.dropped_fragments,
+            "skips": self.skips,
+            "viewers_timed_out": self.viewers_timed_out,
+            "send_p95": self.send_latency.percentile(95),
+            "clients": [client.stats() for client in clients],
+        })
+        return stats
+
+
+class _TestViewer:
+    """Minimal WebSocket client for the benchmark: reads frames and timestamps them"""
+
+    def __init__(self, host: str, port: int, path: str = LIVE_PATH, rcvbuf: Optional[int] = None):
+        import base64
+        import os
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if rcvbuf:
+            # Before connecting, so the advertised TCP window is small too
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.connect((host, port))
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        self.sock.sendall((f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\n"
+                           f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+                           "Sec-WebSocket-Version: 13\r\n\r\n").encode("ascii"))
+        self.rfile = self.sock.makefile("rb")
+        status = self.rfile.readline()
+        while self.rfile.readline() not in (b"\r\n", b""):
+            pass
+        if b" 101 " not in status:
+            raise OSError(f"upgrade refused: {status.decode(errors='replace').strip()}")
+
+    def read(self) -> Optional[tuple]:
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return None
+        length = header[1] & 0x7F
+        if length == 126:
+            length = int.from_bytes(self.rfile.read(2), "big")
+        elif length == 127:
+            length = int.from_bytes(self.rfile.read(8), "big")
+        return header[0] & 0x0F, self.rfile.read(length)
+
+    def close(self):
+        self.sock.close()
+
+
+def benchmark(source: str = "", mbps: float = 8.0, seconds: float = 10.0, slow_viewer: bool = True,
+              send_buffer: int = 64 * 1024, send_timeout: float = 2.0) -> dict:
+    """Datagram arrival to fragment received by a local viewer, plus a viewer that stops reading.
+
+    The stalled viewer should be skipped ahead to keyframes while its socket is backed
+    up, then disconnected after send_timeout, without delaying the other viewer.
+    """
+    import multiprocessing
+
+    from hls_segmenter import _replay
+    from hls_server import HLSServer
+    from segment_store import SegmentStore
+
+    ingest = UDPIngest(port=0, host="127.0.0.1")
+    server = HLSServer(SegmentStore(), host="127.0.0.1")
+    if not ingest.start() or not server.start():
+        return {}
+    live = LivePreview(ingest, send_buffer=send_buffer, send_timeout=send_timeout)
+    server.live = live
+    live.start()
+    sender = multiprocessing.Process(target=_replay, args=(source, ingest.port, seconds, mbps))
+    sender.start()
+    ready = live.wait_ready(5.0)
+    viewer = _TestViewer("127.0.0.1", server.port)
+    # A viewer that never reads: once its socket buffers fill, it must skip to keyframes
+    slow = _TestViewer("127.0.0.1", server.port, rcvbuf=4096) if slow_viewer else None
+    received = 0
+    received_bytes = 0
+    deadline = time.monotonic() + seconds
+    viewer.sock.settimeout(1.0)
+    try:
+        while time.monotonic() < deadline:
+            frame = viewer.read()
+            if frame is None:
+                break
+            if frame[0] == ws_protocol.OP_BINARY:
+                received += 1
+                received_bytes += len(frame[1])
+    except socket.timeout:
+        pass
+    sender.join()
+    stats = live.stats()
+    viewer.close()
+    if slow:
+        slow.close()
+    live.stop()
+    server.stop()
+    ingest.stop()
+    return {
+        "source": source or "synthetic",
+        "mbps": mbps,
+        "ready": ready,
+        "fragments_received": received,
+        "bytes_received": received_bytes,
+        "send_p50": live.send_latency.percentile(50),
+        "send_p95": live.send_latency.percentile(95),
+        "slow_viewer_skips": live.skips if slow_viewer else None,
+        "slow_viewer_disconnected": live.viewers_timed_out > 0 if slow_viewer else None,
+        "stats": stats,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure fMP4-over-WebSocket preview latency with local viewers")
+    parser.add_argument("--source", default="", help="MPEG-TS capture to replay (default: synthetic stream)")
+    parser.add_argument("--mbps", type=float, default=8.0)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--no-slow-viewer", action="store_true")
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.source, args.mbps, args.seconds, not args.no_slow_viewer), indent=2))
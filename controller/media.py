@@ -0,0 +1,336 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from command_client import CommandClient
+
+MEDIA_LIST = "gp/gpMediaList"
+MEDIA_PORT = 8080
+CACHE_FILE = ".gopro_media.json"
+
+
+class MediaItem(NamedTuple):
+    directory: str
+    name: str
+    size: int
+    modified: int
+
+    @property
+    def path(self) -> str:
+        return f"{self.directory}/{self.name}"
+
+
+def _safe_name(name: str) -> bool:
+    """A single path component that cannot leave the download directory"""
+    return name not in ("", ".", "..") and not any(sep in name for sep in ("/", "\\", os.sep))
+
+
+def parse_media_list(listing: dict) -> Dict[str, MediaItem]:
+    """Flatten a gpMediaList response into {"100GOPRO/GOPR0001.MP4": MediaItem}
+
+    Entries whose folder or file name is not a plain file name are dropped.
+    """
+    items = {}
+    for folder in listing.get("media", []):
+        directory = folder.get("d", "")
+        for entry in folder.get("fs", []):
+            item = MediaItem(directory, entry["n"], int(entry.get("s", 0)), int(entry.get("mod", 0)))
+            if not (_safe_name(item.directory) and _safe_name(item.name)):
+                print(f"skipping media entry with an unsafe path: {item.path!r}")
+                continue
+            items[item.path] = item
+    return items
+
+
+class DownloadProgress:
+    """Thread-safe byte and file counters for one camera's download run"""
+
+    def __init__(self, camera: str = ""):
+        self.camera = camera
+        self.files_total = 0
+        self.files_done = 0
+        self.files_skipped = 0
+        self.files_failed: List[str] = []
+        self.bytes_total = 0
+        self.bytes_completed = 0
+        self.bytes_skipped = 0
+        self.bytes_resumed = 0
+        self.current: Dict[str, Tuple[int, int]] = {}
+        # Bytes of each file already on disk before this run, i.e. not transferred by it
+        self._resumed: Dict[str, int] = {}
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def queue(self, item: MediaItem, present: bool):
+        with self._lock:
+            self.files_total += 1
+            self.bytes_total += item.size
+            if present:
+                self.files_done += 1
+                self.files_skipped += 1
+                self.bytes_completed += item.size
+                self.bytes_skipped += item.size
+
+    def begin(self, path: str, offset: int, size: int):
+        """A transfer attempt starts at offset.
+
+        Only the first attempt's offset counts as resumed: on a retry, the bytes before
+        offset were transferred by this run. A retry that starts over lowers it.
+        """
+        with self._lock:
+            self.current[path] = (offset, size)
+            resumed = self._resumed.get(path)
+            if resumed is None or offset < resumed:
+                self.bytes_resumed += offset - (resumed or 0)
+                self._resumed[path] = offset
+
+    def add(self, path: str, count: int):
+        with self._lock:
+            done, size = self.current.get(path, (0, 0))
+            self.current[path] = (done + count, size)
+
+    def finish(self, item: MediaItem, ok: bool):
+        with self._lock:
+            self.current.pop(item.path, None)
+            resumed = self._resumed.pop(item.path, 0)
+            if not ok:
+                # Neither its bytes nor its resumed bytes count towards bytes_done
+                self.bytes_resumed -= resumed
+            if ok:
+                self.files_done += 1
+                self.bytes_completed += item.size
+            else:
+                self.files_failed.append(item.path)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+            in_flight = sum(done for done, _ in self.current.values())
+            done = self.bytes_completed + in_flight
+            transferred = done - self.bytes_resumed - self.bytes_skipped
+            return {
+                "camera": self.camera,
+                "files_total": self.files_total,
+                "files_done": self.files_done,
+                "files_skipped": self.files_skipped,
+                "files_failed": list(self.files_failed),
+                "bytes_total": self.bytes_total,
+                "bytes_done": done,
+                "bytes_transferred": max(0, transferred),
+                "fraction": done / self.bytes_total if self.bytes_total else 1.0,
+                "mbps": max(0, transferred) * 8 / elapsed / 1e6 if elapsed else 0.0,
+                "elapsed": elapsed,
+                "current": dict(self.current),
+            }
+
+
+class MediaClient:
+    """Lists and downloads one camera's SD card media.
+
+    The gpMediaList listing is cached on disk next to the downloads and only re-read
+    when the camera reports a different listing id. Files are fetched over a pool of
+    keep-alive connections, streamed to a .part file in chunk_size pieces, resumed
+    with a Range request after an interruption, and skipped when a file with the
+    same name and size is already present.
+    """
+
+    def __init__(self, ip: str = "10.5.5.9", directory: str = "gopro-media", concurrency: int = 4,
+                 chunk_size: int = 1024 * 1024, retries: int = 3, media_url: Optional[str] = None,
+                 control_url: Optional[str] = None, timeout: Tuple[float, float] = (3.0, 30.0)):
+        self.ip = ip
+        self.directory = directory
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.timeout = timeout
+        self.media_url = (media_url or f"http://{ip}:{MEDIA_PORT}/videos/DCIM").rstrip("/")
+        self.client = CommandClient(control_url or f"http://{ip}", read_timeout=timeout[1])
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.items: Dict[str, MediaItem] = {}
+        self.listing_id: Optional[str] = None
+        self._cache_path = os.path.join(directory, CACHE_FILE)
+        self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self._cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.listing_id = cache.get("id")
+        items = (MediaItem(*fields) for fields in cache.get("items", {}).values())
+        self.items = {item.path: item for item in items if _safe_name(item.directory) and _safe_name(item.name)}
+
+    def _save_cache(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._cache_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"id": self.listing_id, "items": {p: list(i) for p, i in self.items.items()}}, f)
+        os.replace(tmp, self._cache_path)
+
+    def list_media(self) -> Optional[Tuple[List[MediaItem], List[MediaItem]]]:
+        """Refresh the cached listing; returns (added, removed) since the last refresh, or None on error"""
+        response = self.client.get(MEDIA_LIST)
+        if response is None:
+            return None
+        try:
+            listing = response.json()
+        except ValueError:
+            return None
+        listing_id = str(listing.get("id")) if listing.get("id") is not None else None
+        if listing_id is not None and listing_id == self.listing_id:
+            return [], []
+        items = parse_media_list(listing)
+        added = [item for path, item in items.items() if self.items.get(path) != item]
+        removed = [item for path, item in self.items.items() if path not in items]
+        self.items = items
+        self.listing_id = listing_id
+        self._save_cache()
+        return added, removed
+
+    def local_path(self, item: MediaItem) -> str:
+        if not (_safe_name(item.directory) and _safe_name(item.name)):
+            raise ValueError(f"unsafe media path {item.path!r}")
+        return os.path.join(self.directory, item.directory, item.name)
+
+    def is_downloaded(self, item: MediaItem) -> bool:
+        try:
+            return os.path.getsize(self.local_path(item)) == item.size
+        except OSError:
+            return False
+
+    def download(self, items: Optional[Iterable[MediaItem]] = None,
+                 on_progress: Optional[Callable[[dict], None]] = None, progress_interval: float = 0.5,
+                 progress: Optional[DownloadProgress] = None) -> dict:
+        """Download items (default: the whole cached listing) with `concurrency` parallel transfers.
+
+        on_progress is called on the calling thread every progress_interval seconds.
+        """
+        if items is None:
+            if self.list_media() is None and not self.items:
+                return {"error": "could not read the media list"}
+            items = self.items.values()
+        progress = progress or DownloadProgress(self.ip)
+        pending = []
+        for item in items:
+            present = self.is_downloaded(item)
+            progress.queue(item, present)
+            if not present:
+                pending.append(item)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = {pool.submit(self._fetch, item, progress): item for item in pending}
+            while futures:
+                done, _ = wait(futures, timeout=progress_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    progress.finish(futures.pop(future), future.result())
+                if on_progress:
+                    on_progress(progress.snapshot())
+        progress.finished_at = time.monotonic()
+        return progress.snapshot()
+
+    def _fetch(self, item: MediaItem, progress: DownloadProgress) -> bool:
+        path = self.local_path(item)
+        part = path + ".part"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        url = f"{self.media_url}/{item.directory}/{item.name}"
+        for attempt in range(self.retries + 1):
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            if offset == item.size:
+                break
+            if offset > item.size:
+                offset = 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    # A server that ignores Range answers 200 with the whole file
+                    if response.status_code != 206:
+                        offset = 0
+                    progress.begin(item.path, offset, item.size)
+                    with open(part, "ab" if offset else "wb") as f:
+                        for chunk in response.iter_content(self.chunk_size):
+                            f.write(chunk)
+                            progress.add(item.path, len(chunk))
+            except (requests.exceptions.RequestException, OSError) as e:
+                print(f"{self.ip}: download of {item.path} interrupted: {e}")
+                if attempt < self.retries:
+                    time.sleep(min(0.5 * 2 ** attempt, 5.0))
+        try:
+            if os.path.getsize(part) != item.size:
+                return False
+            os.replace(part, path)
+        except OSError:
+            return False
+        return True
+
+    def close(self):
+        self.session.close()
+        self.client.close()
+
+
+def download_fleet(clients: Iterable[MediaClient], on_progress: Optional[Callable[[dict], None]] = None,
+                   progress_interval: float = 1.0) -> dict:
+    """Download every camera's media at once; on_progress gets per-camera and combined totals"""
+    clients = list(clients)
+    progress = {client.ip: DownloadProgress(client.ip) for client in clients}
+    threads = [
+        threading.Thread(target=client.download, kwargs={"progress": progress[client.ip]}, daemon=True)
+        for client in clients
+    ]
+    for thread in threads:
+        thread.start()
+
+    def summary() -> dict:
+        cameras = {ip: p.snapshot() for ip, p in progress.items()}
+        total = sum(c["bytes_total"] for c in cameras.values())
+        done = sum(c["bytes_done"] for c in cameras.values())
+        return {
+            "cameras": cameras,
+            "files_total": sum(c["files_total"] for c in cameras.values()),
+            "files_done": sum(c["files_done"] for c in cameras.values()),
+            "bytes_total": total,
+            "bytes_done": done,
+            "fraction": done / total if total else 1.0,
+            "mbps": sum(c["mbps"] for c in cameras.values()),
+        }
+
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=progress_interval / len(threads))
+        if on_progress:
+            on_progress(summary())
+    return summary()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Download the media on one or more cameras")
+    parser.add_argument("ips", nargs="*", default=["10.5.5.9"])
+    parser.add_argument("--directory", default="gopro-media")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--media-url", default=None, help="override the media base URL (single camera)")
+    parser.add_argument("--control-url", default=None, help="override the gpControl base URL (single camera)")
+    args = parser.parse_args()
+
+    def report(p):
+        print(f"{p['files_done']}/{p['files_total']} files  {p['bytes_done'] / 1e6:.1f}/"
+              f"{p['bytes_total'] / 1e6:.1f} MB  {p['mbps']:.1f} Mbit/s")
+
+    media = [
+        MediaClient(ip, os.path.join(args.directory, ip) if len(args.ips) > 1 else args.directory,
+                    args.concurrency, media_url=args.media_url, control_url=args.control_url)
+        for ip in args.ips
+    ]
+    result = download_fleet(media, report) if len(media) > 1 else media[0].download(on_progress=report)
+    print(json.dumps(result, indent=2))
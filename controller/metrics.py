@@ -0,0 +1,199 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+# Pipeline stage latencies span microseconds (TS indexing) to seconds (segment output)
+STAGE_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05,
+                 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (seconds), cheap enough to update on every command"""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets: Sequence[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            self.min = seconds if self.min is None else min(self.min, seconds)
+            self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bucket bound containing the q-th percentile (0-100)"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q / 100.0 * self.count
+            seen = 0
+            for i, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank and n:
+                    return self.buckets[i] if i < len(self.buckets) else self.max
+            return self.max
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self.counts)
+            count, total = self.count, self.total
+            low, high = self.min, self.max
+        return {
+            "count": count,
+            "mean": total / count if count else None,
+            "min": low,
+            "max": high,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], counts)),
+        }
+
+
+class Metric(NamedTuple):
+    name: str
+    kind: str  # counter, gauge or histogram
+    help: str
+    labels: Dict[str, str]
+    value: object  # a number, or a LatencyHistogram for histograms
+
+
+def counter(name: str, help: str, value, **labels) -> Metric:
+    return Metric(name, "counter", help, labels, value)
+
+
+def gauge(name: str, help: str, value, **labels) -> Metric:
+    return Metric(name, "gauge", help, labels, value)
+
+
+def histogram(name: str, help: str, hist: LatencyHistogram, **labels) -> Metric:
+    return Metric(name, "histogram", help, labels, hist)
+
+
+def _format_labels(labels: Dict[str, str], extra: Optional[Dict[str, str]] = None) -> str:
+    merged = dict(labels)
+    if extra:
+        merged.update(extra)
+    if not merged:
+        return ""
+    parts = []
+    for key, value in merged.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def render(metrics: List[Metric]) -> str:
+    """Prometheus text exposition (format 0.0.4)"""
+    lines = []
+    described = set()
+    for metric in sorted(metrics, key=lambda m: m.name):
+        if metric.name not in described:
+            described.add(metric.name)
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+        if metric.kind != "histogram":
+            if metric.value is None:
+                continue
+            lines.append(f"{metric.name}{_format_labels(metric.labels)} {float(metric.value):g}")
+            continue
+        snapshot = metric.value.snapshot()
+        cumulative = 0
+        for bound, count in snapshot["buckets"].items():
+            cumulative += count
+            lines.append(f"{metric.name}_bucket{_format_labels(metric.labels, {'le': bound})} {cumulative}")
+        total = metric.value.total
+        lines.append(f"{metric.name}_sum{_format_labels(metric.labels)} {total:g}")
+        lines.append(f"{metric.name}_count{_format_labels(metric.labels)} {snapshot['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsRegistry:
+    """Collects metrics from every registered source when scraped"""
+
+    def __init__(self):
+        self._collectors: Dict[str, Callable[[], List[Metric]]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, collect: Callable[[], List[Metric]]):
+        with self._lock:
+            self._collectors[name] = collect
+
+    def unregister(self, name: str):
+        with self._lock:
+            self._collectors.pop(name, None)
+
+    def collect(self) -> List[Metric]:
+        with self._lock:
+            collectors = list(self._collectors.values())
+        metrics = []
+        for collect in collectors:
+            try:
+                metrics.extend(collect())
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+        return metrics
+
+    def render(self) -> str:
+        return render(self.collect())
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer:
+    """Process-wide /metrics endpoint for every registered camera"""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, host: str = "", port: int = 9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.httpd: Optional[ThreadingHTTPServer] = None
+
+    def start(self) -> bool:
+        if self.httpd:
+            return True
+        try:
+            httpd = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+        except OSError as e:
+            print(f"Error starting metrics server: {e}")
+            return False
+        httpd.daemon_threads = True
+        httpd.registry = self.registry
+        self.httpd = httpd
+        self.port = httpd.server_address[1]
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return True
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -0,0 +1,282 @@
+import os
+import re
+import time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from metrics import STAGE_BUCKETS, LatencyHistogram
+from stream_tee import Sink
+from ts_ingest import FLAG_KEYFRAME, UDPIngest
+
+FSYNC_POLICIES = ("none", "segment", "interval", "always")
+
+
+class PrerollRecorder(Sink):
+    """Keeps the last preroll_seconds of the stream in memory and records on trigger().
+
+    The pre-roll is held as whole GOPs, so a triggered recording always starts on a
+    keyframe somewhat before the trigger. Once triggered, the pre-roll is flushed and
+    the live stream follows into segment files that rotate at the first keyframe past
+    segment_seconds or segment_bytes. Writes go out in write_batch sized chunks;
+    fsync runs per segment, per interval, on every batch, or never. After each
+    rotation the oldest segments with this prefix are deleted until the directory is
+    back under disk_budget.
+
+    A restart() (e.g. by the watchdog) keeps the pre-roll and an active recording;
+    the recording carries on in a new segment.
+    """
+
+    kind = "recorder"
+
+    def __init__(self, directory: str, ingest: Optional[UDPIngest] = None, prefix: str = "gopro",
+                 preroll_seconds: float = 10.0, max_preroll_bytes: int = 64 * 1024 * 1024,
+                 segment_seconds: float = 60.0, segment_bytes: int = 512 * 1024 * 1024,
+                 write_batch: int = 4 * 1024 * 1024, flush_interval: float = 1.0, fsync: str = "segment",
+                 fsync_interval: float = 5.0, disk_budget: int = 8 * 1024 * 1024 * 1024,
+                 preallocate: bool = True):
+        super().__init__(ingest)
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}")
+        self.directory = directory
+        self.prefix = prefix
+        self.preroll_seconds = preroll_seconds
+        self.max_preroll_bytes = max_preroll_bytes
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.write_batch = write_batch
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.disk_budget = disk_budget
+        self.preallocate = preallocate
+        self.recording = False
+        self.segments_written = 0
+        self.segments_deleted = 0
+        self.bytes_written = 0
+        self.batches = 0
+        self.fsyncs = 0
+        self.preroll_flushed = 0.0
+        self.batch_latency = LatencyHistogram(STAGE_BUCKETS)
+        self.current_path: Optional[str] = None
+        self._name = re.compile(re.escape(prefix) + r"_\d{8}-\d{6}_\d{4}\.ts$")
+        self._requested: Optional[bool] = None
+        self._gops: Deque[Tuple[float, bytearray]] = deque()
+        self._preroll_bytes = 0
+        self._batch = bytearray()
+        self._batch_started = 0.0
+        self._fd: Optional[int] = None
+        self._segment_started = 0.0
+        self._segment_size = 0
+        self._segment_index = 0
+        self._session = ""
+        self._last_fsync = 0.0
+        self._restarting = False
+
+    def open(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            self._fail(str(e))
+            return False
+        if self.recording and self._fd is None:
+            # Restarted mid-recording; the stream resumes in the next segment
+            self._segment_index += 1
+            if not self._open_segment(time.monotonic()):
+                self.recording = False
+                return False
+
+    def trigger(self):
+        """Start recording: the buffered pre-roll is written first, then the live stream"""
+        self._requested = True
+
+    def release(self):
+        """Stop recording and go back to buffering pre-roll only"""
+        self._requested = False
+
+    def write(self, seq, view, flags, arrival):
+        if self._requested is not None:
+            self._apply_request()
+        if self.recording:
+            if self._rotation_due(arrival, 1) and (flags & FLAG_KEYFRAME or self._rotation_due(arrival, 2)):
+                self._rotate(arrival)
+            self._append(view, arrival)
+            return
+        # Buffer whole GOPs so the pre-roll can always start on a keyframe
+        if flags & FLAG_KEYFRAME or not self._gops:
+            self._gops.append((arrival, bytearray()))
+        self._gops[-1][1].extend(view)
+        self._preroll_bytes += len(view)
+        # Drop the oldest GOP once the next one alone still covers the pre-roll window
+        while len(self._gops) > 1 and (self._gops[1][0] <= arrival - self.preroll_seconds or
+                                       self._preroll_bytes > self.max_preroll_bytes):
+            self._preroll_bytes -= len(self._gops.popleft()[1])
+
+    def idle(self):
+        if self._requested is not None:
+            self._apply_request()
+        if self._batch and time.monotonic() - self._batch_started >= self.flush_interval:
+            self._flush()
+
+    def close(self):
+        if self.recording:
+            self._close_segment()
+            if not self._restarting:
+                self.recording = False
+        if not self._restarting:
+            self._gops.clear()
+            self._preroll_bytes = 0
+
+    def restart(self) -> bool:
+        self._restarting = True
+        try:
+            return super().restart()
+        finally:
+            self._restarting = False
+
+    def _apply_request(self):
+        requested, self._requested = self._requested, None
+        if requested and not self.recording:
+            session = time.strftime("%Y%m%d-%H%M%S")
+            # Two recordings within the same second continue the numbering instead of overwriting
+            self._segment_index = self._segment_index + 1 if session == self._session else 0
+            self._session = session
+            now = time.monotonic()
+            if not self._open_segment(now):
+                return
+            self.recording = True
+            if self._gops:
+                self.preroll_flushed = now - self._gops[0][0]
+                # The pre-roll counts towards the first segment's duration
+                self._segment_started = self._gops[0][0]
+            while self._gops:
+                arrival, data = self._gops.popleft()
+                self._append(data, arrival)
+            self._preroll_bytes = 0
+        elif requested is False and self.recording:
+            self._close_segment()
+            self.recording = False
+
+    def _rotation_due(self, arrival: float, factor: int) -> bool:
+        # Past the limit, rotate at the next keyframe; past twice the limit, rotate anyway
+        return arrival - self._segment_started >= self.segment_seconds * factor or \
+            self._segment_size >= self.segment_bytes * factor
+
+    def _segment_path(self) -> str:
+        return os.path.join(self.directory, f"{self.prefix}_{self._session}_{self._segment_index:04d}.ts")
+
+    def _open_segment(self, started: float) -> bool:
+        path = self._segment_path()
+        try:
+            self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        except OSError as e:
+            self._fail(str(e))
+            return False
+        if self.preallocate and hasattr(os, "posix_fallocate"):
+            # Reserve the whole segment up front so it lands in few extents
+            try:
+                os.posix_fallocate(self._fd, 0, self.segment_bytes)
+            except OSError:
+                pass
+        self.current_path = path
+        self._segment_started = started
+        self._segment_size = 0
+        self._last_fsync = time.monotonic()
+        self._enforce_budget()
+        return True
+
+    def _close_segment(self):
+        self._flush()
+        if self._fd is None:
+            return
+        try:
+            os.ftruncate(self._fd, self._segment_size)
+            if self.fsync != "none":
+                os.fsync(self._fd)
+                self.fsyncs += 1
+        except OSError as e:
+            print(f"Recorder error closing {self.current_path}: {e}")
+        os.close(self._fd)
+        self._fd = None
+        self.segments_written += 1
+        self.current_path = None
+
+    def _rotate(self, arrival: float):
+        self._close_segment()
+        self._segment_index += 1
+        if not self._open_segment(arrival):
+            self.recording = False
+
+    def _append(self, data, arrival: float):
+        if not self._batch:
+            self._batch_started = time.monotonic()
+        self._batch += data
+        self._segment_size += len(data)
+        if len(self._batch) >= self.write_batch:
+            self._flush()
+
+    def _flush(self):
+        if not self._batch or self._fd is None:
+            return
+        start = time.monotonic()
+        try:
+            view = memoryview(self._batch)
+            while view:
+                view = view[os.write(self._fd, view):]
+            if self.fsync == "always" or \
+                    (self.fsync == "interval" and start - self._last_fsync >= self.fsync_interval):
+                os.fsync(self._fd)
+                self.fsyncs += 1
+                self._last_fsync = start
+        except OSError as e:
+            self._fail(str(e))
+            return
+        self.bytes_written += len(self._batch)
+        self.batches += 1
+        self.batch_latency.observe(time.monotonic() - start)
+        self._batch = bytearray()
+
+    def segments(self) -> List[str]:
+        """This recorder's segment files on disk, oldest first"""
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if self._name.match(n))
+        except OSError:
+            return []
+        return [os.path.join(self.directory, n) for n in names]
+
+    def _enforce_budget(self):
+        files = []
+        total = 0
+        for path in self.segments():
+            try:
+                size = self.segment_bytes if path == self.current_path else os.path.getsize(path)
+            except OSError:
+                continue
+            files.append((path, size))
+            total += size
+        for path, size in files:
+            if total <= self.disk_budget or path == self.current_path:
+                break
+            try:
+                os.remove(path)
+                self.segments_deleted += 1
+                total -= size
+            except OSError as e:
+                print(f"Recorder could not delete {path}: {e}")
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        oldest = self._gops[0][0] if self._gops else None
+        stats.update({
+            "recording": self.recording,
+            "current_segment": self.current_path,
+            "preroll_seconds": time.monotonic() - oldest if oldest is not None else 0.0,
+            "preroll_bytes": self._preroll_bytes,
+            "preroll_flushed": self.preroll_flushed,
+            "segments_written": self.segments_written,
+            "segments_deleted": self.segments_deleted,
+            "bytes_written": self.bytes_written,
+            "batches": self.batches,
+            "fsyncs": self.fsyncs,
+            "batch_write_p95": self.batch_latency.percentile(95),
+        })
+        return stats
@@ -0,0 +1,134 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from metrics import STAGE_BUCKETS, LatencyHistogram
+
+SEGMENT_NAME = re.compile(r"^(?P<name>.+?)(?P<sequence>\d+)\.ts$")
+
+
+class SegmentStore:
+    """Bounded in-memory HLS segment store for one camera.
+
+    Holds the newest segments (evicting by count and total bytes), renders the live
+    playlist from them, and lets readers block until a given media sequence number
+    exists, which is what blocking playlist reload (_HLS_msn) needs. Segments added
+    with discontinuity=True get an EXT-X-DISCONTINUITY tag ahead of them.
+    """
+
+    def __init__(self, name: str = "stream", list_size: int = 3, max_segments: int = 6,
+                 max_bytes: int = 64 * 1024 * 1024):
+        self.name = name
+        self.list_size = list_size
+        self.max_segments = max(max_segments, list_size + 1)
+        self.max_bytes = max_bytes
+        self.segments: "OrderedDict[int, Tuple[bytes, float]]" = OrderedDict()
+        self.bytes = 0
+        self.evicted = 0
+        self.last_sequence: Optional[int] = None
+        self.updated_at: Optional[float] = None
+        # Publish-to-first-request delay, i.e. how long a segment waits for the player
+        self.serve_latency = LatencyHistogram(STAGE_BUCKETS)
+        self._unserved: Dict[int, float] = {}
+        # Sequences that follow a cut, and how many such cuts were evicted (EXT-X-DISCONTINUITY-SEQUENCE)
+        self._discontinuities: Set[int] = set()
+        self._discontinuity_sequence = 0
+        self._cond = threading.Condition()
+
+    def add(self, sequence: int, data, duration: float, discontinuity: bool = False):
+        with self._cond:
+            if discontinuity:
+                self._discontinuities.add(sequence)
+            if sequence in self.segments:
+                self.bytes -= len(self.segments.pop(sequence)[0])
+            self.segments[sequence] = (data, duration)
+            self.bytes += len(data)
+            while len(self.segments) > self.max_segments or \
+                    (self.bytes > self.max_bytes and len(self.segments) > 1):
+                old_sequence, (old, _) = self.segments.popitem(last=False)
+                self._unserved.pop(old_sequence, None)
+                if old_sequence in self._discontinuities:
+                    self._discontinuities.remove(old_sequence)
+                    self._discontinuity_sequence += 1
+                self.bytes -= len(old)
+                self.evicted += 1
+            if self.last_sequence is None or sequence > self.last_sequence:
+                self.last_sequence = sequence
+            self.updated_at = time.monotonic()
+            if sequence in self.segments:
+                self._unserved[sequence] = self.updated_at
+            self._cond.notify_all()
+
+    def set_durations(self, durations: dict):
+        """Update segment durations, e.g. from a playlist an external muxer uploaded"""
+        with self._cond:
+            for sequence, duration in durations.items():
+                if sequence in self.segments:
+                    data, _ = self.segments[sequence]
+                    self.segments[sequence] = (data, duration)
+
+    def segment(self, filename: str):
+        match = SEGMENT_NAME.match(filename)
+        if not match or match.group("name") != self.name:
+            return None
+        sequence = int(match.group("sequence"))
+        with self._cond:
+            entry = self.segments.get(sequence)
+            added_at = self._unserved.pop(sequence, None)
+        if added_at is not None:
+            self.serve_latency.observe(time.monotonic() - added_at)
+        return entry[0] if entry else None
+
+    def wait_for(self, sequence: int, timeout: float) -> bool:
+        """Block until segment `sequence` (or a later one) has been added"""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self.last_sequence is not None and self.last_sequence >= sequence, timeout
+            )
+
+    def playlist(self) -> Optional[str]:
+        with self._cond:
+            live = list(self.segments.items())[-self.list_size:]
+            discontinuities = set(self._discontinuities)
+            discontinuity_sequence = self._discontinuity_sequence
+        if not live:
+            return None
+        discontinuity_sequence += sum(1 for sequence in discontinuities if sequence < live[0][0])
+        target = max([1] + [int(duration + 0.999) for _, (_, duration) in live])
+        lines = [
+            "#EXTM3U",
+            # Blocking playlist reload (EXT-X-SERVER-CONTROL) is an LL-HLS feature of version 9
+            "#EXT-X-VERSION:9",
+            f"#EXT-X-TARGETDURATION:{target}",
+            "#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES",
+            f"#EXT-X-MEDIA-SEQUENCE:{live[0][0]}",
+        ]
+        if discontinuity_sequence:
+            lines.append(f"#EXT-X-DISCONTINUITY-SEQUENCE:{discontinuity_sequence}")
+        for sequence, (_, duration) in live:
+            if sequence in discontinuities:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f"#EXTINF:{duration:.6f},")
+            lines.append(f"{self.name}{sequence}.ts")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._cond:
+            self.segments.clear()
+            self._unserved.clear()
+            self._discontinuities.clear()
+            self._discontinuity_sequence = 0
+            self.bytes = 0
+            self.last_sequence = None
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "segments": len(self.segments),
+                "bytes": self.bytes,
+                "evicted": self.evicted,
+                "last_sequence": self.last_sequence,
+            }
@@ -0,0 +1,264 @@
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, NamedTuple, Optional
+
+from metrics import STAGE_BUCKETS, LatencyHistogram
+from stream_tee import Sink
+from ts_ingest import (FLAG_DISCONTINUITY, FLAG_KEYFRAME, FLAG_PES_START, FLAG_PSI, TS_PACKET_SIZE,
+                       UDPIngest, pes_start_offset, psi_packets)
+
+# One decode pool for every camera in the process, so a host with many cameras runs
+# at most this many ffmpeg decoders at once however many snapshots fall due together
+DECODE_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+_decoders = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="snapshot")
+
+
+class Snapshot(NamedTuple):
+    jpeg: bytes
+    captured_at: float  # monotonic arrival of the keyframe
+    timestamp: float    # wall clock time of the keyframe
+    width: int
+    height: int
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.captured_at
+
+
+def pid_packets(view, pid: int) -> bytes:
+    """Copy out the TS packets of one PID from a datagram"""
+    packets = []
+    for pos in range(0, len(view) - len(view) % TS_PACKET_SIZE, TS_PACKET_SIZE):
+        if ((view[pos + 1] & 0x1F) << 8 | view[pos + 2]) == pid:
+            packets.append(bytes(view[pos:pos + TS_PACKET_SIZE]))
+    return b"".join(packets)
+
+
+def decode_command(width: int, height: Optional[int], quality: int) -> list:
+    return [
+        'ffmpeg',
+        '-loglevel', 'error',
+        '-threads', '1',
+        '-skip_frame', 'nokey',
+        '-f', 'mpegts',
+        '-i', 'pipe:0',
+        '-an',
+        '-frames:v', '1',
+        '-vf', f'scale={width}:{height or -2}',
+        '-q:v', str(quality),
+        '-f', 'image2pipe',
+        '-c:v', 'mjpeg',
+        'pipe:1'
+    ]
+
+
+def decode_keyframe(access_unit: bytes, width: int = 320, height: Optional[int] = None, quality: int = 5,
+                    timeout: float = 5.0) -> Optional[bytes]:
+    """Decode one IDR access unit (PAT/PMT + video PES as TS) to a JPEG; None on error"""
+    try:
+        result = subprocess.run(decode_command(width, height, quality), input=access_unit,
+                                capture_output=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        print("Snapshot decode timed out")
+        return None
+    if result.returncode != 0 or not result.stdout:
+        print(f"Snapshot decode failed: {result.stderr.decode(errors='replace').strip()}")
+        return None
+    return result.stdout
+
+
+class SnapshotSink(Sink):
+    """Keeps a JPEG thumbnail of the latest keyframe, at a fraction of the preview's cost.
+
+    Only the datagrams of an IDR access unit are copied out of the ring, and only
+    when the previous thumbnail is at least `interval` seconds old; everything else
+    is skipped without being parsed beyond the ingest's flags. The access unit is
+    decoded by a one-shot ffmpeg that skips non-key frames and scales to width x
+    height (height None keeps the aspect ratio). Decodes run on a pool shared by all
+    cameras, and a camera whose previous decode hasn't finished skips the keyframe.
+    """
+
+    kind = "snapshot"
+    jitter_buffer = True
+
+    def __init__(self, ingest: Optional[UDPIngest] = None, width: int = 320, height: Optional[int] = None,
+                 interval: float = 2.0, quality: int = 5, max_access_unit: int = 4 * 1024 * 1024,
+                 on_snapshot: Optional[Callable[[Snapshot], None]] = None):
+        super().__init__(ingest)
+        self.width = width
+        self.height = height
+        self.interval = interval
+        self.quality = quality
+        self.max_access_unit = max_access_unit
+        self.on_snapshot = on_snapshot
+        self.latest: Optional[Snapshot] = None
+        self.keyframes = 0
+        self.captured = 0
+        self.decoded = 0
+        self.decode_errors = 0
+        self.skipped_busy = 0
+        # Keyframe arrival -> JPEG cached
+        self.snapshot_latency = LatencyHistogram(STAGE_BUCKETS)
+        self._psi = b""
+        self._unit: Optional[bytearray] = None
+        self._unit_arrival = 0.0
+        self._unit_timestamp = 0.0
+        self._last_capture: Optional[float] = None
+        self._pending: Optional[Future] = None
+        self._updated = threading.Condition()
+
+    def close(self):
+        self._unit = None
+
+    def write(self, seq, view, flags, arrival):
+        if flags & FLAG_PSI:
+            self._psi = psi_packets(view, self.ingest.indexer.pmt_pids) or self._psi
+        if flags & FLAG_DISCONTINUITY:
+            self._unit = None
+        video_pid = self.ingest.indexer.video_pid
+        if self._unit is not None:
+            if flags & FLAG_PES_START:
+                # The next access unit starts here, so the keyframe is complete
+                self._unit += pid_packets(view[:pes_start_offset(view, video_pid)], video_pid)
+                self._submit()
+            else:
+                self._unit += pid_packets(view, video_pid)
+                if len(self._unit) > self.max_access_unit:
+                    self._unit = None
+            return
+        if not flags & FLAG_KEYFRAME or video_pid is None:
+            return
+        self.keyframes += 1
+        if not self._psi or (self._last_capture is not None and arrival - self._last_capture < self.interval):
+            return
+        if self._pending is not None and not self._pending.done():
+            self.skipped_busy += 1
+            return
+        self._unit = bytearray(self._psi)
+        self._unit += pid_packets(view[pes_start_offset(view, video_pid):], video_pid)
+        self._unit_arrival = arrival
+        self._unit_timestamp = time.time() - (time.monotonic() - arrival)
+
+    def _submit(self):
+        unit, self._unit = bytes(self._unit), None
+        self._last_capture = self._unit_arrival
+        self.captured += 1
+        self._pending = _decoders.submit(self._decode, unit, self._unit_arrival, self._unit_timestamp)
+
+    def _decode(self, unit: bytes, arrival: float, timestamp: float):
+        try:
+            jpeg = decode_keyframe(unit, self.width, self.height, self.quality)
+        except OSError as e:
+            self._fail(f"error starting ffmpeg: {e}")
+            return
+        if jpeg is None:
+            self.decode_errors += 1
+            return
+        snapshot = Snapshot(jpeg, arrival, timestamp, self.width, self.height or 0)
+        self.decoded += 1
+        self.snapshot_latency.observe(time.monotonic() - arrival)
+        with self._updated:
+            self.latest = snapshot
+            self._updated.notify_all()
+        if self.on_snapshot:
+            try:
+                self.on_snapshot(snapshot)
+            except Exception as e:
+                print(f"Snapshot callback error: {e}")
+
+    def snapshot(self, max_age: Optional[float] = None) -> Optional[Snapshot]:
+        """The latest thumbnail, or None if there is none younger than max_age seconds"""
+        latest = self.latest
+        if latest is None or (max_age is not None and latest.age > max_age):
+            return None
+        return latest
+
+    def wait(self, timeout: float, max_age: Optional[float] = None) -> Optional[Snapshot]:
+        """Block until a thumbnail younger than max_age is available (default: a new one)"""
+        deadline = time.monotonic() + timeout
+        previous = self.latest
+        with self._updated:
+            while True:
+                latest = self.latest
+                if latest is not None and (latest.age <= max_age if max_age is not None else latest is not previous):
+                    return latest
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running:
+                    return None
+                self._updated.wait(remaining)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        latest = self.latest
+        stats.update({
+            "width": self.width,
+            "interval": self.interval,
+            "keyframes": self.keyframes,
+            "captured": self.captured,
+            "decoded": self.decoded,
+            "decode_errors": self.decode_errors,
+            "skipped_busy": self.skipped_busy,
+            "latest_age": latest.age if latest else None,
+            "latest_bytes": len(latest.jpeg) if latest else 0,
+            "snapshot_p95": self.snapshot_latency.percentile(95),
+        })
+        return stats
+
+
+def benchmark(source: str = "", mbps: float = 8.0, seconds: float = 10.0, width: int = 320,
+              interval: float = 2.0) -> dict:
+    """CPU of the snapshot sink and its ffmpeg decodes, fed from a local sender"""
+    import multiprocessing
+    import resource
+    from multiprocessing.connection import wait
+
+    from hls_segmenter import _replay
+
+    ingest = UDPIngest(port=0, host="127.0.0.1")
+    if not ingest.start():
+        return {}
+    sink = SnapshotSink(ingest, width=width, interval=interval)
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    sink.start()
+    sender = multiprocessing.Process(target=_replay, args=(source, ingest.port, seconds, mbps))
+    sender.start()
+    first_snapshot = sink.wait(seconds)
+    time_to_first = time.monotonic() - wall_start if first_snapshot else None
+    # Wait for the sender without reaping it, so only the ffmpeg decodes land in the child delta
+    wait([sender.sentinel])
+    sink.stop()
+    _decoders.submit(lambda: None).result()
+    ingest.stop()
+    wall = time.monotonic() - wall_start
+    cpu = time.process_time() - cpu_start
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    sender.join()
+    child_cpu = (children.ru_utime - children_before.ru_utime) + (children.ru_stime - children_before.ru_stime)
+    return {
+        "mode": "snapshot",
+        "source": source or "synthetic",
+        "mbps": mbps,
+        "cpu_percent": 100.0 * cpu / wall,
+        "ffmpeg_cpu_percent": 100.0 * child_cpu / wall,
+        "time_to_first_snapshot": time_to_first,
+        "stats": sink.stats(),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Measure the CPU cost of keyframe thumbnails")
+    parser.add_argument("--source", default="", help="MPEG-TS capture to replay (default: synthetic stream)")
+    parser.add_argument("--mbps", type=float, default=8.0)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--interval", type=float, default=2.0)
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.source, args.mbps, args.seconds, args.width, args.interval), indent=2))
@@ -0,0 +1,144 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+def status_diff(old: Optional[dict], new: dict) -> Dict[str, dict]:
+    """Changed keys per section, e.g. {"status": {"8": (0, 1)}, "settings": {"2": (9, 1)}}"""
+    old = old or {}
+    diff = {}
+    for section, values in new.items():
+        if not isinstance(values, dict):
+            continue
+        previous = old.get(section) or {}
+        changed = {
+            key: (previous.get(key), value)
+            for key, value in values.items()
+            if previous.get(key) != value
+        }
+        changed.update({key: (value, None) for key, value in previous.items() if key not in values})
+        if changed:
+            diff[section] = changed
+    return diff
+
+
+class StatusWatcher:
+    """Polls camera status in the background at an adaptive rate.
+
+    Reads are served from a TTL cache. The poll interval drops to fast_interval
+    whenever something changes (or boost() is called after a command) and backs
+    off towards slow_interval while the camera is idle. Subscribers receive only
+    the keys that changed.
+    """
+
+    def __init__(self, fetch: Callable[[], Optional[dict]], ttl: float = 1.0,
+                 fast_interval: float = 0.25, slow_interval: float = 5.0, backoff: float = 1.5):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.backoff = backoff
+        self.interval = fast_interval
+        self.polls = 0
+        self.last_error: Optional[float] = None
+        self._status: Optional[dict] = None
+        self._fetched_at = 0.0
+        self._subscribers: List[Callable[[Dict[str, dict]], None]] = []
+        self._cond = threading.Condition()
+        self._fetch_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+        self._wake.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+        self._thread = None
+
+    def subscribe(self, callback: Callable[[Dict[str, dict]], None]) -> Callable[[], None]:
+        """Register a diff callback; returns a function that unsubscribes it"""
+        with self._cond:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._cond:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    def boost(self):
+        """Poll fast again, e.g. right after sending a command that changes camera state"""
+        self.interval = self.fast_interval
+        self._wake.set()
+
+    def get(self, max_age: Optional[float] = None) -> Optional[dict]:
+        """Cached status if younger than max_age (default ttl), else a fresh fetch"""
+        max_age = self.ttl if max_age is None else max_age
+        with self._cond:
+            if self._status is not None and time.monotonic() - self._fetched_at <= max_age:
+                return self._status
+        return self.refresh()
+
+    def refresh(self) -> Optional[dict]:
+        return self._refresh()[0]
+
+    def _refresh(self):
+        with self._fetch_lock:
+            status = self.fetch()
+            self.polls += 1
+        if status is None:
+            self.last_error = time.monotonic()
+            return None, False
+
+        with self._cond:
+            diff = status_diff(self._status, status)
+            self._status = status
+            self._fetched_at = time.monotonic()
+            subscribers = list(self._subscribers)
+            self._cond.notify_all()
+
+        if diff:
+            self.interval = self.fast_interval
+            for callback in subscribers:
+                try:
+                    callback(diff)
+                except Exception as e:
+                    print(f"Status subscriber error: {e}")
+        return status, bool(diff)
+
+    def wait_for(self, predicate: Callable[[dict], bool], timeout: float = 10.0) -> bool:
+        """Block until predicate(status) holds, polling fast meanwhile"""
+        deadline = time.monotonic() + timeout
+        self.start()
+        self.boost()
+        with self._cond:
+            while self._status is None or not predicate(self._status):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+                self.interval = self.fast_interval
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+            self._wake.clear()
+            _, changed = self._refresh()
+            if not changed:
+                self.interval = min(self.interval * self.backoff, self.slow_interval)
+            self._wake.wait(self.interval)
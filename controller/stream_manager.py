@@ -0,0 +1,528 @@
+import json
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Deque, Dict, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+import requests
+
+from ffmpeg_supervisor import install_signal_handlers
+from gopro_controller import GoProController
+from metrics import REGISTRY, MetricsServer
+from stream_tee import FileSink, UDPSink
+
+MANAGER_PORT = 9110
+OUTPUTS = ("file", "udp", "recorder", "snapshot")
+CAMERA_PATH = re.compile(r"^/cameras/(?P<ip>[^/]+)(?:/(?P<action>[^/]+)(?:/(?P<name>[^/]+))?)?$")
+
+
+class ManagedCamera:
+    """One camera owned by the manager: its controller, a job queue and a message log.
+
+    Anything that can take seconds (connecting, camera commands, starting the preview,
+    attaching an output, downloading media) runs as a job on the camera's own worker
+    thread, so API calls return at once and jobs on one camera never overlap.
+    """
+
+    def __init__(self, ip: str, preview_host: str = "localhost", stall_ms: int = 1000):
+        self.ip = ip
+        self.preview_host = preview_host
+        self.stall_ms = stall_ms
+        self.controller: Optional[GoProController] = None
+        self.state = "connecting"
+        self.messages: Deque[dict] = deque(maxlen=50)
+        self.jobs: Deque[dict] = deque(maxlen=20)
+        self.download: Optional[dict] = None
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"camera-{ip}")
+        self._lock = threading.Lock()
+
+    def log(self, level: str, message: str):
+        self.messages.append({"time": time.time(), "level": level, "message": message})
+
+    def submit(self, action: str, fn: Callable[[], Optional[bool]]) -> dict:
+        job = {"id": uuid.uuid4().hex[:8], "action": action, "state": "queued", "queued_at": time.time()}
+        with self._lock:
+            self.jobs.append(job)
+        self._worker.submit(self._run_job, job, fn)
+        return dict(job)
+
+    def _run_job(self, job: dict, fn: Callable[[], Optional[bool]]):
+        job["state"] = "running"
+        job["started_at"] = time.time()
+        try:
+            ok = fn()
+        except Exception as e:
+            self.log("error", f"{job['action']} failed: {e}")
+            ok = False
+        job["state"] = "failed" if ok is False else "done"
+        job["finished_at"] = time.time()
+
+    def job(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            return next((dict(job) for job in self.jobs if job["id"] == job_id), None)
+
+    def pending(self, action: str) -> Optional[dict]:
+        """The queued or running job for action, if there is one"""
+        with self._lock:
+            return next((dict(job) for job in self.jobs
+                         if job["action"] == action and job["state"] in ("queued", "running")), None)
+
+    def connect(self) -> bool:
+        controller = GoProController(ip=self.ip, preview_host=self.preview_host, stall_ms=self.stall_ms)
+        if controller.status() is None:
+            controller.close()
+            self.state = "unreachable"
+            self.log("error", "Could not connect to GoPro. Check IP and connection.")
+            return False
+        if self.controller is not None:
+            self.controller.close()
+        self.controller = controller
+        self.state = "connected"
+        self.log("success", "Connected to GoPro successfully!")
+        return True
+
+    def close(self):
+        self._worker.shutdown(wait=False, cancel_futures=True)
+        if self.controller is not None:
+            self.controller.close()
+            self.controller = None
+        self.state = "closed"
+
+    def describe(self) -> dict:
+        controller = self.controller
+        description = {
+            "ip": self.ip,
+            "state": self.state,
+            "messages": list(self.messages),
+            "jobs": [dict(job) for job in self.jobs],
+            "download": self.download,
+        }
+        if controller is not None:
+            snapshot = controller.snapshot()
+            description.update({
+                "stream_active": controller.stream_active,
+                "preview_active": controller.preview_active,
+                "preview_url": controller.preview_url() if self.state == "previewing" else None,
+                "preview": controller.preview_stats(),
+                "sinks": controller.sink_stats(),
+                "startup_timings": controller.startup_timings(),
+                "latency": controller.latency_stats(),
+                "snapshot_age": snapshot.age if snapshot else None,
+                "watchdog": controller.watchdog.stats(),
+            })
+        return description
+
+
+class StreamManager:
+    """Owns every camera's controller, ingest, pipelines and keep-alives in one process.
+
+    Cameras stay up across browser sessions and UI reloads; every viewer of a camera
+    shares its single pipeline and HLS preview.
+    """
+
+    def __init__(self, preview_host: str = "localhost", stall_ms: int = 1000):
+        self.preview_host = preview_host
+        self.stall_ms = stall_ms
+        self.cameras: Dict[str, ManagedCamera] = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def connect(self, ip: str) -> dict:
+        """Start managing a camera (no-op if already connected); connecting runs as a job"""
+        with self._lock:
+            camera = self.cameras.get(ip)
+            if camera is None:
+                camera = self.cameras[ip] = ManagedCamera(ip, self.preview_host, self.stall_ms)
+            elif camera.controller is not None or camera.pending("connect"):
+                return camera.describe()
+            camera.state = "connecting"
+        camera.submit("connect", camera.connect)
+        return camera.describe()
+
+    def disconnect(self, ip: str) -> bool:
+        with self._lock:
+            camera = self.cameras.pop(ip, None)
+        if camera is None:
+            return False
+        camera.close()
+        return True
+
+    def camera(self, ip: str) -> Optional[ManagedCamera]:
+        return self.cameras.get(ip)
+
+    def close(self):
+        for ip in list(self.cameras):
+            self.disconnect(ip)
+
+    def start_preview(self, camera: ManagedCamera, mode: str) -> dict:
+        controller = camera.controller
+        pending = camera.pending("preview")
+        if pending or controller.preview_active:
+            return pending or {"action": "preview", "state": "done"}
+
+        def start():
+            camera.state = "starting preview"
+            ok = controller.start_preview(mode, on_progress=camera.log)
+            camera.state = "previewing" if ok else "connected"
+            return ok
+        return camera.submit("preview", start)
+
+    def stop_preview(self, camera: ManagedCamera) -> dict:
+        def stop():
+            ok = camera.controller.stop_preview()
+            camera.state = "connected"
+            return ok
+        return camera.submit("stop preview", stop)
+
+    def attach_output(self, camera: ManagedCamera, name: str, options: dict) -> dict:
+        controller = camera.controller
+
+        def attach():
+            if name == "file":
+                ok = controller.attach_sink("file", FileSink(options.get("path", "/tmp/goprofeed.ts")))
+            elif name == "udp":
+                ok = controller.attach_sink("udp", UDPSink(options.get("host", "127.0.0.1"),
+                                                           int(options.get("port", 10000))))
+            elif name == "recorder":
+                ok = controller.enable_preroll(options.get("directory", "/tmp/gopro-recordings"),
+                                               preroll_seconds=float(options.get("preroll_seconds", 10)))
+            else:
+                ok = controller.enable_snapshots(int(options.get("width", 320)), float(options.get("interval", 2.0)))
+            camera.log("info" if ok else "error", f"{name} output {'started' if ok else 'failed to start'}")
+            return ok
+        return camera.submit(f"attach {name}", attach)
+
+    def detach_output(self, camera: ManagedCamera, name: str) -> dict:
+        return camera.submit(f"detach {name}", lambda: camera.controller.detach_sink(name) is not None)
+
+    def download_media(self, camera: ManagedCamera, directory: str, concurrency: int) -> dict:
+        pending = camera.pending("download")
+        if pending:
+            return pending
+
+        def download():
+            def progress(p):
+                camera.download = p
+            result = camera.controller.download_media(directory, concurrency, progress)
+            camera.download = result
+            if "error" in result or result["files_failed"]:
+                camera.log("error", result.get("error") or f"Failed to download: {', '.join(result['files_failed'])}")
+                return False
+            camera.log("success", f"Downloaded {result['files_done'] - result['files_skipped']} new files")
+            return True
+        return camera.submit("download", download)
+
+    def describe(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "cameras": {ip: camera.describe() for ip, camera in list(self.cameras.items())},
+        }
+
+
+class _ManagerRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "GoProManager/1.0"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body, content_type: str = "application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+        return body if isinstance(body, dict) else {}
+
+    def _route(self, method: str):
+        manager: StreamManager = self.server.manager
+        path = urlsplit(self.path).path.rstrip("/")
+        body = self._body() if method in ("POST", "PUT") else {}
+        if path == "/cameras" and method == "GET":
+            self._send(200, manager.describe())
+            return
+        if path == "/metrics" and method == "GET":
+            self._send(200, REGISTRY.render().encode("utf-8"), "text/plain; version=0.0.4")
+            return
+        match = CAMERA_PATH.match(path)
+        if not match:
+            self._send(404, {"error": "not found"})
+            return
+        ip, action, name = unquote(match.group("ip")), match.group("action"), match.group("name")
+        if action is None:
+            if method == "POST":
+                self._send(202, manager.connect(ip))
+            elif method == "DELETE":
+                self._send(200 if manager.disconnect(ip) else 404, {})
+            elif manager.camera(ip):
+                self._send(200, manager.camera(ip).describe())
+            else:
+                self._send(404, {"error": "camera not connected"})
+            return
+        camera = manager.camera(ip)
+        if camera is None or camera.controller is None:
+            self._send(409, {"error": "camera not connected"})
+            return
+        if action == "snapshot.jpg" and method == "GET":
+            snapshot = camera.controller.snapshot()
+            if snapshot is None:
+                self._send(404, {"error": "no snapshot"})
+            else:
+                self._send(200, snapshot.jpeg, "image/jpeg")
+            return
+        status, result = self._camera_action(manager, camera, method, action, name, body)
+        self._send(status, result)
+
+    def _camera_action(self, manager: StreamManager, camera: ManagedCamera, method: str, action: str,
+                       name: Optional[str], body: dict) -> Tuple[int, dict]:
+        controller = camera.controller
+        if action == "preview":
+            if method == "POST":
+                return 202, manager.start_preview(camera, body.get("mode", "passthrough"))
+            if method == "DELETE":
+                return 202, manager.stop_preview(camera)
+        if action == "outputs" and name in OUTPUTS:
+            if method == "PUT":
+                return 202, manager.attach_output(camera, name, body)
+            if method == "DELETE":
+                return 202, manager.detach_output(camera, name)
+        if action == "media" and method == "POST":
+            return 202, manager.download_media(camera, body.get("directory", "gopro-media"),
+                                               int(body.get("concurrency", 4)))
+        # Camera commands wait on the camera's own timeouts and retries, so they are jobs too
+        if action == "mode" and method == "POST":
+            mode = body.get("mode", "")
+            return 202, camera.submit("mode", lambda: controller.set_mode(mode))
+        if action == "video_settings" and method == "POST":
+            def apply():
+                ok = controller.set_video_settings(body.get("resolution", ""), body.get("fps", ""),
+                                                   body.get("fov", ""))
+                for error in controller.settings_errors:
+                    camera.log("error", error)
+                return ok
+            return 202, camera.submit("video settings", apply)
+        if action == "recording" and method == "POST":
+            return 202, camera.submit("start recording", controller.start_recording)
+        if action == "recording" and method == "DELETE":
+            return 202, camera.submit("stop recording", controller.stop_recording)
+        if action == "photo" and method == "POST":
+            return 202, camera.submit("photo", controller.take_photo)
+        if action == "jobs" and name and method == "GET":
+            job = camera.job(name)
+            return (200, job) if job is not None else (404, {"error": "no such job"})
+        if action == "status" and method == "GET":
+            status = controller.status(max_age=2.0)
+            return (200, status) if status is not None else (502, {"error": "camera not responding"})
+        return 404, {"error": "not found"}
+
+    def _dispatch(self, method: str):
+        try:
+            self._route(method)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+class ManagerServer:
+    """Local HTTP/JSON API of a StreamManager"""
+
+    def __init__(self, manager: StreamManager, host: str = "127.0.0.1", port: int = MANAGER_PORT):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.httpd: Optional[ThreadingHTTPServer] = None
+
+    def start(self) -> bool:
+        if self.httpd:
+            return True
+        try:
+            httpd = ThreadingHTTPServer((self.host, self.port), _ManagerRequestHandler)
+        except OSError as e:
+            print(f"Error starting stream manager API: {e}")
+            return False
+        httpd.daemon_threads = True
+        httpd.manager = self.manager
+        self.httpd = httpd
+        self.port = httpd.server_address[1]
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return True
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+
+class ManagerClient:
+    """Thin client for the stream manager API, for the Streamlit UI and scripts.
+
+    Every call returns quickly: long operations come back as queued jobs whose
+    progress shows up in camera(ip). Errors are printed and return None.
+    """
+
+    def __init__(self, url: str = f"http://127.0.0.1:{MANAGER_PORT}", timeout: float = 3.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _request(self, method: str, path: str, body: Optional[dict] = None,
+                 timeout: Optional[float] = None) -> Optional[requests.Response]:
+        try:
+            return self.session.request(method, f"{self.url}{path}", json=body, timeout=timeout or self.timeout)
+        except requests.exceptions.RequestException as e:
+            print(f"Stream manager request {method} {path} failed: {e}")
+            return None
+
+    def _json(self, method: str, path: str, body: Optional[dict] = None,
+              timeout: Optional[float] = None) -> Optional[dict]:
+        response = self._request(method, path, body, timeout)
+        if response is None or response.status_code >= 400 and response.status_code != 502:
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            return None
+
+    def available(self) -> bool:
+        try:
+            return self.session.get(f"{self.url}/cameras", timeout=0.5).ok
+        except requests.exceptions.RequestException:
+            return False
+
+    def cameras(self) -> Optional[dict]:
+        return self._json("GET", "/cameras")
+
+    def connect(self, ip: str) -> Optional[dict]:
+        return self._json("POST", f"/cameras/{ip}")
+
+    def disconnect(self, ip: str) -> bool:
+        response = self._request("DELETE", f"/cameras/{ip}")
+        return response is not None and response.ok
+
+    def camera(self, ip: str) -> Optional[dict]:
+        return self._json("GET", f"/cameras/{ip}")
+
+    def start_preview(self, ip: str, mode: str = "passthrough") -> Optional[dict]:
+        return self._json("POST", f"/cameras/{ip}/preview", {"mode": mode})
+
+    def stop_preview(self, ip: str) -> Optional[dict]:
+        return self._json("DELETE", f"/cameras/{ip}/preview")
+
+    def attach_output(self, ip: str, name: str, **options) -> Optional[dict]:
+        return self._json("PUT", f"/cameras/{ip}/outputs/{name}", options)
+
+    def detach_output(self, ip: str, name: str) -> Optional[dict]:
+        return self._json("DELETE", f"/cameras/{ip}/outputs/{name}")
+
+    def download_media(self, ip: str, directory: str, concurrency: int = 4) -> Optional[dict]:
+        return self._json("POST", f"/cameras/{ip}/media", {"directory": directory, "concurrency": concurrency})
+
+    def job(self, ip: str, job_id: str) -> Optional[dict]:
+        return self._json("GET", f"/cameras/{ip}/jobs/{job_id}")
+
+    def wait(self, ip: str, job: Optional[dict], timeout: float = 30.0, interval: float = 0.2) -> bool:
+        """Poll a job until it finishes; True if it succeeded"""
+        if job is None:
+            return False
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            state = (self.job(ip, job["id"]) or {}).get("state")
+            if state in ("done", "failed", None):
+                return state == "done"
+            time.sleep(interval)
+        return False
+
+    def set_mode(self, ip: str, mode: str) -> Optional[dict]:
+        return self._json("POST", f"/cameras/{ip}/mode", {"mode": mode})
+
+    def set_video_settings(self, ip: str, resolution: str, fps: str, fov: str) -> Optional[dict]:
+        return self._json("POST", f"/cameras/{ip}/video_settings", {"resolution": resolution, "fps": fps, "fov": fov})
+
+    def start_recording(self, ip: str) -> Optional[dict]:
+        return self._json("POST", f"/cameras/{ip}/recording")
+
+    def stop_recording(self, ip: str) -> Optional[dict]:
+        return self._json("DELETE", f"/cameras/{ip}/recording")
+
+    def take_photo(self, ip: str) -> Optional[dict]:
+        return self._json("POST", f"/cameras/{ip}/photo")
+
+    def snapshot(self, ip: str) -> Optional[bytes]:
+        response = self._request("GET", f"/cameras/{ip}/snapshot.jpg")
+        return response.content if response is not None and response.ok else None
+
+    def close(self):
+        self.session.close()
+
+
+def run(host: str = "127.0.0.1", port: int = MANAGER_PORT, preview_host: str = "localhost",
+        metrics_port: Optional[int] = 9108, stall_ms: int = 1000):
+    """Serve the manager API until interrupted"""
+    manager = StreamManager(preview_host, stall_ms)
+    server = ManagerServer(manager, host, port)
+    if not server.start():
+        return False
+    metrics = MetricsServer(port=metrics_port) if metrics_port else None
+    if metrics:
+        metrics.start()
+    print(f"Stream manager listening on {server.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        if metrics:
+            metrics.stop()
+        manager.close()
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the GoPro stream manager daemon")
+    parser.add_argument("--host", default="127.0.0.1", help="address of the manager API")
+    parser.add_argument("--port", type=int, default=MANAGER_PORT)
+    parser.add_argument("--preview-host", default="localhost", help="host name viewers use for preview URLs")
+    parser.add_argument("--metrics-port", type=int, default=9108, help="Prometheus port (0 to disable)")
+    parser.add_argument("--stall-ms", type=int, default=1000,
+                        help="recover a camera stream after this long without packets")
+    args = parser.parse_args()
+    install_signal_handlers()
+    if not run(args.host, args.port, args.preview_host, args.metrics_port, args.stall_ms):
+        raise SystemExit(1)
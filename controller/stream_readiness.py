@@ -0,0 +1,162 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from ts_ingest import FLAG_KEYFRAME, FLAG_PSI, UDPIngest
+
+# Startup phases, in the order a healthy stream reaches them
+PHASES = ("command", "ack", "first_packet", "psi", "keyframe", "ready")
+
+
+class StreamReadiness:
+    """Tracks live-stream startup from real signals instead of fixed sleeps.
+
+    Phases: the restart command is sent ("command") and acknowledged ("ack"), the
+    first UDP datagram arrives ("first_packet"), PAT/PMT are parsed ("psi"), the first
+    keyframe follows ("keyframe"), and the output stage produces something playable
+    ("ready"). Each phase is timestamped relative to begin().
+    """
+
+    def __init__(self, ingest: Optional[UDPIngest] = None):
+        self.ingest: Optional[UDPIngest] = None
+        self.started_at: Optional[float] = None
+        self.reached: Dict[str, float] = {}
+        self._baseline_seq = 0
+        self._cond = threading.Condition()
+        if ingest is not None:
+            self.attach(ingest)
+
+    def attach(self, ingest: UDPIngest):
+        if self.ingest is not None:
+            self.ingest.remove_listener(self._on_datagram)
+        self.ingest = ingest
+        ingest.add_listener(self._on_datagram)
+
+    def detach(self):
+        if self.ingest is not None:
+            self.ingest.remove_listener(self._on_datagram)
+            self.ingest = None
+
+    def begin(self):
+        """Start a new startup attempt; only datagrams received from now on count"""
+        with self._cond:
+            self.started_at = time.monotonic()
+            self.reached = {}
+            self._baseline_seq = self.ingest.write_seq if self.ingest else 0
+            self._cond.notify_all()
+
+    def mark(self, phase: str, at: Optional[float] = None):
+        with self._cond:
+            if self.started_at is None or phase in self.reached:
+                return
+            self.reached[phase] = (at if at is not None else time.monotonic()) - self.started_at
+            self._cond.notify_all()
+
+    def _on_datagram(self, seq: int, flags: int):
+        if self.started_at is None or seq < self._baseline_seq:
+            return
+        arrival = self.ingest.arrivals[seq % self.ingest.slots]
+        if flags & FLAG_PSI and self.ingest.indexer.video_pid is not None:
+            self.mark("psi", arrival)
+        if flags & FLAG_KEYFRAME and "psi" in self.reached:
+            self.mark("keyframe", arrival)
+
+    def wait(self, phase: str, timeout: float) -> bool:
+        """Block until phase is reached; first_packet is read straight off the ingest"""
+        if phase == "first_packet" and self.ingest is not None:
+            if self.ingest.wait(self._baseline_seq, timeout) and self.ingest.write_seq > self._baseline_seq:
+                self.mark("first_packet", self.ingest.arrivals[self._baseline_seq % self.ingest.slots])
+        with self._cond:
+            return self._cond.wait_for(lambda: phase in self.reached, timeout)
+
+    @property
+    def state(self) -> str:
+        with self._cond:
+            if self.started_at is None:
+                return "idle"
+            reached = [p for p in PHASES if p in self.reached]
+            return reached[-1] if reached else "starting"
+
+    def timings(self) -> Dict[str, float]:
+        """Seconds from begin() to each phase reached so far"""
+        with self._cond:
+            return {p: self.reached[p] for p in PHASES if p in self.reached}
+
+
+def wait_until_quiet(ingest: Optional[UDPIngest], quiet: float = 0.2, timeout: float = 2.0) -> bool:
+    """Wait until no datagrams have arrived for `quiet` seconds, i.e. the old stream stopped"""
+    if ingest is None or ingest.last_packet_at is None:
+        return True
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if time.monotonic() - ingest.last_packet_at >= quiet:
+            return True
+        time.sleep(quiet / 4)
+    return False
+
+
+def benchmark(ip: str = "10.5.5.9", http_port: int = 80, udp_port: int = 8554, runs: int = 5,
+              timeout: float = 10.0) -> dict:
+    """Time-to-first-frame for cold starts (fresh ingest) and restarts (ingest kept running)"""
+    import gopro_commands
+    from command_client import CommandClient
+    from keepalive import KeepAliveScheduler
+
+    client = CommandClient(f"http://{ip}:{http_port}" if http_port != 80 else f"http://{ip}")
+    keep_alive = KeepAliveScheduler()
+    results = {"cold_start": [], "restart": []}
+
+    def start(ingest: UDPIngest, readiness: StreamReadiness) -> Dict[str, float]:
+        client.get(gopro_commands.STREAM_STOP)
+        wait_until_quiet(ingest)
+        readiness.begin()
+        readiness.mark("command")
+        if client.get(gopro_commands.STREAM_RESTART) is None:
+            return {}
+        readiness.mark("ack")
+        readiness.wait("first_packet", timeout)
+        if readiness.wait("keyframe", timeout):
+            readiness.mark("ready")
+        return readiness.timings()
+
+    keep_alive.add(ip, udp_port)
+    try:
+        for _ in range(runs):
+            ingest = UDPIngest(port=udp_port)
+            if not ingest.start():
+                break
+            readiness = StreamReadiness(ingest)
+            results["cold_start"].append(start(ingest, readiness))
+            results["restart"].append(start(ingest, readiness))
+            ingest.stop()
+    finally:
+        client.get(gopro_commands.STREAM_STOP)
+        keep_alive.stop()
+        client.close()
+
+    summary = {}
+    for kind, runs_timings in results.items():
+        summary[kind] = {}
+        for phase in PHASES:
+            values = sorted(t[phase] for t in runs_timings if phase in t)
+            if values:
+                summary[kind][phase] = {
+                    "min": values[0],
+                    "median": values[len(values) // 2],
+                    "max": values[-1],
+                    "runs": len(values),
+                }
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Benchmark time-to-first-frame of the camera live stream")
+    parser.add_argument("--ip", default="10.5.5.9")
+    parser.add_argument("--http-port", type=int, default=80)
+    parser.add_argument("--udp-port", type=int, default=8554)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.ip, args.http_port, args.udp_port, args.runs), indent=2))
@@ -0,0 +1,251 @@
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from jitter_buffer import JitterBuffer
+from metrics import STAGE_BUCKETS, LatencyHistogram
+from ts_ingest import UDPIngest
+
+
+class Sink:
+    """A consumer of one camera's ingest ring.
+
+    Every sink reads the shared ring through its own cursor on its own thread and
+    receives views into the ring rather than copies. A sink that can't keep up only
+    overruns its own cursor (counted in stats) and never holds up the others.
+
+    Sinks that decode or segment set jitter_buffer so they read through a JitterBuffer
+    and only ever see datagrams in continuity order, resuming at a keyframe after loss.
+    """
+
+    kind = "sink"
+    jitter_buffer = False
+    # Decoding sinks record when they last produced output, so a hung decoder can be spotted
+    last_output_at: Optional[float] = None
+
+    def __init__(self, ingest: Optional[UDPIngest] = None):
+        self.ingest = ingest
+        self.datagrams = 0
+        self.bytes = 0
+        self.error: Optional[str] = None
+        # Datagram arrival -> handled by this sink, sampled once per read batch
+        self.lag = LatencyHistogram(STAGE_BUCKETS)
+        self._reader = None
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> bool:
+        if self._running:
+            return True
+        if self.ingest is None:
+            raise ValueError("sink is not attached to an ingest")
+        self.error = None
+        if self.open() is False:
+            return False
+        self._reader = JitterBuffer(self.ingest) if self.jitter_buffer else self.ingest.reader()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._running = False
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        self._thread = None
+        self.close()
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def restart(self) -> bool:
+        """Reopen the sink's resources (e.g. a hung decoder) without detaching it"""
+        self.stop()
+        return self.start()
+
+    def open(self) -> Optional[bool]:
+        """Acquire resources before the first datagram; return False to abort start()"""
+
+    def close(self):
+        """Release resources after the sink thread has stopped"""
+
+    def write(self, seq: int, view: memoryview, flags: int, arrival: float):
+        raise NotImplementedError
+
+    def idle(self):
+        """Called after every read batch, including empty ones"""
+
+    def _fail(self, message: str):
+        self.error = message
+        self._running = False
+        print(f"{self.kind} sink stopped: {message}")
+
+    def _run(self):
+        while self._running:
+            items = self._reader.read(timeout=0.5)
+            for seq, view, flags, arrival in items:
+                self.write(seq, view, flags, arrival)
+                self.datagrams += 1
+                self.bytes += len(view)
+                if not self._running:
+                    return
+            if items:
+                self.lag.observe(time.monotonic() - items[-1][3])
+            self.idle()
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "running": self.running,
+            "datagrams": self.datagrams,
+            "bytes": self.bytes,
+            "overruns": self._reader.overruns if self._reader else 0,
+            "dropped_datagrams": self._reader.skipped if self._reader else 0,
+            "lag_p95": self.lag.percentile(95),
+            "jitter_buffer": self._reader.stats() if isinstance(self._reader, JitterBuffer) else None,
+            "error": self.error,
+        }
+
+
+class FileSink(Sink):
+    """Appends the raw MPEG-TS to a local file"""
+
+    kind = "file"
+
+    def __init__(self, path: str, ingest: Optional[UDPIngest] = None, buffer_size: int = 1024 * 1024):
+        super().__init__(ingest)
+        self.path = path
+        self.buffer_size = buffer_size
+        self._file = None
+
+    def open(self):
+        try:
+            self._file = open(self.path, "ab", buffering=self.buffer_size)
+        except OSError as e:
+            self._fail(str(e))
+            return False
+
+    def write(self, seq, view, flags, arrival):
+        try:
+            self._file.write(view)
+        except OSError as e:
+            self._fail(str(e))
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class UDPSink(Sink):
+    """Restreams the datagrams unchanged to a local or multicast UDP address"""
+
+    kind = "udp"
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 10000, ingest: Optional[UDPIngest] = None,
+                 ttl: int = 1):
+        super().__init__(ingest)
+        self.host = host
+        self.port = port
+        self.ttl = ttl
+        self.send_errors = 0
+        self._sock: Optional[socket.socket] = None
+
+    def open(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        first_octet = int(self.host.split(".")[0]) if self.host[0].isdigit() else 0
+        if 224 <= first_octet <= 239:
+            self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, struct.pack("b", self.ttl))
+
+    def write(self, seq, view, flags, arrival):
+        try:
+            self._sock.sendto(view, (self.host, self.port))
+        except OSError:
+            self.send_errors += 1
+
+    def close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["send_errors"] = self.send_errors
+        return stats
+
+
+class CallbackSink(Sink):
+    """Hands every datagram view to a callback, e.g. an analytics frame tap.
+
+    The view is only valid during the call; copy it to keep it.
+    """
+
+    kind = "callback"
+    jitter_buffer = True
+
+    def __init__(self, callback: Callable[[memoryview, int, float], None], ingest: Optional[UDPIngest] = None):
+        super().__init__(ingest)
+        self.callback = callback
+
+    def write(self, seq, view, flags, arrival):
+        try:
+            self.callback(view, flags, arrival)
+        except Exception as e:
+            self._fail(str(e))
+
+
+class StreamTee:
+    """One ingest per camera fanned out to any number of named sinks"""
+
+    def __init__(self, ingest: UDPIngest):
+        self.ingest = ingest
+        self.sinks: Dict[str, Sink] = {}
+        self._lock = threading.Lock()
+        # Held across a sink's stop/start, so a detach never races a restart of the same sink
+        self._lifecycle = threading.Lock()
+
+    def attach(self, name: str, sink: Sink) -> bool:
+        """Start sink on this ingest under name, replacing any sink already using it"""
+        self.detach(name)
+        sink.ingest = self.ingest
+        if not sink.start():
+            return False
+        with self._lock:
+            self.sinks[name] = sink
+        return True
+
+    def detach(self, name: str) -> Optional[Sink]:
+        with self._lifecycle:
+            with self._lock:
+                sink = self.sinks.pop(name, None)
+            if sink:
+                sink.stop()
+        return sink
+
+    def get(self, name: str) -> Optional[Sink]:
+        with self._lock:
+            return self.sinks.get(name)
+
+    def restart(self, name: str) -> bool:
+        """Stop and start a sink in place; it stays attached under name throughout.
+
+        A sink detached before the restart begins is left stopped; one detached while it
+        restarts is stopped by the detach once the restart is done.
+        """
+        with self._lifecycle:
+            sink = self.get(name)
+            return sink.restart() if sink else False
+
+    def stop(self):
+        with self._lock:
+            names = list(self.sinks)
+        for name in names:
+            self.detach(name)
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            sinks = list(self.sinks.items())
+        return {name: sink.stats() for name, sink in sinks}
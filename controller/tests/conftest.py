@@ -0,0 +1,140 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import pytest
+
+# The controller modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ts_ingest import UDPIngest, synthetic_datagrams  # noqa: E402
+
+
+class _CameraHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        # Like the camera, drop keep-alive connections left idle for idle_timeout
+        self.timeout = self.server.camera.idle_timeout
+        super().setup()
+
+    def do_GET(self):
+        camera = self.server.camera
+        with camera.lock:
+            camera.requests.append(self.path)
+            camera.connections.add(self.client_address)
+        if camera.delay:
+            time.sleep(camera.delay)
+        status = 404 if "missing" in self.path else 200
+        body = json.dumps(camera.status if "status" in self.path else {}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if camera.close:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class HTTPCamera:
+    """Minimal gpControl stand-in: answers GETs with JSON, 404s any path containing "missing"""
+
+    def __init__(self, host: str = "127.0.0.1", delay: float = 0.0, close: bool = False,
+                 idle_timeout: Optional[float] = None):
+        self.delay = delay
+        self.close = close
+        self.idle_timeout = idle_timeout
+        self.status = {"status": {"8": 0}, "settings": {}}
+        self.requests = []
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, 0), _CameraHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.camera = self
+        self.host, self.port = self.httpd.server_address
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def http_camera():
+    """Factory for HTTPCamera servers; all are stopped after the test"""
+    started = []
+
+    def start(**options):
+        camera = HTTPCamera(**options)
+        started.append(camera)
+        return camera
+
+    yield start
+    for camera in started:
+        camera.stop()
+
+
+def wait_until(predicate, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def feed(ingest: UDPIngest, datagrams, timeout: float = 2.0):
+    """Send datagrams to a running ingest one at a time, in order, and wait until each lands"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for datagram in datagrams:
+            seq = ingest.write_seq
+            sock.sendto(datagram, ("127.0.0.1", ingest.port))
+            assert ingest.wait(seq, timeout), "ingest did not receive a datagram"
+    finally:
+        sock.close()
+
+
+def gops(count: int, gop: int = 30, datagrams_per_frame: int = 8):
+    """Whole GOPs of the synthetic stream (PAT/PMT and an IDR at the start of each)"""
+    return list(synthetic_datagrams(count * gop * datagrams_per_frame, gop=gop,
+                                    datagrams_per_frame=datagrams_per_frame))
+
+
+@pytest.fixture
+def ingest():
+    ingest = UDPIngest(port=0, host="127.0.0.1", slots=4096)
+    assert ingest.start()
+    yield ingest
+    ingest.stop()
+
+
+@pytest.fixture
+def simulator():
+    """Factory for a CameraSimulator on free loopback ports; all are stopped after the test"""
+    from camera_simulator import CameraSimulator
+
+    started = []
+
+    def start(**options):
+        camera = CameraSimulator(**{"host": "127.0.0.1", "http_port": 0, "stream_port": 0, **options})
+        assert camera.start()
+        started.append(camera)
+        return camera
+
+    yield start
+    for camera in started:
+        camera.stop()
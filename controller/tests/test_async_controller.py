@@ -0,0 +1,75 @@
+import asyncio
+import socket
+
+from async_controller import AsyncGoProController, CameraFleet, FleetResult
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def closed_port() -> int:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_commands_share_one_keep_alive_connection(http_camera):
+    camera = http_camera()
+
+    async def session():
+        controller = AsyncGoProController(camera.host, camera.port)
+        try:
+            assert await controller.connect()
+            status = await controller.status()
+            assert await controller.set_video_settings("1080p", "60fps", "Wide")
+            assert not await controller.set_video_settings("8K", "60fps", "Wide")
+            assert await controller.send_command("gp/gpControl/missing") is None
+            return status, controller.latency_stats()
+        finally:
+            await controller.close()
+
+    status, stats = run(session())
+    assert status == camera.status
+    assert camera.requests[1:4] == ["/gp/gpControl/setting/2/9", "/gp/gpControl/setting/3/6",
+                                    "/gp/gpControl/setting/4/0"]
+    assert stats["gp/gpControl/setting"]["count"] == 3
+    # A 404 is not retried
+    assert stats["gp/gpControl/missing"]["errors"] == 1
+    assert camera.requests.count("/gp/gpControl/missing") == 1
+
+
+def test_fan_out_reports_skew_and_partial_failure(http_camera):
+    # Each camera needs its own address, since the fleet is keyed by IP
+    fast = http_camera(host="127.0.0.2")
+    slow = http_camera(host="127.0.0.3", delay=0.2)
+    cameras = [AsyncGoProController(fast.host, fast.port),
+               AsyncGoProController(slow.host, slow.port),
+               AsyncGoProController("127.0.0.4", closed_port(), connect_timeout=0.5, retries=0)]
+
+    async def session():
+        fleet = CameraFleet(cameras)
+        try:
+            connected = await fleet.connect()
+            return connected, await fleet.start_recording()
+        finally:
+            await fleet.close()
+
+    connected, result = run(session())
+    assert connected == {"127.0.0.2": True, "127.0.0.3": True, "127.0.0.4": False}
+    assert not result.ok
+    assert result.failed == ["127.0.0.4"]
+    assert fast.requests == slow.requests == ["/gp/gpControl/command/shutter?p=1"]
+    # The slow camera acks about 0.2 s later, so it is estimated to act about 0.1 s later
+    assert 0.05 < result.skew < 0.2
+    assert result.duration >= 0.2
+
+
+def test_fleet_result_properties():
+    result = FleetResult({"a": True, "b": False}, {"a": 1.0, "b": 1.0}, {"a": 1.5})
+    assert result.failed == ["b"] and not result.ok
+    assert result.skew == 0.0
+    assert result.duration == 0.5
+    assert FleetResult({}, {}, {}).skew is None
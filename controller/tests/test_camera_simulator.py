@@ -0,0 +1,62 @@
+import time
+
+import gopro_commands
+from command_client import CommandClient
+from conftest import wait_until
+from keepalive import KeepAliveScheduler
+from ts_ingest import FLAG_KEYFRAME
+
+
+def test_commands_change_the_reported_status(simulator):
+    camera = simulator()
+    client = CommandClient(camera.base_url, retries=0)
+    try:
+        assert client.get(gopro_commands.SHUTTER_ON) is not None
+        assert client.get(gopro_commands.mode_command("photo")) is not None
+        for command in gopro_commands.video_settings_commands("720p", "60fps", "Narrow"):
+            assert client.get(command) is not None
+        status = client.get(gopro_commands.STATUS).json()
+        assert status["status"]["8"] == 1 and status["status"]["43"] == 1
+        assert status["settings"] == {"2": 12, "3": 6, "4": 2}
+        assert client.get("gp/gpControl/command/unknown") is None
+        assert camera.stats()["requests"] == 7
+    finally:
+        client.close()
+
+
+def test_streams_to_the_client_while_keep_alives_arrive(simulator, ingest):
+    # On its own loopback address the simulator can take the ingest's port for keep-alives
+    camera = simulator(host="127.0.0.2", stream_port=ingest.port, mbps=1.0, fps=50.0, gop=10,
+                       startup_delay=0.0, keep_alive_timeout=0.3)
+    client = CommandClient(camera.base_url, retries=0)
+    keep_alive = KeepAliveScheduler()
+    keep_alive.add(camera.host, ingest.port, period=0.05)
+    reader = ingest.reader(from_latest=False)
+    try:
+        assert client.get(gopro_commands.STREAM_RESTART) is not None
+        assert wait_until(lambda: ingest.indexer.keyframes >= 3)
+        first = reader.read(timeout=0)[0]
+        assert first[2] & FLAG_KEYFRAME
+        assert camera.streaming and camera.keep_alives > 0
+        assert ingest.indexer.cc_errors == 0
+        # Without keep-alives the stream stops on its own, like the camera's
+        keep_alive.stop()
+        assert wait_until(lambda: not camera.streaming)
+        sent = camera.datagrams_sent
+        time.sleep(0.1)
+        assert camera.datagrams_sent == sent
+    finally:
+        keep_alive.stop()
+        client.close()
+
+
+def test_loss_drops_datagrams(simulator, ingest):
+    camera = simulator(host="127.0.0.2", stream_port=ingest.port, mbps=2.0, fps=50.0, loss=0.2, seed=1,
+                       startup_delay=0.0, keep_alive_timeout=None)
+    camera.start_stream(("127.0.0.1", ingest.port))
+    try:
+        assert wait_until(lambda: camera.datagrams_dropped >= 10)
+    finally:
+        camera.stop_stream()
+    assert wait_until(lambda: ingest.datagrams == camera.datagrams_sent)
+    assert ingest.indexer.cc_errors > 0
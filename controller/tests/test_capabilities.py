@@ -0,0 +1,62 @@
+import pytest
+
+from camera_simulator import SCHEMA
+from capabilities import CapabilitySchema, SchemaCache, current_settings
+from command_client import CommandClient
+
+RESOLUTION, FPS, FOV = 2, 3, 4
+
+
+@pytest.fixture
+def schema():
+    return CapabilitySchema(SCHEMA)
+
+
+def test_resolve_names_and_display_values(schema):
+    assert schema.resolve({"resolution": "1080", "Frames Per Second": "60"}, "video") == ({RESOLUTION: 9, FPS: 6}, [])
+    settings, errors = schema.resolve({"resolution": "8K", "iso": "100"}, "video")
+    assert settings == {}
+    assert len(errors) == 2 and "no option '8K'" in errors[0] and "no setting 'iso'" in errors[1]
+
+
+def test_validate_reports_the_blocking_setting(schema):
+    assert schema.validate({RESOLUTION: 1, FPS: 6, FOV: 0}) == ["Frames Per Second=60 is not available with Resolution=4K"]
+    assert schema.validate({RESOLUTION: 9, FPS: 6, FOV: 0}) == []
+
+
+def test_stale_current_value_does_not_block_an_unrelated_change(schema):
+    # 120 fps at 1080 is ruled out by the filters, but the camera reports it anyway
+    current = {RESOLUTION: 9, FPS: 1, FOV: 0}
+    changes = {FOV: 1}
+    assert schema.validate({**current, **changes})
+    assert schema.validate({**current, **changes}, changes) == []
+    # A change that itself conflicts is still caught
+    assert schema.validate({**current, FOV: 4}, {FOV: 4}) == \
+        ["Field of View=Linear is not available with Frames Per Second=120"]
+
+
+def test_plan_sends_parents_first_and_skips_unchanged(schema):
+    current = {RESOLUTION: 9, FPS: 6, FOV: 0}
+    assert schema.plan({FPS: 5, RESOLUTION: 12}, current) == [(RESOLUTION, 12), (FPS, 5)]
+    assert schema.plan({RESOLUTION: 9, FPS: 6}, current) == []
+    # fps is already 60, but it is re-sent after the resolution change the camera may adjust it for
+    assert schema.plan({RESOLUTION: 12, FPS: 6}, current) == [(RESOLUTION, 12), (FPS, 6)]
+
+
+def test_current_settings():
+    assert current_settings({"settings": {"2": 9, "3": "5", "x": 1}}) == {RESOLUTION: 9, FPS: 5}
+    assert current_settings(None) == {}
+
+
+def test_schema_cache_fetches_the_schema_once_per_firmware(simulator, tmp_path):
+    camera = simulator()
+    client = CommandClient(camera.base_url)
+    cache = SchemaCache(str(tmp_path))
+    try:
+        first = cache.fetch(client)
+        second = cache.fetch(client)
+    finally:
+        client.close()
+    assert (cache.misses, cache.hits) == (1, 1)
+    assert first.key == second.key and first.settings == second.settings
+    assert first.firmware == "HD5.03.02.51.00"
@@ -0,0 +1,93 @@
+import time
+
+from command_client import CommandClient, endpoint_key
+
+SETTINGS = ["gp/gpControl/setting/2/9", "gp/gpControl/setting/3/5", "gp/gpControl/setting/4/0"]
+
+
+def test_endpoint_key():
+    assert endpoint_key("gp/gpControl/setting/2/9") == "gp/gpControl/setting"
+    assert endpoint_key("/gp/gpControl/command/shutter?p=1") == "gp/gpControl/command/shutter"
+
+
+def test_get_records_latency_and_errors(http_camera):
+    camera = http_camera()
+    client = CommandClient(camera.base_url, retries=0)
+    try:
+        assert client.get("gp/gpControl/status").json() == camera.status
+        assert client.get("gp/gpControl/missing") is None
+        stats = client.latency_stats()
+        assert stats["gp/gpControl/status"]["count"] == 1
+        assert stats["gp/gpControl/status"]["errors"] == 0
+        assert stats["gp/gpControl/missing"]["count"] == 0
+        assert stats["gp/gpControl/missing"]["errors"] == 1
+    finally:
+        client.close()
+
+
+def test_pipeline_sends_in_order_and_reads_every_response(http_camera):
+    camera = http_camera()
+    client = CommandClient(camera.base_url, retries=0)
+    commands = SETTINGS[:2] + ["gp/gpControl/missing/1"] + SETTINGS[2:]
+    try:
+        assert client.pipeline(commands) == [True, True, False, True]
+        assert camera.requests == ["/" + c for c in commands]
+        stats = client.latency_stats()
+        assert stats["gp/gpControl/setting"]["count"] == 3
+        assert stats["gp/gpControl/missing"]["errors"] == 1
+        assert "pipeline" not in stats
+    finally:
+        client.close()
+
+
+def test_pipeline_keeps_its_connection_between_batches(http_camera):
+    camera = http_camera()
+    client = CommandClient(camera.base_url, retries=0)
+    try:
+        assert client.pipeline(SETTINGS) == [True, True, True]
+        assert client.pipeline(SETTINGS) == [True, True, True]
+        assert len(camera.connections) == 1
+    finally:
+        client.close()
+
+
+def test_pipeline_reopens_a_connection_the_camera_closed_while_idle(http_camera):
+    camera = http_camera(idle_timeout=0.1)
+    client = CommandClient(camera.base_url, retries=0)
+    try:
+        assert client.pipeline(SETTINGS) == [True, True, True]
+        time.sleep(0.3)
+        assert client.pipeline(SETTINGS) == [True, True, True]
+        assert client.pipeline(SETTINGS) == [True, True, True]
+        # Every batch went out whole and once; the last two shared the reopened connection
+        assert camera.requests == ["/" + c for c in SETTINGS] * 3
+        assert len(camera.connections) == 2
+        assert "pipeline" not in client.latency_stats()
+    finally:
+        client.close()
+
+
+def test_pipeline_replays_what_a_closed_connection_left_unanswered(http_camera):
+    # The camera answers one request per connection, like firmware without pipelining
+    camera = http_camera(close=True)
+    client = CommandClient(camera.base_url, retries=0)
+    try:
+        assert client.pipeline(SETTINGS) == [True, True, True]
+        # Each command reached the camera exactly once, still in order
+        assert camera.requests == ["/" + c for c in SETTINGS]
+        assert client.latency_stats()["gp/gpControl/setting"]["count"] == 3
+    finally:
+        client.close()
+
+
+def test_pipeline_falls_back_to_single_requests_when_unreachable(http_camera):
+    camera = http_camera()
+    camera.stop()
+    client = CommandClient(camera.base_url, connect_timeout=0.5, retries=0)
+    try:
+        assert client.pipeline(SETTINGS[:2]) == [False, False]
+        stats = client.latency_stats()
+        assert stats["pipeline"]["errors"] == 1
+        assert stats["gp/gpControl/setting"]["errors"] == 2
+    finally:
+        client.close()
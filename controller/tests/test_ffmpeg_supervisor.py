@@ -0,0 +1,69 @@
+import sys
+
+import ffmpeg_supervisor
+from conftest import wait_until
+from ffmpeg_supervisor import FFmpegProcess, FFmpegProgress
+
+BLOCK = """frame=120
+fps=29.97
+bitrate=4012.3kbits/s
+total_size=2015232
+out_time_us=4000000
+dup_frames=1
+drop_frames=2
+speed=0.98x
+"""
+
+
+def test_progress_blocks_are_parsed():
+    progress = FFmpegProgress()
+    assert not any(progress.feed(line) for line in BLOCK.splitlines())
+    assert progress.feed("progress=continue")
+    stats = progress.stats()
+    assert (stats["frame"], stats["fps"], stats["bitrate_kbps"]) == (120, 29.97, 4012.3)
+    assert (stats["out_time"], stats["speed"], stats["dup_frames"], stats["drop_frames"]) == (4.0, 0.98, 1, 2)
+    assert stats["encode_lag"] == 0.0
+    assert not progress.ended
+    # N/A values while ffmpeg is starting up don't lose what is already known
+    for line in ("frame=N/A", "fps=N/A", "speed=N/A", "out_time_us=N/A", "progress=end"):
+        progress.feed(line)
+    assert progress.frame == 120 and progress.fps is None and progress.out_time == 4.0
+    assert progress.ended and progress.reports == 2
+
+
+def test_ffmpeg_gets_progress_pipe_and_nostdin():
+    child = FFmpegProcess(["ffmpeg", "-i", "in.ts", "out.ts"])
+    assert child.command(5) == ["ffmpeg", "-progress", "pipe:5", "-nostats", "-nostdin", "-loglevel", "level+info",
+                                "-i", "in.ts", "out.ts"]
+    assert FFmpegProcess(["ffplay", "in.ts"]).command() == ["ffplay", "-loglevel", "level+info", "in.ts"]
+
+
+def test_log_lines_are_echoed_with_their_own_level(capsys):
+    quiet = FFmpegProcess(["ffmpeg", "-loglevel", "error", "-i", "in.ts", "out.ts"])
+    assert quiet.command()[1:4] == ["-nostdin", "-loglevel", "level+error"]
+    script = "import sys; sys.stderr.write('[h264 @ 0x1] [warning] late frame\\nno level\\n')"
+    child = FFmpegProcess([sys.executable, "-c", script], name="tap")
+    child.start()
+    assert wait_until(lambda: child.pid not in ffmpeg_supervisor._children)
+    assert capsys.readouterr().out.splitlines() == [
+        "FFmpeg warning (tap): [h264 @ 0x1] late frame",
+        "FFmpeg (tap): no level",
+    ]
+
+
+def test_child_that_exits_is_unregistered():
+    child = FFmpegProcess([sys.executable, "-c", "import sys; sys.stderr.write('boom\\n')"], echo_log=False)
+    child.start()
+    assert wait_until(lambda: child.pid not in ffmpeg_supervisor._children)
+    assert child.poll() == 0
+    assert child.stats()["last_log"] == "boom"
+    assert child not in ffmpeg_supervisor.children()
+
+
+def test_reap_all_stops_running_children():
+    child = FFmpegProcess([sys.executable, "-c", "import time; time.sleep(30)"])
+    child.start()
+    assert child in ffmpeg_supervisor.children()
+    ffmpeg_supervisor.reap_all(timeout=1.0)
+    assert not child.running
+    assert child.pid not in ffmpeg_supervisor._children
@@ -0,0 +1,89 @@
+import struct
+
+from fmp4 import (NAL_IDR, NAL_PPS, NAL_SPS, TIMESCALE, TS_WRAP, FMP4Muxer, codec_string, parse_pes, parse_sps,
+                  split_nals)
+from ts_ingest import SYNTHETIC_PARAMETER_SETS
+
+IDR = b"\x00\x00\x00\x01\x65\x88\x84\x00"
+NON_IDR = b"\x00\x00\x00\x01\x41\x9a\x00"
+
+
+def timestamp(marker: int, value: int) -> bytes:
+    return bytes([marker << 4 | (value >> 29) & 0x0E | 1, (value >> 22) & 0xFF, (value >> 14) & 0xFE | 1,
+                  (value >> 7) & 0xFF, (value << 1) & 0xFE | 1])
+
+
+def pes(payload: bytes, pts=None, dts=None) -> bytes:
+    header = b""
+    flags = 0
+    if pts is not None:
+        flags = 0x80
+        header = timestamp(0x3 if dts is not None else 0x2, pts)
+        if dts is not None:
+            flags = 0xC0
+            header += timestamp(0x1, dts)
+    return b"\x00\x00\x01\xe0\x00\x00\x80" + bytes([flags, len(header)]) + header + payload
+
+
+def decode_time(fragment: bytes) -> int:
+    pos = fragment.index(b"tfdt")
+    assert fragment[pos + 4] == 1
+    return struct.unpack(">Q", fragment[pos + 8:pos + 16])[0]
+
+
+def sample_duration(fragment: bytes) -> int:
+    pos = fragment.index(b"trun")
+    # version/flags, sample count, data offset, then the first sample's duration
+    return struct.unpack(">I", fragment[pos + 16:pos + 20])[0]
+
+
+def test_split_nals_and_parse_sps():
+    nals = split_nals(SYNTHETIC_PARAMETER_SETS + IDR)
+    assert [nal[0] & 0x1F for nal in nals] == [NAL_SPS, NAL_PPS, NAL_IDR]
+    assert parse_sps(nals[0]) == (1280, 720)
+    assert codec_string(nals[0]) == "avc1.42c01f"
+
+
+def test_parse_pes_timestamps():
+    assert parse_pes(pes(IDR, pts=6000, dts=3000)) == (6000, 3000, IDR)
+    # Without a DTS the decode time is the PTS
+    assert parse_pes(pes(IDR, pts=TS_WRAP - 1)) == (TS_WRAP - 1, TS_WRAP - 1, IDR)
+    assert parse_pes(b"\x00\x00") == (None, None, b"")
+
+
+def test_muxer_starts_at_idr_and_emits_one_frame_late():
+    muxer = FMP4Muxer()
+    assert muxer.add_pes(pes(NON_IDR, pts=0), 0.0) == []
+    out = muxer.add_pes(pes(SYNTHETIC_PARAMETER_SETS + IDR, pts=3000), 0.033)
+    assert [f.kind for f in out] == ["init"]
+    assert b"avcC" in out[0].data and (muxer.width, muxer.height) == (1280, 720)
+    out = muxer.add_pes(pes(NON_IDR, pts=6000), 0.066)
+    assert [(f.kind, f.keyframe) for f in out] == [("media", True)]
+    assert decode_time(out[0].data) == 3000
+    assert sample_duration(out[0].data) == 3000
+    out = muxer.add_pes(pes(NON_IDR, pts=9000), 0.1)
+    assert [(f.kind, f.keyframe) for f in out] == [("media", False)]
+    assert decode_time(out[0].data) == 6000
+
+
+def test_muxer_timestamps_survive_wrap_and_stuck_clocks():
+    muxer = FMP4Muxer()
+    muxer.add_pes(pes(SYNTHETIC_PARAMETER_SETS + IDR, pts=TS_WRAP - 1500), 0.0)
+    # DTS wraps around 2^33 and keeps counting
+    [fragment] = muxer.add_pes(pes(NON_IDR, pts=1500), 0.033)
+    assert sample_duration(fragment.data) == 3000
+    # A clock that stops advancing falls back to arrival times
+    [fragment] = muxer.add_pes(pes(NON_IDR, pts=1500), 0.073)
+    assert sample_duration(fragment.data) == round(0.04 * TIMESCALE)
+    assert decode_time(fragment.data) == 3000
+
+
+def test_changed_sps_sends_a_new_init_segment():
+    muxer = FMP4Muxer()
+    muxer.add_pes(pes(SYNTHETIC_PARAMETER_SETS + IDR, pts=0), 0.0)
+    sps, pps, _ = split_nals(SYNTHETIC_PARAMETER_SETS + IDR)
+    # Same stream with a different level_idc (0x1f -> 0x28)
+    other = b"\x00\x00\x00\x01" + sps[:3] + b"\x28" + sps[4:] + b"\x00\x00\x00\x01" + pps
+    out = muxer.add_pes(pes(other + IDR, pts=3000), 0.033)
+    assert [f.kind for f in out] == ["media", "init"]
+    assert muxer.codec == "avc1.42c028"
@@ -0,0 +1,72 @@
+import io
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import feed, gops, wait_until
+from frame_tap import FrameTap
+
+DATAGRAM = 7 * 188
+
+
+def tap_for(policy, depth=2, ingest=None):
+    # A 1316x1 gray frame is exactly one datagram, so `cat` can stand in for the decoder
+    tap = FrameTap(DATAGRAM, 1, ingest, pix_fmt="gray", policy=policy, depth=depth)
+    tap.command = lambda: ["cat"]
+    return tap
+
+
+def decoded(frames: int):
+    """A finished decoder whose output is `frames` frames filled with their index"""
+    return SimpleNamespace(stdout=io.BytesIO(b"".join(bytes([i]) * DATAGRAM for i in range(frames))))
+
+
+@pytest.mark.parametrize("policy, depth, kept", [("latest", 4, [9]), ("queue", 3, [7, 8, 9])])
+def test_drop_policies_keep_the_newest_frames(policy, depth, kept):
+    tap = tap_for(policy, depth)
+    tap._tapping = True
+    tap._read_frames(decoded(10))
+    frames = []
+    while True:
+        frame = tap.get(timeout=0)
+        if frame is None:
+            break
+        frames.append(frame.data[0])
+    assert frames == kept
+    assert tap.decoded == 10
+    assert tap.dropped == 10 - len(kept)
+    assert tap.delivered == len(kept)
+
+
+def test_block_policy_waits_for_the_consumer_without_looking_stalled():
+    tap = tap_for("block", depth=2)
+    tap._tapping = True
+    reader = threading.Thread(target=tap._read_frames, args=(decoded(5),), daemon=True)
+    reader.start()
+    assert wait_until(lambda: tap._blocked)
+    time.sleep(0.05)
+    # Held up by the consumer, not by the decoder
+    assert time.monotonic() - tap.last_output_at < 0.01
+    assert [tap.get(timeout=1).data[0] for _ in range(5)] == [0, 1, 2, 3, 4]
+    reader.join(timeout=1)
+    assert tap.dropped == 0
+    assert tap.get(timeout=0) is None
+
+
+def test_frames_carry_on_across_restart(ingest):
+    tap = tap_for("queue", depth=64, ingest=ingest)
+    assert tap.start()
+    try:
+        datagrams = gops(1)
+        feed(ingest, datagrams[:8])
+        assert [bytes(tap.get(timeout=1).data) for _ in range(8)] == datagrams[:8]
+        assert tap.restart()
+        # The old reader has finished, so it can't end the new decoder's frames
+        assert not tap._ended
+        feed(ingest, datagrams[8:16])
+        assert [bytes(tap.get(timeout=1).data) for _ in range(8)] == datagrams[8:16]
+    finally:
+        tap.stop()
+    assert tap.get(timeout=0) is None
@@ -0,0 +1,102 @@
+import time
+
+from conftest import feed, gops, wait_until
+from hls_segmenter import HLSSegmenter
+from segment_store import SegmentStore
+from ts_ingest import FLAG_DISCONTINUITY, FLAG_KEYFRAME
+
+FRAME = 8
+GOP = 30 * FRAME
+
+
+def segmenter_for(ingest, store=None, **kwargs):
+    fallbacks = []
+    segmenter = HLSSegmenter(ingest, store or SegmentStore(list_size=3, max_segments=8),
+                             target_duration=0.2, on_fallback=fallbacks.append, **kwargs)
+    # Driven directly rather than from the sink thread, so every step is deterministic
+    segmenter._running = True
+    return segmenter, fallbacks
+
+
+def write_all(segmenter, ingest, start=0, discontinuity_at=()):
+    for seq in range(start, ingest.write_seq):
+        _, view, flags, arrival = ingest.entry(seq)
+        if seq in discontinuity_at:
+            flags |= FLAG_DISCONTINUITY
+        segmenter.write(seq, view, flags, arrival)
+
+
+def test_segments_cut_at_keyframes(ingest):
+    feed(ingest, gops(4))
+    segmenter, fallbacks = segmenter_for(ingest)
+    write_all(segmenter, ingest)
+    store = segmenter.store
+    assert list(store.segments) == [0, 1, 2]
+    for data, duration in store.segments.values():
+        assert abs(duration - 0.29) < 0.01
+        # PAT/PMT first, then the keyframe PES
+        assert data[1:3] == b"\x40\x00"
+    assert not fallbacks
+
+
+def test_dropped_segment_leaves_no_sequence_gap(ingest):
+    feed(ingest, gops(5))
+    segmenter, fallbacks = segmenter_for(ingest)
+    # Loss in the middle of the second GOP; the jitter buffer resumes at the next IDR
+    for seq in range(ingest.write_seq):
+        if GOP + 3 * FRAME < seq < 2 * GOP:
+            continue
+        _, view, flags, arrival = ingest.entry(seq)
+        segmenter.write(seq, view, flags | (FLAG_DISCONTINUITY if seq == 2 * GOP else 0), arrival)
+    store = segmenter.store
+    assert segmenter.segments_dropped == 1
+    assert list(store.segments) == [0, 1, 2]
+    playlist = store.playlist()
+    lines = playlist.splitlines()
+    assert "#EXT-X-MEDIA-SEQUENCE:0" in lines
+    # The segment after the cut is flagged, the others are not
+    assert lines.count("#EXT-X-DISCONTINUITY") == 1
+    assert lines[lines.index("#EXT-X-DISCONTINUITY") + 2] == "stream1.ts"
+    assert not fallbacks
+
+
+def test_resume_on_non_keyframe_waits_for_keyframe_timeout(ingest):
+    feed(ingest, gops(4))
+    segmenter, fallbacks = segmenter_for(ingest, keyframe_timeout=0.5)
+    for seq in range(ingest.write_seq):
+        _, view, flags, arrival = ingest.entry(seq)
+        if GOP <= seq < GOP + 10 * FRAME:
+            continue
+        if seq == GOP + 10 * FRAME:
+            assert not flags & FLAG_KEYFRAME
+            flags |= FLAG_DISCONTINUITY
+        # Arrival times as if the stream had been running for a while before the loss
+        segmenter.write(seq, view, flags, arrival + (5.0 if seq >= GOP else 0.0))
+    assert not fallbacks
+    assert segmenter.segments_dropped == 1
+    # The first GOP was cut short; the third is published as segment 0
+    assert list(segmenter.store.segments) == [0]
+    assert "#EXT-X-DISCONTINUITY" in segmenter.store.playlist()
+
+def test_restart_keeps_numbering_and_does_not_fall_back(ingest):
+    feed(ingest, gops(3))
+    segmenter, fallbacks = segmenter_for(ingest, keyframe_timeout=0.5)
+    write_all(segmenter, ingest)
+    assert segmenter.store.last_sequence == 1
+    segmenter._running = False
+    assert segmenter.restart()
+    try:
+        time.sleep(0.6)
+        # Neither an idle tick nor a non-keyframe right after the restart means the GOP is too long
+        segmenter.idle()
+        _, view, flags, arrival = ingest.entry(FRAME)
+        segmenter.write(FRAME, view, flags, time.monotonic())
+        assert not fallbacks and segmenter.running
+        # The sink thread picks the stream up again from here
+        feed(ingest, gops(3))
+        assert wait_until(lambda: segmenter.store.last_sequence == 3)
+    finally:
+        segmenter.stop()
+    assert not fallbacks
+    assert list(segmenter.store.segments) == [0, 1, 2, 3]
+    assert "#EXT-X-DISCONTINUITY" in segmenter.store.playlist()
@@ -0,0 +1,101 @@
+import http.client
+import socket
+import threading
+import time
+
+import pytest
+
+from hls_server import HLSServer
+from segment_store import SegmentStore
+
+
+@pytest.fixture
+def server():
+    server = HLSServer(SegmentStore(list_size=3, max_segments=6), host="127.0.0.1", block_timeout=2.0)
+    assert server.start()
+    yield server
+    server.stop()
+
+
+def request(server, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=5)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def test_put_segments_and_playlist_then_get(server):
+    assert request(server, "GET", "/stream.m3u8")[0] == 404
+    assert request(server, "PUT", "/stream0.ts", b"ts0")[0] == 201
+    assert request(server, "PUT", "/stream1.ts", b"ts1")[0] == 201
+    playlist = b"#EXTM3U\n#EXTINF:1.500,\nstream0.ts\n#EXTINF:0.750,\nstream1.ts\n"
+    assert request(server, "PUT", "/stream.m3u8", playlist)[0] == 201
+
+    assert request(server, "GET", "/stream1.ts") == (200, b"ts1")
+    assert request(server, "GET", "/stream9.ts")[0] == 404
+    status, body = request(server, "GET", "/stream.m3u8")
+    assert status == 200
+    lines = body.decode().splitlines()
+    assert lines[-4:] == ["#EXTINF:1.500000,", "stream0.ts", "#EXTINF:0.750000,", "stream1.ts"]
+    assert request(server, "DELETE", "/stream0.ts")[0] == 204
+
+
+def test_chunked_put(server):
+    body = b"3\r\nabc\r\n2\r\nde\r\n0\r\n\r\n"
+    assert request(server, "PUT", "/stream0.ts", body, {"Transfer-Encoding": "chunked"})[0] == 201
+    assert server.store.segment("stream0.ts") == b"abcde"
+
+
+def test_bad_framing_headers_are_rejected(server):
+    assert request(server, "PUT", "/stream0.ts", b"abc", {"Content-Length": "three"})[0] == 400
+    assert request(server, "PUT", "/stream0.ts", b"zz\r\nabc\r\n0\r\n\r\n", {"Transfer-Encoding": "chunked"})[0] == 400
+    assert server.store.segment("stream0.ts") is None
+
+
+def test_uploads_are_refused_from_the_network():
+    # Reach the server over this machine's own non-loopback address, as a LAN client would
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probe.connect(("192.0.2.1", 9))
+        address = probe.getsockname()[0]
+    except OSError:
+        address = "127.0.0.1"
+    finally:
+        probe.close()
+    if address.startswith("127."):
+        pytest.skip("no non-loopback address to connect from")
+    store = SegmentStore()
+    store.add(0, b"ts0", 1.0)
+    server = HLSServer(store, host="")
+    assert server.start()
+    try:
+        connection = http.client.HTTPConnection(address, server.port, timeout=5)
+        connection.request("PUT", "/stream0.ts", b"evil")
+        assert connection.getresponse().status == 403
+        connection.close()
+        connection = http.client.HTTPConnection(address, server.port, timeout=5)
+        connection.request("GET", "/stream0.ts")
+        response = connection.getresponse()
+        assert (response.status, response.read()) == (200, b"ts0")
+        connection.close()
+    finally:
+        server.stop()
+
+
+def test_blocking_playlist_reload_waits_for_the_segment(server):
+    server.store.add(0, b"x", 1.0)
+    threading.Timer(0.2, server.store.add, (1, b"y", 1.0)).start()
+    start = time.monotonic()
+    status, body = request(server, "GET", "/stream.m3u8?_HLS_msn=1")
+    assert status == 200
+    assert time.monotonic() - start >= 0.15
+    assert b"stream1.ts" in body
+    assert request(server, "GET", "/stream.m3u8?_HLS_msn=x")[0] == 400
+
+
+def test_live_paths_without_a_preview(server):
+    assert request(server, "GET", "/live")[0] == 404
+    assert request(server, "GET", "/live.html")[0] == 404
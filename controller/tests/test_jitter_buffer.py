@@ -0,0 +1,62 @@
+import time
+
+from conftest import feed, gops
+from jitter_buffer import JitterBuffer, video_cc_range
+from ts_ingest import FLAG_DISCONTINUITY, FLAG_KEYFRAME
+
+VIDEO_PID = 0x1011
+
+
+def drain(buffer: JitterBuffer, wait: float = 0.0):
+    if wait:
+        time.sleep(wait)
+    items = []
+    while True:
+        batch = buffer.read(timeout=0)
+        if not batch:
+            return items
+        items += batch
+
+
+def test_clean_stream_is_released_at_once(ingest):
+    buffer = JitterBuffer(ingest)
+    datagrams = gops(1)
+    feed(ingest, datagrams)
+    released = drain(buffer)
+    assert [bytes(view) for _, view, _, _ in released] == datagrams
+    assert buffer.gaps == 0 and buffer.reordered == 0
+
+
+def test_reordered_datagrams_are_put_back_in_order(ingest):
+    buffer = JitterBuffer(ingest, max_delay=0.05)
+    datagrams = gops(1)
+    swapped = datagrams[:10] + [datagrams[11], datagrams[10]] + datagrams[12:]
+    feed(ingest, swapped)
+    released = drain(buffer, wait=0.1)
+    assert [bytes(view) for _, view, _, _ in released] == datagrams
+    assert buffer.reordered == 1
+    assert buffer.gaps == 0
+
+
+def test_lost_datagram_skips_to_next_keyframe(ingest):
+    buffer = JitterBuffer(ingest, max_delay=0.05)
+    datagrams = gops(2)
+    lost = 20
+    feed(ingest, datagrams[:lost] + datagrams[lost + 1:])
+    released = drain(buffer, wait=0.1)
+    views = [bytes(view) for _, view, _, _ in released]
+    resume = len(datagrams) // 2
+    # Everything before the gap, then nothing until the second GOP's IDR
+    assert views == datagrams[:lost] + datagrams[resume:]
+    assert buffer.gaps == 1
+    assert buffer.lost_packets == 7
+    flags = released[lost][2]
+    assert flags & FLAG_DISCONTINUITY and flags & FLAG_KEYFRAME
+    assert not any(f & FLAG_DISCONTINUITY for _, _, f, _ in released[:lost] + released[lost + 1:])
+
+
+def test_video_cc_range():
+    datagram = gops(1)[1]
+    first, last = video_cc_range(datagram, VIDEO_PID)
+    assert (last - first) & 0x0F == 6
+    assert video_cc_range(datagram, None) == (None, None)
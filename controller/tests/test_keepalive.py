@@ -0,0 +1,68 @@
+import socket
+import time
+
+import pytest
+
+from conftest import wait_until
+from keepalive import KEEP_ALIVE_MESSAGE, KeepAliveScheduler
+
+
+@pytest.fixture
+def camera():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(2.0)
+    yield sock
+    sock.close()
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = KeepAliveScheduler()
+    yield scheduler
+    scheduler.stop()
+
+
+def test_first_keep_alive_is_immediate_then_periodic(scheduler, camera):
+    port = camera.getsockname()[1]
+    start = time.monotonic()
+    scheduler.add("127.0.0.1", port, period=0.1)
+    assert camera.recv(64) == KEEP_ALIVE_MESSAGE
+    assert time.monotonic() - start < 0.1
+    for _ in range(3):
+        camera.recv(64)
+    # Four sends are three periods in, give or take scheduling delay
+    assert 0.25 <= time.monotonic() - start < 0.6
+    key = f"127.0.0.1:{port}"
+    assert wait_until(lambda: scheduler.stats()[key]["sent"] >= 4)
+    stats = scheduler.stats()[key]
+    assert stats["errors"] == 0
+    assert stats["jitter"]["count"] >= stats["sent"]
+
+
+def test_remove_stops_sending(scheduler, camera):
+    port = camera.getsockname()[1]
+    scheduler.add("127.0.0.1", port, period=0.05)
+    camera.recv(64)
+    scheduler.remove("127.0.0.1", port)
+    assert scheduler.cameras() == []
+    time.sleep(0.1)
+    camera.setblocking(False)
+    try:
+        while True:
+            camera.recv(64)  # drain anything sent before the removal
+    except BlockingIOError:
+        pass
+    time.sleep(0.15)
+    with pytest.raises(BlockingIOError):
+        camera.recv(64)
+
+
+def test_send_now_and_custom_message(scheduler, camera):
+    port = camera.getsockname()[1]
+    assert scheduler.send_now("127.0.0.1", port)
+    assert camera.recv(64) == KEEP_ALIVE_MESSAGE
+    scheduler.add("127.0.0.1", port, period=10.0, message=b"ping")
+    assert camera.recv(64) == b"ping"
+    assert scheduler.send_now("127.0.0.1", port)
+    assert camera.recv(64) == b"ping"
@@ -0,0 +1,98 @@
+import json
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import ws_protocol
+from conftest import feed, gops, wait_until
+from fmp4 import Fragment
+from hls_server import HLSServer
+from live_preview import LiveClient, LivePreview, _TestViewer
+from metrics import STAGE_BUCKETS, LatencyHistogram
+from segment_store import SegmentStore
+
+
+@pytest.fixture
+def viewer_socket():
+    server_side, viewer_side = socket.socketpair()
+    yield server_side, viewer_side
+    server_side.close()
+    viewer_side.close()
+
+
+def client_for(connection, **kwargs):
+    handler = SimpleNamespace(client_address=("127.0.0.1", 1234), connection=connection,
+                              rfile=connection.makefile("rb"))
+    return LiveClient(handler, **kwargs)
+
+
+def media(keyframe: bool, arrival: float = None) -> Fragment:
+    return Fragment("media", b"", keyframe, time.monotonic() if arrival is None else arrival)
+
+
+def test_slow_viewer_skips_to_the_next_keyframe(viewer_socket):
+    client = client_for(viewer_socket[0], max_queue_bytes=400)
+    header = ws_protocol.encode_frame(b"{}", ws_protocol.OP_TEXT)
+    client.push(header)
+    # Nothing goes out before the first keyframe
+    client.push(b"x" * 100, media(False))
+    for keyframe in (True, False, False):
+        client.push(b"x" * 100, media(keyframe))
+    assert client.dropped == 1 and client.skips == 0
+    # Over max_queue_bytes: the queued media is dropped, the header stays
+    client.push(b"x" * 100, media(False))
+    assert client.skips == 1
+    assert client.dropped == 1 + 3 + 1
+    client.push(b"x" * 100, media(True))
+    assert [item[0] for item in client._queue] == [header, b"x" * 100]
+
+
+def test_stale_queue_is_skipped(viewer_socket):
+    client = client_for(viewer_socket[0], max_delay=0.1)
+    client.push(b"x", media(True, time.monotonic() - 0.2))
+    client.push(b"x", media(True))
+    assert client.skips == 1
+    assert len(client._queue) == 1
+
+
+def test_viewer_that_stops_reading_is_disconnected(viewer_socket):
+    client = client_for(viewer_socket[0], send_buffer=4096, send_timeout=0.2)
+    served = threading.Thread(target=client.serve, args=(LatencyHistogram(STAGE_BUCKETS),), daemon=True)
+    served.start()
+    client.push(b"x" * (1 << 20), media(True))
+    served.join(timeout=3)
+    assert not served.is_alive()
+    assert client.timed_out and not client.open
+
+
+def test_viewer_gets_header_init_and_keyframe_first(ingest):
+    server = HLSServer(SegmentStore(), host="127.0.0.1")
+    assert server.start()
+    live = LivePreview(ingest)
+    server.live = live
+    assert live.start()
+    viewer = None
+    try:
+        feed(ingest, gops(2))
+        assert live.wait_ready(2.0)
+        viewer = _TestViewer("127.0.0.1", server.port)
+        assert wait_until(lambda: live.viewers == 1)
+        opcode, header = viewer.read()
+        assert opcode == ws_protocol.OP_TEXT
+        assert json.loads(header) == {"codec": "avc1.42c01f", "width": 1280, "height": 720}
+        opcode, init = viewer.read()
+        assert opcode == ws_protocol.OP_BINARY and init[4:8] == b"ftyp"
+        feed(ingest, gops(1))
+        opcode, fragment = viewer.read()
+        assert fragment[4:8] == b"moof"
+        # The first fragment a viewer gets is a sync sample
+        assert b"\x02\x00\x00\x00" in fragment[fragment.index(b"trun"):]
+    finally:
+        if viewer:
+            viewer.close()
+        live.stop()
+        server.stop()
+    assert live.stats()["fragments"] > 0
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+import media
+from media import DownloadProgress, MediaClient, MediaItem, parse_media_list
+
+CLIP = "100GOPRO/GOPR0001.MP4"
+
+
+def pattern(start: int, end: int) -> bytes:
+    # The simulator's media files are the byte pattern i % 251
+    return bytes(i % 251 for i in range(start, end))
+
+
+def test_parse_media_list():
+    listing = {"id": "7", "media": [{"d": "100GOPRO", "fs": [{"n": "GOPR0001.MP4", "s": "1000", "mod": "5"}]}]}
+    assert parse_media_list(listing) == {CLIP: MediaItem("100GOPRO", "GOPR0001.MP4", 1000, 5)}
+
+
+def test_retry_in_the_same_run_is_not_counted_as_resumed():
+    item = MediaItem("100GOPRO", "GOPR0001.MP4", 1000, 0)
+    progress = DownloadProgress()
+    progress.queue(item, present=False)
+    # 100 bytes were on disk from an earlier run; this run gets 400 more before the connection drops
+    progress.begin(item.path, 100, item.size)
+    progress.add(item.path, 400)
+    progress.begin(item.path, 500, item.size)
+    progress.add(item.path, 500)
+    progress.finish(item, True)
+    snapshot = progress.snapshot()
+    assert snapshot["bytes_done"] == 1000
+    assert snapshot["bytes_transferred"] == 900
+
+
+def test_retry_that_starts_over_counts_the_whole_file():
+    item = MediaItem("100GOPRO", "GOPR0001.MP4", 1000, 0)
+    progress = DownloadProgress()
+    progress.queue(item, present=False)
+    progress.begin(item.path, 300, item.size)
+    # The server ignored the Range header on the retry
+    progress.begin(item.path, 0, item.size)
+    progress.add(item.path, 1000)
+    progress.finish(item, True)
+    assert progress.snapshot()["bytes_transferred"] == 1000
+
+
+def test_failed_file_drops_its_resumed_bytes():
+    item = MediaItem("100GOPRO", "GOPR0001.MP4", 1000, 0)
+    progress = DownloadProgress()
+    progress.queue(item, present=False)
+    progress.begin(item.path, 300, item.size)
+    progress.finish(item, False)
+    assert progress.bytes_resumed == 0
+
+
+def test_download_resumes_a_partial_file(simulator, tmp_path):
+    camera = simulator(media={CLIP: 200000, "100GOPRO/GOPR0002.MP4": 5000})
+    client = MediaClient("127.0.0.1", str(tmp_path), concurrency=2, chunk_size=8192,
+                         media_url=camera.base_url + "/videos/DCIM", control_url=camera.base_url)
+    part = tmp_path / "100GOPRO" / "GOPR0001.MP4.part"
+    part.parent.mkdir()
+    part.write_bytes(pattern(0, 50000))
+    try:
+        result = client.download()
+    finally:
+        client.close()
+    assert result["files_done"] == 2 and not result["files_failed"]
+    assert result["bytes_transferred"] == 150000 + 5000
+    assert (tmp_path / "100GOPRO" / "GOPR0001.MP4").read_bytes() == pattern(0, 200000)
+    assert not os.path.exists(part)
+
+
+def test_unsafe_paths_are_dropped_from_the_listing(tmp_path):
+    listing = {"media": [
+        {"d": "..", "fs": [{"n": "evil.sh", "s": "1"}]},
+        {"d": "100GOPRO", "fs": [{"n": "../../evil.sh", "s": "1"}, {"n": "GOPR0001.MP4", "s": "1"}]},
+    ]}
+    assert list(parse_media_list(listing)) == [CLIP]
+    client = MediaClient("127.0.0.1", str(tmp_path))
+    try:
+        with pytest.raises(ValueError):
+            client.local_path(MediaItem("100GOPRO", "../evil.sh", 1, 0))
+    finally:
+        client.close()
+
+
+def test_last_failed_attempt_does_not_back_off(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(media.time, "sleep", sleeps.append)
+    client = MediaClient("127.0.0.1", str(tmp_path), retries=2, media_url="http://127.0.0.1:9/videos/DCIM",
+                         timeout=(0.5, 0.5))
+    try:
+        assert not client._fetch(MediaItem("100GOPRO", "GOPR0001.MP4", 10, 0), DownloadProgress())
+    finally:
+        client.close()
+    assert sleeps == [0.5, 1.0]
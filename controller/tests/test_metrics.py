@@ -0,0 +1,64 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from metrics import LatencyHistogram, MetricsRegistry, MetricsServer, counter, gauge, histogram, render
+
+
+def test_histogram_percentiles_and_snapshot():
+    hist = LatencyHistogram((0.01, 0.1, 1.0))
+    assert hist.percentile(50) is None
+    for seconds in (0.005, 0.005, 0.05, 0.5, 3.0):
+        hist.observe(seconds)
+    assert hist.percentile(40) == 0.01
+    assert hist.percentile(60) == 0.1
+    assert hist.percentile(80) == 1.0
+    # Above the last bucket the largest observation stands in for the bound
+    assert hist.percentile(99) == 3.0
+    snapshot = hist.snapshot()
+    assert snapshot["count"] == 5
+    assert snapshot["min"] == 0.005 and snapshot["max"] == 3.0
+    assert snapshot["mean"] == pytest.approx(3.56 / 5)
+    assert snapshot["buckets"] == {"0.01": 2, "0.1": 1, "1.0": 1, "+Inf": 1}
+
+
+def test_render_prometheus_text():
+    hist = LatencyHistogram((0.1, 1.0))
+    hist.observe(0.05)
+    hist.observe(2.0)
+    text = render([
+        counter("frames_total", "Frames", 3, camera="a"),
+        counter("frames_total", "Frames", 4, camera='b"1'),
+        gauge("fps", "Frame rate", None),
+        histogram("lag_seconds", "Lag", hist),
+    ])
+    lines = text.splitlines()
+    assert lines.count("# TYPE frames_total counter") == 1
+    assert 'frames_total{camera="a"} 3' in lines
+    assert 'frames_total{camera="b\\"1"} 4' in lines
+    # A gauge without a value is described but has no sample
+    assert "# TYPE fps gauge" in lines and not any(line.startswith("fps ") for line in lines)
+    assert 'lag_seconds_bucket{le="0.1"} 1' in lines
+    assert 'lag_seconds_bucket{le="+Inf"} 2' in lines
+    assert "lag_seconds_sum 2.05" in lines
+    assert "lag_seconds_count 2" in lines
+
+
+def test_registry_skips_failing_collectors_and_serves_metrics():
+    registry = MetricsRegistry()
+    registry.register("good", lambda: [gauge("up", "Up", 1)])
+    registry.register("bad", lambda: 1 / 0)
+    assert [m.name for m in registry.collect()] == ["up"]
+    server = MetricsServer(registry, host="127.0.0.1", port=0)
+    assert server.start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=5) as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert "up 1" in response.read().decode().splitlines()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"http://127.0.0.1:{server.port}/other", timeout=5)
+    finally:
+        server.stop()
+    registry.unregister("good")
+    assert registry.collect() == []
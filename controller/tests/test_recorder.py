@@ -0,0 +1,98 @@
+import os
+import time
+
+from conftest import feed, gops
+from recorder import PrerollRecorder
+
+GOP = 30 * 8
+
+
+def recorder_for(ingest, directory, **kwargs):
+    kwargs.setdefault("preallocate", False)
+    recorder = PrerollRecorder(str(directory), ingest, **kwargs)
+    assert recorder.open() is not False
+    recorder._running = True
+    return recorder
+
+
+def write_range(recorder, ingest, start, end, base, clock=0.01):
+    # Arrival times on a fixed clock, so durations don't depend on how fast the test runs
+    for seq in range(start, end):
+        _, view, flags, _ = ingest.entry(seq)
+        recorder.write(seq, view, flags, base + seq * clock)
+
+
+def test_trigger_writes_preroll_then_live_stream(ingest, tmp_path):
+    datagrams = gops(3)
+    feed(ingest, datagrams)
+    recorder = recorder_for(ingest, tmp_path, preroll_seconds=2.0)
+    write_range(recorder, ingest, 0, 2 * GOP, 0.0)
+    # Only the newest GOP is needed to cover two seconds of pre-roll
+    assert recorder.stats()["preroll_bytes"] == sum(map(len, datagrams[GOP:2 * GOP]))
+    recorder.trigger()
+    recorder.idle()
+    assert recorder.recording
+    write_range(recorder, ingest, 2 * GOP, 3 * GOP, 0.0)
+    recorder.release()
+    recorder.idle()
+    assert not recorder.recording
+    [path] = recorder.segments()
+    with open(path, "rb") as f:
+        assert f.read() == b"".join(datagrams[GOP:])
+
+
+def test_segments_rotate_at_keyframes_and_respect_the_budget(ingest, tmp_path):
+    datagrams = gops(4)
+    feed(ingest, datagrams)
+    gop_bytes = sum(map(len, datagrams[:GOP]))
+    recorder = recorder_for(ingest, tmp_path, segment_seconds=0.5, segment_bytes=2 * gop_bytes,
+                            disk_budget=3 * gop_bytes)
+    recorder.trigger()
+    recorder.idle()
+    write_range(recorder, ingest, 0, 4 * GOP, time.monotonic(), clock=0.004)
+    recorder.close()
+    paths = recorder.segments()
+    assert recorder.segments_written == 4
+    # Each GOP lasts 0.96s on the test clock, so every keyframe starts a new segment
+    assert [os.path.getsize(p) for p in paths] == [gop_bytes] * len(paths)
+    assert recorder.segments_deleted == 4 - len(paths)
+    # The open segment counts at its full size, leaving room for one finished segment
+    assert len(paths) == 2
+
+
+def test_restart_keeps_recording_in_a_new_segment(ingest, tmp_path):
+    datagrams = gops(2)
+    feed(ingest, datagrams)
+    recorder = recorder_for(ingest, tmp_path)
+    write_range(recorder, ingest, 0, GOP, 0.0)
+    recorder.trigger()
+    recorder.idle()
+    first = recorder.current_path
+    recorder._running = False
+    assert recorder.restart()
+    try:
+        assert recorder.recording
+        assert recorder.current_path != first
+        write_range(recorder, ingest, GOP, 2 * GOP, 0.0)
+    finally:
+        recorder.stop()
+    assert not recorder.recording
+    contents = []
+    for path in recorder.segments():
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    assert contents == [b"".join(datagrams[:GOP]), b"".join(datagrams[GOP:])]
+
+
+def test_restart_keeps_the_preroll(ingest, tmp_path):
+    feed(ingest, gops(1))
+    recorder = recorder_for(ingest, tmp_path)
+    write_range(recorder, ingest, 0, GOP, 0.0)
+    preroll = recorder.stats()["preroll_bytes"]
+    recorder._running = False
+    assert recorder.restart()
+    try:
+        assert preroll and recorder.stats()["preroll_bytes"] == preroll
+    finally:
+        recorder.stop()
+    assert recorder.stats()["preroll_bytes"] == 0
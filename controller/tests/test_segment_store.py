@@ -0,0 +1,32 @@
+from segment_store import SegmentStore
+
+
+def test_playlist_window_and_discontinuity_sequence():
+    store = SegmentStore(list_size=2, max_segments=3)
+    for sequence in range(3):
+        store.add(sequence, b"x", 1.0, discontinuity=sequence == 1)
+    lines = store.playlist().splitlines()
+    assert lines[:2] == ["#EXTM3U", "#EXT-X-VERSION:9"]
+    assert "#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES" in lines
+    assert "#EXT-X-MEDIA-SEQUENCE:1" in lines
+    assert lines.index("#EXT-X-DISCONTINUITY") == lines.index("stream1.ts") - 2
+    assert not any(line.startswith("#EXT-X-DISCONTINUITY-SEQUENCE") for line in lines)
+    for sequence in range(3, 5):
+        store.add(sequence, b"x", 1.0)
+    lines = store.playlist().splitlines()
+    # The cut at 1 has left the playlist (and then the store) but is still counted
+    assert "#EXT-X-DISCONTINUITY-SEQUENCE:1" in lines
+    assert "#EXT-X-DISCONTINUITY" not in lines
+
+
+def test_eviction_by_count_and_wait_for():
+    store = SegmentStore(list_size=2, max_segments=3)
+    for sequence in range(5):
+        store.add(sequence, b"x" * 10, 1.0)
+    assert list(store.segments) == [2, 3, 4]
+    assert store.evicted == 2
+    assert store.bytes == 30
+    assert store.segment("stream4.ts") == b"x" * 10
+    assert store.segment("other4.ts") is None
+    assert store.wait_for(4, 0.0)
+    assert not store.wait_for(5, 0.01)
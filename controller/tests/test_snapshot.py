@@ -0,0 +1,64 @@
+import time
+
+import snapshot
+from conftest import feed, gops
+from snapshot import SnapshotSink, pid_packets
+from ts_ingest import TS_PACKET_SIZE
+
+GOP = 30 * 8
+
+
+def sink_for(ingest, **kwargs):
+    sink = SnapshotSink(ingest, **kwargs)
+    assert sink.open() is not False
+    sink._running = True
+    return sink
+
+
+def write_range(sink, ingest, start, end, clock=0.01):
+    # Arrival times on a fixed clock that ends now, so intervals don't depend on test speed
+    base = time.monotonic() - end * clock
+    for seq in range(start, end):
+        _, view, flags, _ = ingest.entry(seq)
+        sink.write(seq, view, flags, base + seq * clock)
+
+
+def test_pid_packets():
+    packets = [bytes([0x47, pid >> 8, pid & 0xFF]) + bytes(TS_PACKET_SIZE - 3) for pid in (0x100, 0x101, 0x100)]
+    assert pid_packets(memoryview(b"".join(packets)), 0x100) == packets[0] + packets[2]
+
+
+def test_captures_one_keyframe_access_unit_per_interval(ingest, monkeypatch):
+    units = []
+
+    def decode(unit, width, height, quality):
+        units.append(unit)
+        return b"jpeg"
+
+    monkeypatch.setattr(snapshot, "decode_keyframe", decode)
+    datagrams = gops(3)
+    feed(ingest, datagrams)
+    video_pid = ingest.indexer.video_pid
+    # GOPs are 2.4 s apart on the test clock, so 3 s between thumbnails skips every other one
+    sink = sink_for(ingest, interval=3.0)
+    write_range(sink, ingest, 0, 3 * GOP)
+    sink._pending.result(timeout=2.0)
+    assert sink.keyframes == 3
+    assert sink.captured == 2
+    # PAT/PMT followed by the IDR frame's video packets, and nothing from the next frame
+    idr = b"".join(pid_packets(memoryview(d), video_pid) for d in datagrams[:8])
+    assert units[0].endswith(idr)
+    assert len(units[0]) > len(idr)
+    assert sink.decoded == 2
+    assert sink.snapshot(max_age=60).jpeg == b"jpeg"
+    assert sink.stats()["captured"] == 2
+
+
+def test_failed_decodes_are_counted(ingest, monkeypatch):
+    monkeypatch.setattr(snapshot, "decode_keyframe", lambda *args: None)
+    feed(ingest, gops(1))
+    sink = sink_for(ingest, interval=0.0)
+    write_range(sink, ingest, 0, GOP)
+    sink._pending.result(timeout=2.0)
+    assert sink.captured == 1 and sink.decode_errors == 1
+    assert sink.snapshot() is None
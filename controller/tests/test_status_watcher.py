@@ -0,0 +1,87 @@
+import threading
+
+from conftest import wait_until
+from status_watcher import StatusWatcher, status_diff
+
+
+class Camera:
+    """A fetch function whose status the test changes, counting calls"""
+
+    def __init__(self):
+        self.status = {"status": {"8": 0}, "settings": {"2": 9}}
+        self.calls = 0
+        self.fail = False
+
+    def __call__(self):
+        self.calls += 1
+        return None if self.fail else {section: dict(values) for section, values in self.status.items()}
+
+
+def test_status_diff():
+    old = {"status": {"8": 0, "10": 0}, "settings": {"2": 9}}
+    new = {"status": {"8": 1, "31": 1}, "settings": {"2": 9}, "info": "ignored"}
+    assert status_diff(old, new) == {"status": {"8": (0, 1), "31": (None, 1), "10": (0, None)}}
+    assert status_diff(None, {"settings": {"2": 9}}) == {"settings": {"2": (None, 9)}}
+    assert status_diff(new, new) == {}
+
+
+def test_get_is_served_from_the_ttl_cache():
+    camera = Camera()
+    watcher = StatusWatcher(camera, ttl=60.0)
+    assert watcher.get() == camera.status
+    camera.status["status"]["8"] = 1
+    assert watcher.get()["status"]["8"] == 0
+    assert camera.calls == 1
+    assert watcher.get(max_age=0)["status"]["8"] == 1
+    assert camera.calls == 2
+    camera.fail = True
+    assert watcher.refresh() is None
+    assert watcher.last_error is not None
+    # A failed fetch keeps the last good status
+    assert watcher.get()["status"]["8"] == 1
+
+
+def test_subscribers_get_only_what_changed():
+    camera = Camera()
+    watcher = StatusWatcher(camera)
+    diffs = []
+    unsubscribe = watcher.subscribe(diffs.append)
+    watcher.subscribe(lambda diff: 1 / 0)  # a failing subscriber doesn't stop the others
+    watcher.refresh()
+    watcher.refresh()
+    camera.status["status"]["8"] = 1
+    watcher.refresh()
+    assert diffs == [{"status": {"8": (None, 0)}, "settings": {"2": (None, 9)}}, {"status": {"8": (0, 1)}}]
+    unsubscribe()
+    camera.status["status"]["8"] = 0
+    watcher.refresh()
+    assert len(diffs) == 2
+
+
+def test_poll_interval_backs_off_and_drops_back_on_change():
+    camera = Camera()
+    watcher = StatusWatcher(camera, fast_interval=0.01, slow_interval=0.08, backoff=2.0)
+    intervals = []
+    watcher.start()
+    try:
+        assert wait_until(lambda: watcher.interval == 0.08)
+        watcher.subscribe(lambda diff: intervals.append(watcher.interval))
+        camera.status["status"]["8"] = 1
+        watcher.boost()
+        assert wait_until(lambda: intervals)
+        # The change was seen with polling back at the fast rate
+        assert intervals == [0.01]
+        assert wait_until(lambda: watcher.interval == 0.08)
+    finally:
+        watcher.stop()
+
+
+def test_wait_for_polls_until_the_predicate_holds():
+    camera = Camera()
+    watcher = StatusWatcher(camera, fast_interval=0.01, slow_interval=1.0)
+    threading.Timer(0.1, camera.status["status"].update, ({"8": 1},)).start()
+    try:
+        assert watcher.wait_for(lambda status: status["status"]["8"] == 1, timeout=2.0)
+        assert not watcher.wait_for(lambda status: status["status"]["8"] == 2, timeout=0.1)
+    finally:
+        watcher.stop()
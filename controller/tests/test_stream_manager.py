@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from conftest import wait_until
+from stream_manager import ManagerClient, ManagerServer, StreamManager
+
+
+@pytest.fixture
+def api():
+    manager = StreamManager()
+    server = ManagerServer(manager, port=0)
+    assert server.start()
+    client = ManagerClient(server.url)
+    yield client
+    client.close()
+    server.stop()
+    manager.close()
+
+
+def test_connect_runs_as_a_job_and_commands_reach_the_camera(api, simulator):
+    camera = simulator()
+    ip = f"127.0.0.1:{camera.http_port}"
+    assert api.available()
+    described = api.connect(ip)
+    assert described["state"] == "connecting"
+    assert [job["action"] for job in described["jobs"]] == ["connect"]
+    assert wait_until(lambda: api.camera(ip)["state"] == "connected", timeout=5.0)
+    assert ip in api.cameras()["cameras"]
+
+    job = api.start_recording(ip)
+    assert job["action"] == "start recording" and job["state"] in ("queued", "running", "done")
+    assert api.wait(ip, job, timeout=5.0)
+    assert api.job(ip, job["id"])["state"] == "done"
+    assert camera.recording
+    assert api.wait(ip, api.stop_recording(ip), timeout=5.0)
+    assert not camera.recording
+    assert api.job(ip, "missing") is None
+
+    assert api.disconnect(ip)
+    assert api.camera(ip) is None
+    assert not api.disconnect(ip)
+
+
+def test_unreachable_and_unconnected_cameras(api, simulator):
+    camera = simulator()
+    ip = f"127.0.0.1:{camera.http_port}"
+    camera.stop()
+    api.connect(ip)
+    assert wait_until(lambda: api.camera(ip)["state"] == "unreachable", timeout=20.0)
+    messages = api.camera(ip)["messages"]
+    assert messages[-1]["level"] == "error"
+    # Camera actions need a connected controller
+    assert api.start_preview(ip) is None
+    assert api.take_photo("127.0.0.1:1") is None
+
+
+def test_commands_return_before_the_camera_answers(api, http_camera):
+    camera = http_camera()
+    ip = f"127.0.0.1:{camera.port}"
+    api.connect(ip)
+    assert wait_until(lambda: api.camera(ip)["state"] == "connected", timeout=5.0)
+    camera.delay = 1.0
+    started = time.monotonic()
+    job = api.take_photo(ip)
+    assert time.monotonic() - started < 0.5
+    assert job["action"] == "photo"
+    assert wait_until(lambda: api.job(ip, job["id"])["state"] != "queued", timeout=2.0)
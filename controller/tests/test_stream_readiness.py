@@ -0,0 +1,48 @@
+from conftest import feed, gops
+from stream_readiness import PHASES, StreamReadiness, wait_until_quiet
+
+
+def test_phases_follow_the_stream(ingest):
+    readiness = StreamReadiness(ingest)
+    assert readiness.state == "idle"
+    readiness.begin()
+    assert readiness.state == "starting"
+    readiness.mark("command")
+    readiness.mark("ack")
+    feed(ingest, gops(1))
+    assert readiness.wait("first_packet", 1.0)
+    assert readiness.wait("keyframe", 1.0)
+    readiness.mark("ready")
+    assert readiness.state == "ready"
+    timings = readiness.timings()
+    assert list(timings) == list(PHASES)
+    assert list(timings.values()) == sorted(timings.values())
+    # Phases are only recorded the first time they are reached
+    readiness.mark("ack")
+    assert readiness.timings()["ack"] == timings["ack"]
+    readiness.detach()
+    assert readiness.ingest is None
+
+
+def test_begin_ignores_datagrams_from_before_it(ingest):
+    readiness = StreamReadiness(ingest)
+    feed(ingest, gops(1))
+    readiness.begin()
+    assert not readiness.wait("first_packet", 0.05)
+    assert readiness.timings() == {}
+    feed(ingest, gops(1))
+    assert readiness.wait("first_packet", 1.0)
+    assert readiness.wait("keyframe", 1.0)
+
+
+def test_mark_before_begin_is_ignored():
+    readiness = StreamReadiness()
+    readiness.mark("command")
+    assert readiness.state == "idle" and readiness.timings() == {}
+
+
+def test_wait_until_quiet(ingest):
+    assert wait_until_quiet(ingest)
+    feed(ingest, gops(1)[:8])
+    assert wait_until_quiet(ingest, quiet=0.05, timeout=1.0)
+    assert not wait_until_quiet(ingest, quiet=5.0, timeout=0.05)
@@ -0,0 +1,97 @@
+import socket
+import threading
+
+from conftest import feed, gops, wait_until
+from stream_tee import CallbackSink, FileSink, Sink, StreamTee, UDPSink
+
+
+def test_every_sink_gets_every_datagram(ingest, tmp_path):
+    # Few enough to sit in a default-sized receive buffer until the restream is read
+    datagrams = gops(1)[:80]
+    received = []
+    restream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    restream.bind(("127.0.0.1", 0))
+    restream.settimeout(2.0)
+    tee = StreamTee(ingest)
+    try:
+        assert tee.attach("file", FileSink(str(tmp_path / "out.ts")))
+        assert tee.attach("udp", UDPSink("127.0.0.1", restream.getsockname()[1]))
+        assert tee.attach("tap", CallbackSink(lambda view, flags, arrival: received.append(bytes(view))))
+        feed(ingest, datagrams)
+        assert wait_until(lambda: all(s["datagrams"] == len(datagrams) for s in tee.stats().values()))
+        assert received == datagrams
+        assert [restream.recv(2048) for _ in datagrams] == datagrams
+    finally:
+        tee.stop()
+        restream.close()
+    assert tee.stats() == {}
+    assert (tmp_path / "out.ts").read_bytes() == b"".join(datagrams)
+
+
+def test_failing_sink_stops_without_affecting_the_others(ingest, tmp_path):
+    def explode(view, flags, arrival):
+        raise RuntimeError("boom")
+
+    tee = StreamTee(ingest)
+    try:
+        tee.attach("tap", CallbackSink(explode))
+        tee.attach("file", FileSink(str(tmp_path / "out.ts")))
+        feed(ingest, gops(1))
+        assert wait_until(lambda: tee.stats()["file"]["datagrams"] == 240)
+        stats = tee.stats()["tap"]
+        assert not stats["running"] and stats["error"] == "boom"
+    finally:
+        tee.stop()
+
+
+def test_attach_replaces_a_sink_and_unopenable_sinks_are_not_attached(ingest, tmp_path):
+    tee = StreamTee(ingest)
+    try:
+        first = FileSink(str(tmp_path / "a.ts"))
+        assert tee.attach("file", first)
+        assert tee.attach("file", FileSink(str(tmp_path / "b.ts")))
+        assert not first.running
+        assert not tee.attach("bad", FileSink(str(tmp_path / "missing" / "c.ts")))
+        assert tee.get("bad") is None
+    finally:
+        tee.stop()
+
+
+class SlowSink(Sink):
+    def __init__(self):
+        super().__init__()
+        self.opening = threading.Event()
+        self.proceed = threading.Event()
+        self.proceed.set()
+
+    def open(self):
+        self.opening.set()
+        self.proceed.wait(2.0)
+
+    def write(self, seq, view, flags, arrival):
+        pass
+
+
+def test_restart_keeps_a_sink_attached_and_never_outlives_a_detach(ingest):
+    tee = StreamTee(ingest)
+    sink = SlowSink()
+    try:
+        assert tee.attach("slow", sink)
+        assert tee.restart("slow") and sink.running and tee.get("slow") is sink
+
+        # The restart is in open() when the sink is detached
+        sink.opening.clear()
+        sink.proceed.clear()
+        restart = threading.Thread(target=tee.restart, args=("slow",))
+        restart.start()
+        assert sink.opening.wait(2.0)
+        detach = threading.Thread(target=tee.detach, args=("slow",))
+        detach.start()
+        sink.proceed.set()
+        restart.join(2.0)
+        detach.join(2.0)
+        assert tee.get("slow") is None
+        assert not sink.running
+        assert not tee.restart("slow")
+    finally:
+        tee.stop()
@@ -0,0 +1,110 @@
+import time
+
+from conftest import feed, gops
+from ts_ingest import (FLAG_DISCONTINUITY, FLAG_INVALID, FLAG_KEYFRAME, FLAG_PCR, FLAG_PES_START, FLAG_PSI,
+                       PCR_HZ, TS_PACKET_SIZE, TSIndexer, UDPIngest)
+
+GOP = 30 * 8
+VIDEO_PID = 0x1011
+PES_HEADER = b"\x00\x00\x01\xe0\x00\x00\x80\x80\x05" + b"\x21\x00\x01\x00\x01"
+
+
+def packet(pid, cc, payload=b"", pusi=False, af_flags=0):
+    """One TS packet, padded to 188 bytes with adaptation-field stuffing"""
+    af_length = TS_PACKET_SIZE - 5 - len(payload)
+    header = bytes([0x47, (0x40 if pusi else 0) | pid >> 8, pid & 0xFF, 0x30 | cc & 0x0F, af_length])
+    return header + bytes([af_flags]) + b"\xff" * (af_length - 1) + payload
+
+
+def program(stream_type):
+    """PAT and a PMT announcing one video stream of stream_type on VIDEO_PID"""
+    pat = bytes([0x00, 0x00, 0xB0, 0x0D, 0x00, 0x01, 0xC1, 0x00, 0x00, 0x00, 0x01, 0xF0, 0x00, 0, 0, 0, 0])
+    pmt = bytes([0x00, 0x02, 0xB0, 0x12, 0x00, 0x01, 0xC1, 0x00, 0x00, 0xF0, 0x11, 0xF0, 0x00,
+                 stream_type, 0xF0, 0x11, 0xF0, 0x00, 0, 0, 0, 0])
+    return packet(0, 0, pat, pusi=True) + packet(0x1000, 0, pmt, pusi=True)
+
+
+def index(indexer, datagram):
+    return indexer.index(datagram, 0, len(datagram), time.monotonic())
+
+
+def test_indexes_the_synthetic_stream():
+    indexer = TSIndexer()
+    flags = [index(indexer, d) for d in gops(2)]
+    assert indexer.video_pid == VIDEO_PID and indexer.video_stream_type == 0x1B
+    assert [i for i, f in enumerate(flags) if f & FLAG_PSI] == [0, GOP]
+    assert [i for i, f in enumerate(flags) if f & FLAG_KEYFRAME] == [0, GOP]
+    # Every frame starts a PES carrying a PCR, 1/100 s apart
+    assert [i for i, f in enumerate(flags) if f & FLAG_PES_START] == list(range(0, 2 * GOP, 8))
+    assert [i for i, f in enumerate(flags) if f & FLAG_PCR] == list(range(0, 2 * GOP, 8))
+    assert indexer.pcr == 59 * PCR_HZ // 100
+    assert indexer.pcr_count == 60
+    assert indexer.keyframes == 2
+    assert indexer.cc_errors == 0 and indexer.sync_errors == 0
+    assert not any(f & (FLAG_DISCONTINUITY | FLAG_INVALID) for f in flags)
+
+
+def test_continuity_gaps_are_counted():
+    indexer = TSIndexer()
+    datagrams = gops(1)
+    del datagrams[5]
+    flags = [index(indexer, d) for d in datagrams[:7]]
+    assert flags[5] & FLAG_DISCONTINUITY
+    assert indexer.cc_errors == 1
+    assert indexer.lost_packets == 7
+    assert not any(f & FLAG_DISCONTINUITY for f in flags[:5] + flags[6:])
+
+
+def test_invalid_datagrams():
+    indexer = TSIndexer()
+    datagram = bytearray(gops(1)[1])
+    datagram[TS_PACKET_SIZE] = 0x00
+    assert index(indexer, datagram) & FLAG_INVALID
+    assert indexer.sync_errors == 1
+    assert index(indexer, gops(1)[1][:-1]) & FLAG_INVALID
+
+
+def test_h264_keyframes_by_random_access_indicator_or_nal_type():
+    indexer = TSIndexer()
+    assert index(indexer, program(0x1B)) & FLAG_PSI
+    assert indexer.video_pid == VIDEO_PID
+    # Random-access indicator alone
+    assert index(indexer, packet(VIDEO_PID, 0, af_flags=0x40)) & FLAG_KEYFRAME
+    # IDR (5) and SPS (7) at the start of a PES; a non-IDR slice (1) is not a keyframe
+    assert index(indexer, packet(VIDEO_PID, 1, PES_HEADER + b"\x00\x00\x00\x01\x65", pusi=True)) & FLAG_KEYFRAME
+    assert index(indexer, packet(VIDEO_PID, 2, PES_HEADER + b"\x00\x00\x00\x01\x67", pusi=True)) & FLAG_KEYFRAME
+    flags = index(indexer, packet(VIDEO_PID, 3, PES_HEADER + b"\x00\x00\x00\x01\x41", pusi=True))
+    assert flags & FLAG_PES_START and not flags & FLAG_KEYFRAME
+
+
+def test_hevc_keyframes_by_nal_type():
+    indexer = TSIndexer()
+    index(indexer, program(0x24))
+    assert indexer.video_stream_type == 0x24
+    # IDR_W_RADL (19) and SPS (33) are keyframes; TRAIL_R (1) is not
+    assert index(indexer, packet(VIDEO_PID, 0, PES_HEADER + b"\x00\x00\x01\x26\x01", pusi=True)) & FLAG_KEYFRAME
+    assert index(indexer, packet(VIDEO_PID, 1, PES_HEADER + b"\x00\x00\x01\x42\x01", pusi=True)) & FLAG_KEYFRAME
+    assert not index(indexer, packet(VIDEO_PID, 2, PES_HEADER + b"\x00\x00\x01\x02\x01", pusi=True)) & FLAG_KEYFRAME
+
+
+def test_ring_readers_are_independent_and_count_overruns():
+    ingest = UDPIngest(port=0, host="127.0.0.1", slots=64)
+    assert ingest.start()
+    try:
+        first = ingest.reader()
+        datagrams = gops(1)[:48]
+        feed(ingest, datagrams)
+        items = first.read(timeout=0)
+        assert [seq for seq, _, _, _ in items] == list(range(48))
+        assert [bytes(view) for _, view, _, _ in items] == datagrams
+        assert items[0][2] & FLAG_KEYFRAME
+        late = ingest.reader(from_latest=False)
+        feed(ingest, gops(1)[:48])
+        # 96 datagrams went through a 64-slot ring, whose slot being received into is never
+        # handed out: the late reader gets the newest 63 and lost the 33 before them
+        assert [seq for seq, _, _, _ in late.read(timeout=0)] == list(range(33, 96))
+        assert late.overruns == 1 and late.skipped == 33
+        assert len(first.read(timeout=0)) == 48 and first.overruns == 0
+        assert ingest.stats()["datagrams"] == 96
+    finally:
+        ingest.stop()
@@ -0,0 +1,70 @@
+import time
+from types import SimpleNamespace
+
+from conftest import feed, gops, wait_until
+from watchdog import StreamWatchdog
+
+ESCALATION = (("keep_alive", 0.1), ("restart_stream", 0.3), ("restart_pipeline", 0.3))
+
+
+def watchdog_for(ingest, actions, sinks=None, restart_sink=None, **kwargs):
+    return StreamWatchdog(lambda: ingest, lambda: sinks or {}, actions, restart_sink or (lambda name: True),
+                          stall_ms=100, escalation=ESCALATION, **kwargs)
+
+
+def test_escalates_until_packets_come_back(ingest):
+    datagram = gops(1)[:1]
+    calls = []
+    actions = {
+        "keep_alive": lambda: calls.append("keep_alive"),
+        # Only a gpStream restart brings this camera back
+        "restart_stream": lambda: (calls.append("restart_stream"), feed(ingest, datagram)),
+        "restart_pipeline": lambda: calls.append("restart_pipeline"),
+    }
+    feed(ingest, datagram)
+    watchdog = watchdog_for(ingest, actions)
+    watchdog.start()
+    try:
+        assert wait_until(lambda: watchdog.recovered_by["restart_stream"] == 1)
+    finally:
+        watchdog.stop()
+    assert calls[:2] == ["keep_alive", "restart_stream"]
+    assert watchdog.stalls >= 1 and watchdog.failures == 0
+    assert 0.1 < watchdog.last_recovery < 1.0
+
+
+def test_failed_ladder_is_counted_and_retried(ingest):
+    calls = []
+    actions = {action: (lambda action=action: calls.append(action)) for action, _ in ESCALATION}
+    feed(ingest, gops(1)[:1])
+    watchdog = watchdog_for(ingest, actions, retry_interval=0.1)
+    watchdog.start()
+    try:
+        assert wait_until(lambda: watchdog.failures >= 2, timeout=3.0)
+    finally:
+        watchdog.stop()
+    assert calls[:4] == ["keep_alive", "restart_stream", "restart_pipeline", "keep_alive"]
+    assert watchdog.state == "idle"
+
+
+def test_dead_sinks_are_restarted_within_the_limit(ingest):
+    feed(ingest, gops(1)[:1])
+    sink = SimpleNamespace(running=False, error="ffmpeg exited", last_output_at=None)
+    restarted = []
+    watchdog = watchdog_for(ingest, {}, sinks={"hls": sink}, restart_sink=restarted.append, max_sink_restarts=2)
+    # Checked directly: the stream itself looks stalled to a running watchdog by now
+    for _ in range(5):
+        watchdog._check_sinks()
+    assert restarted == ["hls", "hls"]
+    assert watchdog.sink_restarts == {"hls": 2}
+
+
+def test_quiet_sink_is_restarted_after_output_stall(ingest):
+    sink = SimpleNamespace(running=True, error=None, last_output_at=time.monotonic())
+    restarted = []
+    watchdog = watchdog_for(ingest, {}, sinks={"frames": sink}, restart_sink=restarted.append, output_stall=0.05)
+    watchdog._check_sinks()
+    assert restarted == []
+    time.sleep(0.1)
+    watchdog._check_sinks()
+    assert restarted == ["frames"]
@@ -0,0 +1,53 @@
+import io
+import os
+
+import pytest
+
+import ws_protocol
+
+
+def client_frame(payload: bytes, opcode: int = ws_protocol.OP_TEXT, mask: bytes = b"\x37\xfa\x21\x3d") -> bytes:
+    length = len(payload)
+    if length < 126:
+        header = bytes([0x80 | opcode, 0x80 | length])
+    elif length < 1 << 16:
+        header = bytes([0x80 | opcode, 0x80 | 126]) + length.to_bytes(2, "big")
+    else:
+        header = bytes([0x80 | opcode, 0x80 | 127]) + length.to_bytes(8, "big")
+    return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+def test_accept_key_matches_rfc_6455_example():
+    assert ws_protocol.accept_key("dGhlIHNhbXBsZSBub25jZQ==") == "s3pPLMBiTxaQ9kYGzzhZRbK+xOo="
+
+
+@pytest.mark.parametrize("length, header", [(125, b"\x82\x7d"), (126, b"\x82\x7e\x00\x7e"),
+                                            (1 << 16, b"\x82\x7f" + (1 << 16).to_bytes(8, "big"))])
+def test_encode_frame_length_forms(length, header):
+    frame = ws_protocol.encode_frame(bytes(length))
+    assert frame[:len(header)] == header
+    assert len(frame) == len(header) + length
+
+
+@pytest.mark.parametrize("length", [0, 5, 126, 1000])
+def test_read_frame_unmasks(length):
+    payload = os.urandom(length)
+    assert ws_protocol.read_frame(io.BytesIO(client_frame(payload, ws_protocol.OP_BINARY))) == \
+        (ws_protocol.OP_BINARY, True, payload)
+
+
+def test_read_frame_rejects_unmasked_and_oversized_frames():
+    with pytest.raises(ValueError):
+        ws_protocol.read_frame(io.BytesIO(ws_protocol.encode_frame(b"hi")))
+    with pytest.raises(ValueError):
+        ws_protocol.read_frame(io.BytesIO(client_frame(bytes(100))), max_size=99)
+
+
+def test_read_frame_returns_none_on_truncation():
+    frame = client_frame(b"hello")
+    for cut in (0, 1, 4, len(frame) - 1):
+        assert ws_protocol.read_frame(io.BytesIO(frame[:cut])) is None
+
+
+def test_close_payload():
+    assert ws_protocol.close_payload(1001, "bye") == b"\x03\xe9bye"
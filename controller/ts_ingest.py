@@ -0,0 +1,549 @@
+import socket
+import threading
+import time
+from array import array
+from typing import Callable, List, Optional, Tuple
+
+from metrics import STAGE_BUCKETS, LatencyHistogram
+
+TS_PACKET_SIZE = 188
+TS_PACKETS_PER_DATAGRAM = 7
+SYNC_BYTE = 0x47
+PAT_PID = 0x0000
+NULL_PID = 0x1FFF
+PCR_HZ = 27000000
+PCR_WRAP = (1 << 33) * 300
+
+# Per-datagram flags stored alongside each ring slot
+FLAG_KEYFRAME = 0x01      # random-access indicator or IDR/SPS at the start of a video PES
+FLAG_PCR = 0x02           # carries a program clock reference
+FLAG_PSI = 0x04           # carries a PAT or PMT section
+FLAG_DISCONTINUITY = 0x08 # a continuity-counter gap was detected in this datagram
+FLAG_INVALID = 0x10       # lost sync or not a whole number of TS packets
+FLAG_PES_START = 0x20     # a video PES (access unit) starts in this datagram
+
+H264_STREAM_TYPES = (0x1B,)
+HEVC_STREAM_TYPES = (0x24,)
+START_CODE = b"\x00\x00\x01"
+SYNTHETIC_PARAMETER_SETS = bytes.fromhex("000000016742c01fda014016ec05a808080a00000300020000030079080000000168ce3c80")
+
+
+class TSIndexer:
+    """Validates and indexes 188-byte TS packets in place, without copying them"""
+
+    def __init__(self):
+        self.continuity = [-1] * 8192
+        self.pmt_pids = set()
+        self.video_pid: Optional[int] = None
+        self.video_stream_type: Optional[int] = None
+        self.pcr: Optional[int] = None
+        self.pcr_arrival: Optional[float] = None
+        self.packets = 0
+        self.sync_errors = 0
+        self.cc_errors = 0
+        self.lost_packets = 0
+        self.pcr_count = 0
+        self.keyframes = 0
+        self.pat_seen = False
+        self.pmt_seen = False
+        self.on_pcr: Optional[Callable[[int, float], None]] = None
+
+    def index(self, buf, offset: int, length: int, arrival: float) -> int:
+        """Index the TS packets in buf[offset:offset + length] and return FLAG_* bits"""
+        flags = 0
+        if length % TS_PACKET_SIZE:
+            flags |= FLAG_INVALID
+        end = offset + length - length % TS_PACKET_SIZE
+        continuity = self.continuity
+        for pos in range(offset, end, TS_PACKET_SIZE):
+            if buf[pos] != SYNC_BYTE:
+                self.sync_errors += 1
+                flags |= FLAG_INVALID
+                continue
+            self.packets += 1
+            b1 = buf[pos + 1]
+            pid = ((b1 & 0x1F) << 8) | buf[pos + 2]
+            if pid == NULL_PID:
+                continue
+            b3 = buf[pos + 3]
+            afc = (b3 >> 4) & 0x3
+            payload = pos + 4
+
+            if afc & 0x2:
+                af_len = buf[pos + 4]
+                payload = pos + 5 + af_len
+                if af_len:
+                    af_flags = buf[pos + 5]
+                    if af_flags & 0x40 and pid == self.video_pid:
+                        flags |= FLAG_KEYFRAME
+                    if af_flags & 0x10 and af_len >= 7:
+                        p = pos + 6
+                        base = (buf[p] << 25) | (buf[p + 1] << 17) | (buf[p + 2] << 9) | \
+                               (buf[p + 3] << 1) | (buf[p + 4] >> 7)
+                        ext = ((buf[p + 4] & 0x1) << 8) | buf[p + 5]
+                        self.pcr = base * 300 + ext
+                        self.pcr_arrival = arrival
+                        self.pcr_count += 1
+                        flags |= FLAG_PCR
+                        if self.on_pcr is not None:
+                            self.on_pcr(self.pcr, arrival)
+                    if af_flags & 0x80:
+                        continuity[pid] = -1
+
+            if afc & 0x1:
+                cc = b3 & 0x0F
+                last = continuity[pid]
+                if last >= 0 and cc != (last + 1) & 0x0F and cc != last:
+                    self.cc_errors += 1
+                    self.lost_packets += (cc - last - 1) & 0x0F
+                    flags |= FLAG_DISCONTINUITY
+                continuity[pid] = cc
+
+                if b1 & 0x40 and payload < pos + TS_PACKET_SIZE:
+                    if pid == self.video_pid:
+                        flags |= FLAG_PES_START
+                        if self._starts_keyframe(buf, payload, pos + TS_PACKET_SIZE):
+                            flags |= FLAG_KEYFRAME
+                    elif pid == PAT_PID:
+                        self._parse_pat(buf, payload, pos + TS_PACKET_SIZE)
+                        flags |= FLAG_PSI
+                    elif pid in self.pmt_pids:
+                        self._parse_pmt(buf, payload, pos + TS_PACKET_SIZE)
+                        flags |= FLAG_PSI
+        if flags & FLAG_KEYFRAME:
+            self.keyframes += 1
+        return flags
+
+    def _section(self, buf, payload: int, end: int) -> Tuple[int, int]:
+        start = payload + 1 + buf[payload]
+        if start + 3 > end:
+            return start, start
+        section_length = ((buf[start + 1] & 0x0F) << 8) | buf[start + 2]
+        return start, min(start + 3 + section_length - 4, end)
+
+    def _parse_pat(self, buf, payload: int, end: int):
+        start, section_end = self._section(buf, payload, end)
+        if start >= end or buf[start] != 0x00:
+            return
+        self.pat_seen = True
+        for p in range(start + 8, section_end - 3, 4):
+            program = (buf[p] << 8) | buf[p + 1]
+            if program:
+                self.pmt_pids.add(((buf[p + 2] & 0x1F) << 8) | buf[p + 3])
+
+    def _parse_pmt(self, buf, payload: int, end: int):
+        start, section_end = self._section(buf, payload, end)
+        if start >= end or buf[start] != 0x02:
+            return
+        self.pmt_seen = True
+        program_info_length = ((buf[start + 10] & 0x0F) << 8) | buf[start + 11]
+        p = start + 12 + program_info_length
+        while p + 5 <= section_end:
+            stream_type = buf[p]
+            pid = ((buf[p + 1] & 0x1F) << 8) | buf[p + 2]
+            es_info_length = ((buf[p + 3] & 0x0F) << 8) | buf[p + 4]
+            if stream_type in H264_STREAM_TYPES + HEVC_STREAM_TYPES and self.video_pid is None:
+                self.video_pid = pid
+                self.video_stream_type = stream_type
+            p += 5 + es_info_length
+
+    def _starts_keyframe(self, buf, payload: int, end: int) -> bool:
+        """Look for an IDR or parameter-set NAL unit at the start of a video PES"""
+        if payload + 9 > end or buf[payload:payload + 3] != START_CODE:
+            return False
+        es = payload + 9 + buf[payload + 8]
+        hevc = self.video_stream_type in HEVC_STREAM_TYPES
+        p = buf.find(START_CODE, es, end)
+        while 0 <= p < end - 3:
+            header = buf[p + 3]
+            if hevc:
+                if 16 <= (header >> 1) & 0x3F <= 21 or (header >> 1) & 0x3F == 33:
+                    return True
+            elif header & 0x1F in (5, 7):
+                return True
+            p = buf.find(START_CODE, p + 3, end)
+        return False
+
+    def snapshot(self) -> dict:
+        return {
+            "packets": self.packets,
+            "sync_errors": self.sync_errors,
+            "cc_errors": self.cc_errors,
+            "lost_packets": self.lost_packets,
+            "pcr_count": self.pcr_count,
+            "keyframes": self.keyframes,
+            "video_pid": self.video_pid,
+        }
+
+
+class PCRDriftEstimator:
+    """Estimates how fast the camera's PCR clock runs against the local monotonic clock.
+
+    drift_ppm > 0 means wall-clock time passes faster than PCR time, i.e. data is
+    arriving late and latency is building up. The estimate is an exponentially
+    weighted slope over PCR/arrival pairs; PCR wraps and jumps reset it.
+    """
+
+    def __init__(self, alpha: float = 0.05, max_jump: float = 1.0):
+        self.alpha = alpha
+        self.max_jump = max_jump
+        self.drift_ppm: Optional[float] = None
+        self.offset: Optional[float] = None
+        self.resets = 0
+        self.samples = 0
+        self._ref: Optional[tuple] = None
+        self._last: Optional[tuple] = None
+
+    def update(self, pcr: int, arrival: float):
+        if self._last is not None:
+            delta_pcr = ((pcr - self._last[0]) % PCR_WRAP) / PCR_HZ
+            delta_wall = arrival - self._last[1]
+            if delta_pcr > self.max_jump or abs(delta_wall - delta_pcr) > self.max_jump:
+                self._ref = None
+                self.resets += 1
+        self._last = (pcr, arrival)
+        if self._ref is None:
+            self._ref = (pcr, arrival)
+            return
+        elapsed_pcr = ((pcr - self._ref[0]) % PCR_WRAP) / PCR_HZ
+        elapsed_wall = arrival - self._ref[1]
+        self.offset = elapsed_wall - elapsed_pcr
+        if elapsed_pcr < 0.5:
+            return
+        ppm = (elapsed_wall - elapsed_pcr) / elapsed_pcr * 1e6
+        self.drift_ppm = ppm if self.drift_ppm is None else \
+            self.drift_ppm + self.alpha * (ppm - self.drift_ppm)
+        self.samples += 1
+
+
+class RingReader:
+    """Cursor over an ingest ring; each consumer gets its own so a slow one only hurts itself.
+
+    Views returned by read() point straight into the ring and stay valid until the
+    ring wraps around (ingest.slots datagrams later); copy anything kept longer.
+    """
+
+    def __init__(self, ingest: "UDPIngest", from_latest: bool = True):
+        self.ingest = ingest
+        self.next_seq = ingest.write_seq if from_latest else max(0, ingest.write_seq - ingest.slots + 1)
+        self.overruns = 0
+        self.skipped = 0
+
+    def read(self, timeout: Optional[float] = None, max_items: int = 1024) -> List[Tuple[int, memoryview, int, float]]:
+        """Return (seq, view, flags, arrival) for datagrams received since the last read"""
+        ingest = self.ingest
+        if ingest.write_seq == self.next_seq and timeout != 0:
+            ingest.wait(self.next_seq, timeout)
+        write_seq = ingest.write_seq
+        oldest = write_seq - ingest.slots + 1
+        if self.next_seq < oldest:
+            self.overruns += 1
+            self.skipped += oldest - self.next_seq
+            self.next_seq = oldest
+        items = []
+        end = min(write_seq, self.next_seq + max_items)
+        for seq in range(self.next_seq, end):
+            items.append(ingest.entry(seq))
+        self.next_seq = end
+        return items
+
+    def valid(self, seq: int) -> bool:
+        return seq > self.ingest.write_seq - self.ingest.slots
+
+
+class UDPIngest:
+    """Receives the camera's MPEG-TS datagrams into a preallocated ring buffer.
+
+    Each datagram is read with recv_into straight into its ring slot and indexed in
+    place; downstream stages read the slots through RingReader cursors.
+    """
+
+    def __init__(self, port: int = 8554, host: str = "", slots: int = 16384, slot_size: int = 1500,
+                 rcvbuf: int = 8 * 1024 * 1024):
+        self.host = host
+        self.port = port
+        self.slots = slots
+        self.slot_size = slot_size
+        self.rcvbuf = rcvbuf
+        self.buffer = bytearray(slots * slot_size)
+        self.view = memoryview(self.buffer)
+        self.lengths = array("I", [0]) * slots
+        self.flags = array("B", [0]) * slots
+        self.arrivals = array("d", [0.0]) * slots
+        self.pcrs = array("q", [-1]) * slots
+        self.write_seq = 0
+        self.indexer = TSIndexer()
+        self.datagrams = 0
+        self.bytes = 0
+        self.truncated = 0
+        self.index_latency = LatencyHistogram(STAGE_BUCKETS)
+        self.started_at: Optional[float] = None
+        self.first_packet_at: Optional[float] = None
+        self.last_packet_at: Optional[float] = None
+        self.sock: Optional[socket.socket] = None
+        self._cond = threading.Condition()
+        self._waiters = 0
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[int, int], None]] = []
+
+    def start(self) -> bool:
+        if self._running:
+            return True
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+            except OSError:
+                pass
+            sock.bind((self.host, self.port))
+            sock.settimeout(0.2)
+        except OSError as e:
+            print(f"Error binding ingest port {self.port}: {e}")
+            return False
+        self.sock = sock
+        self.port = sock.getsockname()[1]
+        self.started_at = time.monotonic()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._running = False
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+        self._thread = None
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        with self._cond:
+            self._cond.notify_all()
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def add_listener(self, callback: Callable[[int, int], None]):
+        """Call callback(seq, flags) on the ingest thread for flagged datagrams; keep it cheap"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[int, int], None]):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def reader(self, from_latest: bool = True) -> RingReader:
+        return RingReader(self, from_latest)
+
+    def entry(self, seq: int) -> Tuple[int, memoryview, int, float]:
+        slot = seq % self.slots
+        offset = slot * self.slot_size
+        return seq, self.view[offset:offset + self.lengths[slot]], self.flags[slot], self.arrivals[slot]
+
+    def wait(self, seq: int, timeout: Optional[float] = None) -> bool:
+        """Block until datagram seq has been written"""
+        with self._cond:
+            self._waiters += 1
+            try:
+                return self._cond.wait_for(lambda: self.write_seq > seq or not self._running, timeout)
+            finally:
+                self._waiters -= 1
+
+    def _run(self):
+        sock = self.sock
+        recv_into = sock.recv_into
+        view = self.view
+        slot_size = self.slot_size
+        slots = self.slots
+        index = self.indexer.index
+        observe = self.index_latency.observe
+        buffer = self.buffer
+        while self._running:
+            slot = self.write_seq % slots
+            offset = slot * slot_size
+            try:
+                n = recv_into(view[offset:offset + slot_size], slot_size)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self._running:
+                    time.sleep(0.01)
+                continue
+            now = time.monotonic()
+            if n == slot_size:
+                self.truncated += 1
+            if self.first_packet_at is None:
+                self.first_packet_at = now
+            self.last_packet_at = now
+            self.lengths[slot] = n
+            self.arrivals[slot] = now
+            flags = index(buffer, offset, n, now)
+            observe(time.monotonic() - now)
+            self.flags[slot] = flags
+            self.pcrs[slot] = self.indexer.pcr if flags & FLAG_PCR else -1
+            self.datagrams += 1
+            self.bytes += n
+            seq = self.write_seq
+            self.write_seq = seq + 1
+            if self._waiters:
+                with self._cond:
+                    self._cond.notify_all()
+            if flags and self._listeners:
+                for callback in list(self._listeners):
+                    try:
+                        callback(seq, flags)
+                    except Exception as e:
+                        print(f"Ingest listener error: {e}")
+
+    def stats(self) -> dict:
+        elapsed = (time.monotonic() - self.started_at) if self.started_at else 0.0
+        stats = {
+            "datagrams": self.datagrams,
+            "bytes": self.bytes,
+            "truncated": self.truncated,
+            "elapsed": elapsed,
+            "mbps": self.bytes * 8 / elapsed / 1e6 if elapsed else 0.0,
+            "last_packet_age": time.monotonic() - self.last_packet_at if self.last_packet_at else None,
+        }
+        stats.update(self.indexer.snapshot())
+        return stats
+
+
+def pes_start_offset(view, pid: int) -> int:
+    """Byte offset of the first TS packet in view that starts a PES on pid (0 if none)"""
+    for pos in range(0, len(view) - len(view) % TS_PACKET_SIZE, TS_PACKET_SIZE):
+        if view[pos + 1] & 0x40 and ((view[pos + 1] & 0x1F) << 8 | view[pos + 2]) == pid:
+            return pos
+    return 0
+
+
+def psi_packets(view, pmt_pids) -> bytes:
+    """Copy out the PAT/PMT packets of a datagram, to be repeated at the start of segments"""
+    packets = []
+    for pos in range(0, len(view) - len(view) % TS_PACKET_SIZE, TS_PACKET_SIZE):
+        pid = (view[pos + 1] & 0x1F) << 8 | view[pos + 2]
+        if pid == PAT_PID or pid in pmt_pids:
+            packets.append(bytes(view[pos:pos + TS_PACKET_SIZE]))
+    return b"".join(packets)
+
+
+def synthetic_datagrams(count: Optional[int], pid: int = 0x1011, gop: int = 30, datagrams_per_frame: int = 8,
+                        fps: float = 100.0):
+    """Build a sequence of TS datagrams: PAT/PMT, then video PES with periodic IDRs.
+
+    Each frame is datagrams_per_frame datagrams with a PCR on its first packet, spaced
+    1/fps apart on the PCR timeline. count=None yields frames forever.
+    """
+    def packet(pid, cc, payload, pusi=False, rai=False, pcr=None):
+        header = bytes([SYNC_BYTE, (0x40 if pusi else 0) | (pid >> 8), pid & 0xFF])
+        af = b""
+        if rai or pcr is not None:
+            af = bytes([(0x40 if rai else 0) | (0x10 if pcr is not None else 0)])
+            if pcr is not None:
+                base, ext = divmod(pcr, 300)
+                af += bytes([(base >> 25) & 0xFF, (base >> 17) & 0xFF, (base >> 9) & 0xFF,
+                             (base >> 1) & 0xFF, ((base & 1) << 7) | 0x7E | (ext >> 8), ext & 0xFF])
+        room = TS_PACKET_SIZE - 4 - (len(af) + 1 if af else 0)
+        payload = payload[:room]
+        stuffing = room - len(payload)
+        if not af and not stuffing:
+            return header + bytes([0x10 | (cc & 0x0F)]) + payload
+        if af:
+            af_body = af + b"\xff" * stuffing
+        else:
+            af_body = b"\x00" + b"\xff" * (stuffing - 2) if stuffing > 1 else b""
+        return header + bytes([0x30 | (cc & 0x0F), len(af_body)]) + af_body + payload
+
+    pat = bytes([0x00, 0x00, 0xB0, 0x0D, 0x00, 0x01, 0xC1, 0x00, 0x00, 0x00, 0x01, 0xF0, 0x00, 0, 0, 0, 0])
+    pmt = bytes([0x00, 0x02, 0xB0, 0x12, 0x00, 0x01, 0xC1, 0x00, 0x00, 0xE0 | (pid >> 8), pid & 0xFF,
+                 0xF0, 0x00, 0x1B, 0xE0 | (pid >> 8), pid & 0xFF, 0xF0, 0x00, 0, 0, 0, 0])
+    cc = {0: 0, 0x1000: 0, pid: 0}
+    frame = 0
+    produced = 0
+    while count is None or produced < count:
+        packets = []
+        if frame % gop == 0:
+            packets.append(packet(0, cc[0], pat, pusi=True)); cc[0] += 1
+            packets.append(packet(0x1000, cc[0x1000], pmt, pusi=True)); cc[0x1000] += 1
+        keyframe = frame % gop == 0
+        # A 1280x720 baseline SPS and a PPS ahead of each IDR, as the camera sends them
+        nal = SYNTHETIC_PARAMETER_SETS + b"\x00\x00\x00\x01\x65" if keyframe else b"\x00\x00\x00\x01\x41"
+        pes = b"\x00\x00\x01\xe0\x00\x00\x80\x80\x05" + b"\x21\x00\x01\x00\x01" + nal
+        pcr = int(frame * PCR_HZ / fps) % PCR_WRAP
+        first = True
+        total_packets = datagrams_per_frame * TS_PACKETS_PER_DATAGRAM - len(packets)
+        for i in range(total_packets):
+            body = pes if first else b"\xaa" * 184
+            packets.append(packet(pid, cc[pid], body, pusi=first, rai=first and keyframe,
+                                  pcr=pcr if first else None))
+            cc[pid] += 1
+            first = False
+        for i in range(0, len(packets), TS_PACKETS_PER_DATAGRAM):
+            yield b"".join(packets[i:i + TS_PACKETS_PER_DATAGRAM])
+            produced += 1
+            if count is not None and produced >= count:
+                return
+        frame += 1
+
+
+def _send_synthetic(port: int, mbps: float, seconds: float):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    datagram_size = TS_PACKET_SIZE * TS_PACKETS_PER_DATAGRAM
+    rate = mbps * 1e6 / 8 / datagram_size
+    # 16 GOPs, so every PID's continuity counter wraps cleanly when the pattern repeats
+    pattern = list(synthetic_datagrams(8 * 30 * 16))
+    start = time.monotonic()
+    sent = 0
+    while True:
+        now = time.monotonic()
+        if now - start >= seconds:
+            break
+        due = int((now - start) * rate)
+        while sent < due:
+            sock.sendto(pattern[sent % len(pattern)], ("127.0.0.1", port))
+            sent += 1
+        time.sleep(0.0005)
+    sock.close()
+    return sent
+
+
+def benchmark(mbps: float = 60.0, seconds: float = 5.0) -> dict:
+    """Receive a synthetic TS stream from a local sender process and report throughput and CPU"""
+    import multiprocessing
+
+    ingest = UDPIngest(port=0, host="127.0.0.1")
+    if not ingest.start():
+        return {}
+    sender = multiprocessing.Process(target=_send_synthetic, args=(ingest.port, mbps, seconds))
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    sender.start()
+    sender.join()
+    time.sleep(0.2)
+    cpu = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+    ingest.stop()
+    stats = ingest.stats()
+    expected = int(mbps * 1e6 / 8 / (TS_PACKET_SIZE * TS_PACKETS_PER_DATAGRAM) * seconds)
+    return {
+        "target_mbps": mbps,
+        "received_mbps": ingest.bytes * 8 / seconds / 1e6,
+        "datagrams": ingest.datagrams,
+        "expected_datagrams": expected,
+        "datagram_loss": max(0, expected - ingest.datagrams) / expected if expected else 0.0,
+        "cc_errors": stats["cc_errors"],
+        "keyframes": stats["keyframes"],
+        "cpu_percent": 100.0 * cpu / wall,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Benchmark the UDP MPEG-TS ingest against a local sender")
+    parser.add_argument("--mbps", type=float, default=60.0)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.mbps, args.seconds), indent=2))
@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from metrics import LatencyHistogram
+
+# Keep-alive -> gpStream restart -> pipeline restart, each given this long to bring packets back
+ESCALATION = (("keep_alive", 0.5), ("restart_stream", 3.0), ("restart_pipeline", 5.0))
+RECOVERY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0, 30.0)
+
+
+class StreamWatchdog:
+    """Detects a stalled camera stream and recovers it with the cheapest action that works.
+
+    The stream counts as stalled once no datagram has arrived for stall_ms. Recovery
+    first re-sends the keep-alive, then asks the camera for a gpStream restart, then
+    restarts the local pipeline (ingest socket and every sink), moving on when an
+    action doesn't bring packets back within its wait. Sinks are restarted in place,
+    so they stay attached and HLS viewers and frame-tap consumers carry on. If every
+    step fails the ladder is retried after retry_interval.
+
+    Decoding sinks that die (e.g. ffmpeg exits) or produce no output for output_stall
+    seconds while packets are flowing are restarted on their own, at most
+    max_sink_restarts times per minute each.
+
+    `actions` maps each escalation step to a callable; recovery times (last packet
+    before the stall to first packet after) go into the `recovery` histogram.
+    """
+
+    def __init__(self, ingest: Callable[[], Optional[object]], sinks: Callable[[], Dict[str, object]],
+                 actions: Dict[str, Callable[[], object]], restart_sink: Callable[[str], bool],
+                 stall_ms: int = 1000, output_stall: float = 5.0, retry_interval: float = 5.0,
+                 max_sink_restarts: int = 3, escalation: Tuple[Tuple[str, float], ...] = ESCALATION):
+        self.ingest = ingest
+        self.sinks = sinks
+        self.actions = actions
+        self.restart_sink = restart_sink
+        self.stall_ms = stall_ms
+        self.output_stall = output_stall
+        self.retry_interval = retry_interval
+        self.max_sink_restarts = max_sink_restarts
+        self.escalation = escalation
+        self.state = "idle"
+        self.stalls = 0
+        self.failures = 0
+        self.recovered_by: Dict[str, int] = {action: 0 for action, _ in escalation}
+        self.sink_restarts: Dict[str, int] = {}
+        self.last_recovery: Optional[float] = None
+        self.recovery = LatencyHistogram(RECOVERY_BUCKETS)
+        self._sink_restart_times: Dict[str, Deque[float]] = {}
+        self._sink_started: Dict[str, float] = {}
+        self._wake = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._wake.clear()
+        self.state = "ok"
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        self._thread = None
+        self.state = "idle"
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def _sleep(self, seconds: float) -> bool:
+        """Wait, returning False as soon as the watchdog is stopped"""
+        self._wake.wait(seconds)
+        return self._running
+
+    def _run(self):
+        check = min(0.1, self.stall_ms / 4000)
+        while self._sleep(check):
+            ingest = self.ingest()
+            if ingest is None:
+                continue
+            last = ingest.last_packet_at or ingest.started_at
+            if last is not None and time.monotonic() - last > self.stall_ms / 1000:
+                self._recover(ingest, last)
+            else:
+                self._check_sinks()
+
+    def _recover(self, ingest, last_packet: float):
+        self.stalls += 1
+        print(f"Stream stalled: no packets for {time.monotonic() - last_packet:.2f}s")
+        while self._running:
+            for action, wait in self.escalation:
+                self.state = action
+                since = time.monotonic()
+                try:
+                    self.actions[action]()
+                except Exception as e:
+                    print(f"Watchdog {action} failed: {e}")
+                ingest = self.ingest() or ingest
+                if self._wait_for_packet(ingest, since, wait):
+                    recovery = ingest.last_packet_at - last_packet
+                    self.recovered_by[action] += 1
+                    self.recovery.observe(recovery)
+                    self.last_recovery = recovery
+                    self.state = "ok"
+                    print(f"Stream recovered by {action} after {recovery:.2f}s")
+                    return
+                if not self._running:
+                    return
+            self.failures += 1
+            self.state = "failed"
+            print(f"Stream recovery failed; retrying in {self.retry_interval:.0f}s")
+            if not self._sleep(self.retry_interval):
+                return
+
+    def _wait_for_packet(self, ingest, since: float, timeout: float) -> bool:
+        deadline = since + timeout
+        while self._running:
+            if ingest.last_packet_at is not None and ingest.last_packet_at > since:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if ingest.running:
+                ingest.wait(ingest.write_seq, min(remaining, 0.1))
+            else:
+                self._sleep(min(remaining, 0.1))
+        return False
+
+    def _check_sinks(self):
+        now = time.monotonic()
+        for name, sink in list(self.sinks().items()):
+            started = self._sink_started.setdefault(name, now)
+            if sink.running:
+                last_output = max(sink.last_output_at or 0.0, started)
+                if sink.last_output_at is None or now - last_output <= self.output_stall:
+                    continue
+                reason = f"no output for {now - last_output:.1f}s"
+            else:
+                reason = sink.error or "stopped"
+            times = self._sink_restart_times.setdefault(name, deque())
+            while times and now - times[0] > 60.0:
+                times.popleft()
+            if len(times) >= self.max_sink_restarts:
+                continue
+            times.append(now)
+            self._sink_started[name] = now
+            self.sink_restarts[name] = self.sink_restarts.get(name, 0) + 1
+            print(f"Restarting {name} sink: {reason}")
+            self.restart_sink(name)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "stall_ms": self.stall_ms,
+            "stalls": self.stalls,
+            "failures": self.failures,
+            "recovered_by": dict(self.recovered_by),
+            "sink_restarts": dict(self.sink_restarts),
+            "last_recovery": self.last_recovery,
+            "recovery_p95": self.recovery.percentile(95),
+        }
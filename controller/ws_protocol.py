@@ -0,0 +1,100 @@
+import base64
+import hashlib
+import struct
+from typing import Optional, Tuple
+
+# RFC 6455
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+def accept_key(key: str) -> str:
+    """Sec-WebSocket-Accept for a client's Sec-WebSocket-Key"""
+    return base64.b64encode(hashlib.sha1((key.strip() + GUID).encode("ascii")).digest()).decode("ascii")
+
+
+def handshake(handler) -> bool:
+    """Answer a BaseHTTPRequestHandler's GET with 101 Switching Protocols; False if it isn't an upgrade"""
+    headers = handler.headers
+    key = headers.get("Sec-WebSocket-Key")
+    if headers.get("Upgrade", "").lower() != "websocket" or not key or \
+            "upgrade" not in headers.get("Connection", "").lower():
+        handler.send_error(400, "Expected a WebSocket upgrade")
+        return False
+    if headers.get("Sec-WebSocket-Version") != "13":
+        handler.send_response(426)
+        handler.send_header("Sec-WebSocket-Version", "13")
+        handler.send_header("Content-Length", "0")
+        handler.end_headers()
+        return False
+    handler.send_response(101, "Switching Protocols")
+    handler.send_header("Upgrade", "websocket")
+    handler.send_header("Connection", "Upgrade")
+    handler.send_header("Sec-WebSocket-Accept", accept_key(key))
+    handler.end_headers()
+    handler.wfile.flush()
+    handler.close_connection = True
+    return True
+
+
+def encode_frame(payload: bytes, opcode: int = OP_BINARY) -> bytes:
+    """One unfragmented, unmasked (server to client) frame"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def _read_exact(rfile, count: int) -> Optional[bytes]:
+    data = rfile.read(count)
+    return data if len(data) == count else None
+
+
+def read_frame(rfile, max_size: int = 64 * 1024) -> Optional[Tuple[int, bool, bytes]]:
+    """(opcode, fin, payload) of the next client frame, unmasked; None when the connection closes.
+
+    Raises ValueError for frames a client must not send (unmasked or oversized).
+    """
+    header = _read_exact(rfile, 2)
+    if header is None:
+        return None
+    fin = bool(header[0] & 0x80)
+    opcode = header[0] & 0x0F
+    masked = header[1] & 0x80
+    length = header[1] & 0x7F
+    if length == 126:
+        extended = _read_exact(rfile, 2)
+        if extended is None:
+            return None
+        length = struct.unpack(">H", extended)[0]
+    elif length == 127:
+        extended = _read_exact(rfile, 8)
+        if extended is None:
+            return None
+        length = struct.unpack(">Q", extended)[0]
+    if not masked:
+        raise ValueError("client frames must be masked")
+    if length > max_size:
+        raise ValueError(f"frame of {length} bytes exceeds {max_size}")
+    mask = _read_exact(rfile, 4)
+    payload = _read_exact(rfile, length) if length else b""
+    if mask is None or payload is None:
+        return None
+    if length:
+        # XOR with the repeated 4-byte key, as one big integer rather than byte by byte
+        key = (mask * (length // 4 + 1))[:length]
+        payload = (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(length, "big")
+    return opcode, fin, payload
+
+
+def close_payload(code: int = 1000, reason: str = "") -> bytes:
+    return struct.pack(">H", code) + reason.encode("utf-8")[:123]